@@ -1,15 +1,16 @@
-import datetime
-import difflib
+from base64 import b64decode
 import json
 import os
 import re
 import sys
-import base64
-from configparser import ConfigParser, NoSectionError
 from urllib.parse import urlparse
 from py_common.deps import ensure_requirements
 from py_common import graphql
+from py_common import http
+from py_common import images
+from py_common import match
 from py_common import log
+from py_common import tokens
 from py_common.config import get_config
 
 ensure_requirements("bs4:beautifulsoup4", "requests")
@@ -22,9 +23,6 @@
 #
 
 config = get_config(default="""
-# File to store the Algolia API key.
-STOCKAGE_FILE_APIKEY = Algolia.ini
-
 # Extra tag that will be added to the scene
 FIXED_TAG =
 
@@ -202,7 +200,7 @@ def send_request(url: str, head: dict, send_json="") -> requests.Response:
     """
     log.debug(f"Request URL: {url}")
     try:
-        response = requests.post(url, headers=head, json=send_json, timeout=10)
+        response = http.post(url, headers=head, json=send_json, timeout=10)
     except requests.RequestException as req_error:
         log.warning(f"Requests failed: {req_error}")
         return None
@@ -215,20 +213,28 @@ def send_request(url: str, head: dict, send_json="") -> requests.Response:
 
 
 # API Authentification
-def apikey_get(site_url, time):
+def apikey_get(site_url):
     req = send_request(site_url, HEADERS)
     if req is None:
-        return None, None
+        return None
     script_html = fetch_page_json(req.text)
     if script_html is not None:
         app_id = script_html['api']['algolia']['applicationID']
         algolia_api_key = script_html['api']['algolia']['apiKey']
-        # Write key into a file
-        write_config(time, app_id, algolia_api_key)
         log.info(f"New API keys: {algolia_api_key}")
-        return app_id, algolia_api_key
+        return tokens.Token([app_id, algolia_api_key], apikey_valid_until(algolia_api_key))
     log.error(f"Can't retrieve Algolia API keys from page ({site_url})")
-    return None, None
+    return None
+
+
+def apikey_valid_until(api_key):
+    # Secured API keys embed their expiry as a query string
+    try:
+        if valid_until := re.search(r"validUntil=(\d+)", b64decode(api_key).decode('utf-8')):
+            return int(valid_until.group(1))
+    except Exception as e:
+        log.debug(f"Could not extract validUntil from api_key: {e}")
+    return None
 
 
 def fetch_page_json(page_html):
@@ -236,43 +242,6 @@ def fetch_page_json(page_html):
     return None if len(matches) == 0 else json.loads(matches[0])
 
 
-def check_config(domain, time):
-    if os.path.isfile(config.STOCKAGE_FILE_APIKEY):
-        parser = ConfigParser()
-        parser.read(config.STOCKAGE_FILE_APIKEY)
-        try:
-            time_past = datetime.datetime.strptime(parser.get(domain, 'date'),
-                                                   '%Y-%m-%d %H:%M:%S.%f')
-
-            if time_past.hour - 1 < time.hour < time_past.hour + 1 and (
-                    time - time_past).days == 0:
-                log.debug("Using old key")
-                application_id = parser.get(domain, 'app_id')
-                api_key = parser.get(domain, 'api_key')
-                return application_id, api_key
-            log.info(
-                f"Need new api key: [{time.hour}|{time_past.hour}|{(time-time_past).days}]"
-            )
-        except NoSectionError:
-            pass
-    return None, None
-
-
-def write_config(date, app_id, api_key):
-    log.debug("Writing config!")
-    parser = ConfigParser()
-    parser.read(config.STOCKAGE_FILE_APIKEY)
-    try:
-        parser.get(SITE, 'date')
-    except NoSectionError:
-        parser.add_section(SITE)
-    parser.set(SITE, 'date', date.strftime("%Y-%m-%d %H:%M:%S.%f"))
-    parser.set(SITE, 'app_id', app_id)
-    parser.set(SITE, 'api_key', api_key)
-    with open(config.STOCKAGE_FILE_APIKEY, 'w', encoding='utf-8') as configfile:
-        parser.write(configfile)
-
-
 # API Search Data
 def api_search_req(type_search, query, url):
     api_request = None
@@ -490,13 +459,11 @@ def match_result(api_scene, range_duration=60, single=False, clip_id: str=None):
 
     # Matching ratio
     if SCENE_TITLE:
-        match_ratio_title = difflib.SequenceMatcher(None, SCENE_TITLE.lower(),
-                                                    api_title.lower()).ratio()
+        match_ratio_title = match.ratio(SCENE_TITLE, api_title)
     else:
         match_ratio_title = 0
     if url_title and api_scene.get("url_title"):
-        match_ratio_title_url = difflib.SequenceMatcher(
-            None, url_title.lower(), api_scene["url_title"].lower()).ratio()
+        match_ratio_title_url = match.ratio(url_title, api_scene["url_title"])
     else:
         match_ratio_title_url = 0
 
@@ -584,16 +551,17 @@ def parse_movie_json(movie_json: dict) -> dict:
         date_by_studio = studios_movie_dates[studio_name]
     scrape["date"] = movie_json[0].get(date_by_studio)
 
-    front_img_req = requests.get(f"https://transform.gammacdn.com/movies{movie[0].get('cover_path')}_front_400x625.jpg?width=450&height=636")
-    if front_img_req.ok:
-        scrape["front_image"] = front_img_req.url
+    front_image_url = f"https://transform.gammacdn.com/movies{movie[0].get('cover_path')}_front_400x625.jpg?width=450&height=636"
+    back_image_url = f"https://transform.gammacdn.com/movies{movie[0].get('cover_path')}_back_400x625.jpg?width=450&height=636"
+    front_image, back_image = images.fetch_many([front_image_url, back_image_url])
+    if front_image is not None:
+        scrape["front_image"] = front_image_url
 
-    back_img_req = requests.get(f"https://transform.gammacdn.com/movies{movie[0].get('cover_path')}_back_400x625.jpg?width=450&height=636")
-    if back_img_req.ok:
-        if base64.b64encode(front_img_req.content) == base64.b64encode(back_img_req.content):
+    if back_image is not None:
+        if front_image == back_image:
             log.debug("back_image same as front_image")
         else:
-            scrape["back_image"] = back_img_req.url
+            scrape["back_image"] = back_image_url
 
     directors = []
     if movie_json[0].get('directors') is not None:
@@ -870,16 +838,13 @@ def parse_gallery_json(gallery_json: dict, url: str = None) -> dict:
 # log.trace(f"fragment: {FRAGMENT}")
 
 # ACCESS API
-# Check existing API keys
-CURRENT_TIME = datetime.datetime.now()
-application_id, api_key = check_config(SITE, CURRENT_TIME)
-# Getting new key
-if application_id is None:
-    application_id, api_key = apikey_get(f"https://www.{SITE}.com/en",
-                                         CURRENT_TIME)
+# API keys are shared with AlgoliaAPI and only fetched again once they expire
+api_auth = tokens.get("algolia", SITE, lambda: apikey_get(f"https://www.{SITE}.com/en"),
+                      ttl=60 * 60)
 # Failed to get new key
-if application_id is None:
+if api_auth is None:
     sys.exit(1)
+application_id, api_key = api_auth
 api_url = f"https://tsmkfa364q-dsn.algolia.net/1/indexes/*/queries?x-algolia-application-id={application_id}&x-algolia-api-key={api_key}"
 
 #log.debug(HEADERS)
@@ -900,7 +865,7 @@ def parse_gallery_json(gallery_json: dict, url: str = None) -> dict:
 
 if "movie" not in sys.argv and "gallery" not in sys.argv:
     # Get your sqlite database
-    stash_config = graphql.configuration()
+    stash_config = graphql.configuration(fields=["general.databasePath"])
     DB_PATH = None
     if stash_config:
         DB_PATH = stash_config["general"]["databasePath"]
@@ -917,7 +882,9 @@ def parse_gallery_json(gallery_json: dict, url: str = None) -> dict:
     if DB_PATH:
         if SCENE_ID:
             # Get data by GraphQL
-            database_dict = graphql.getScene(SCENE_ID)
+            database_dict = graphql.getScene(
+                SCENE_ID, fields=["files.duration", "files.height", "files.size"]
+            )
             if database_dict is not None:
                 database_dict = database_dict["files"]
             log.debug(f"[DATABASE] Info: {database_dict}")
@@ -1,19 +1,18 @@
 """
 Stash scraper that uses the Algolia API Python client
 """
-from base64 import b64decode, b64encode
-import configparser
+from base64 import b64decode
 from difflib import SequenceMatcher
 import json
 import os
 import re
 import sys
-from time import time
 from typing import Any, Callable, Literal, TypeVar
 from urllib.parse import urlparse
 from zipfile import ZipFile
 
-from py_common import graphql, log
+from py_common import graphql, images, log, tokens
+from py_common.match import Scorer, rank
 from py_common.deps import ensure_requirements
 from py_common.types import ScrapedGallery, ScrapedMovie, ScrapedPerformer, ScrapedScene, ScrapedTag
 from py_common.util import dig, guess_nationality, feet_to_cm, lb_to_kg, is_valid_url, scraper_args
@@ -26,7 +25,6 @@
 
 T = TypeVar('T')
 
-CONFIG_FILE = 'AlgoliaAPI.ini'
 FIXED_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:79.0) Gecko/20100101 Firefox/79.0'
 IMAGE_CDN = "https://images03-fame.gammacdn.com"
 TRANSFORM_IMAGE_CDN = "https://transform.gammacdn.com"
@@ -42,56 +40,17 @@ def headers_for_homepage(homepage: str) -> dict[str, str]:
     "Generates the request headers required for a homepage of a site"
     return { "User-Agent": FIXED_USER_AGENT, "Origin": homepage, "Referer": homepage }
 
-def api_auth_cache_write(site: str, app_id: str, api_key: str):
-    "Saves the API auth (app_id and api_key) to the CONFIG_FILE " \
-    "so that it can be loaded in future runs of this script"
-    config = configparser.ConfigParser()
-    config.read(CONFIG_FILE)
-    try:
-        config.get(site, 'valid_until')
-    except configparser.NoSectionError:
-        config.add_section(site)
-    config.set(site, "app_id", app_id)
-    config.set(site, "api_key", api_key)
-    # set a default valid_until to 24 hours from now
-    valid_until = str(int(time()) + 24 * 60 * 60)
+def api_auth_valid_until(api_key: str) -> int | None:
+    "Extracts the expiry that secured API keys embed as a query string"
     try:
         if match := re.search(r"validUntil=(\d+)", b64decode(api_key).decode('utf-8')):
-            valid_until = match.group(1)
+            return int(match.group(1))
     except Exception as e:
         log.debug(f"Could not extract validUntil from api_key: {e}")
-    config.set(site, "valid_until", valid_until)
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as config_file:
-        config.write(config_file)
-
-def api_auth_cache_read(site: str) -> tuple[str, str] | tuple[None, None]:
-    "Attempts to load a previously obtained set of API auth credentials" \
-    "(`app_id` and `api_key`) for a `site`, if it exists in the" \
-    "CONFIG_FILE and is still valid for a reasonable amount of time"
-    config = configparser.ConfigParser()
-    config.read(CONFIG_FILE)
-    try:
-        valid_until = config.getint(site, 'valid_until')
-        app_id = config.get(site, 'app_id')
-        api_key = config.get(site, 'api_key')
-    except configparser.NoSectionError as e:
-        log.debug(f"Could not find section [{e.section}] in {CONFIG_FILE}")
-        return None, None
-    except configparser.NoOptionError as e:
-        log.debug(f"Could not find option {e.option} in [{e.section}] in {CONFIG_FILE}")
-        return None, None
-    seconds_remaining = valid_until - int(time())
-    if seconds_remaining < 600:
-        return None, None
-    log.debug(f'Using cached auth, valid for the next {seconds_remaining} seconds')
-    return app_id, api_key
+    return None
 
-def get_api_auth(site: str) -> tuple[str, str]:
-    "Gets the API auth (`app_id` and `api_key`) for a `site`, either from previously cached in" \
-    "CONFIG_FILE, or retrieved from the site's homepage"
-    # attempt to get cached API auth
-    if (auth := api_auth_cache_read(site)) and auth[0] and auth[1]:
-        return auth
+def fetch_api_auth(site: str) -> tokens.Token:
+    "Retrieves the API auth (`app_id` and `api_key`) from the site's homepage"
     log.debug('No valid auth found in cache, fetching new auth')
     # make a request to the site's homepage to get API Key and Application ID
     homepage = homepage_url(site)
@@ -112,7 +71,17 @@ def get_api_auth(site: str) -> tuple[str, str]:
         log.debug(f'Homepage content: {r.text}')
         sys.exit(1)
     log.debug(f'Fetched API auth: app_id={app_id}, api_key={api_key}')
-    api_auth_cache_write(site, app_id, api_key)
+    return tokens.Token([app_id, api_key], api_auth_valid_until(api_key))
+
+def get_api_auth(site: str) -> tuple[str, str]:
+    "Gets the API auth (`app_id` and `api_key`) for a `site`, either from the shared token" \
+    "store, or retrieved from the site's homepage"
+    # keys without a validUntil are assumed to be valid for 24 hours
+    auth = tokens.get("algolia", site, lambda: fetch_api_auth(site), ttl=24 * 60 * 60)
+    if not auth:
+        log.error(f'Failed to get API auth for {site}')
+        sys.exit(1)
+    app_id, api_key = auth
     return app_id, api_key
 
 def homepage_url(site: str) -> str:
@@ -330,59 +299,38 @@ def actors_to_performers(actors: list[dict[str, Any]], site: str) -> list[Scrape
         for actor in actors
     ]
 
-def scalar_match(scalar_candidate: int | float, scalar_reference: int | float) -> float:
-    "Calculates a ratio match of two scalar values, e.g. seconds, bytes, etc."
-    return 1 - abs(scalar_candidate - scalar_reference) / scalar_reference
-
-def add_scene_match_metadata(
-    api_scene: dict[str, Any],
-    fragment: dict[str, Any] | None,
-) -> dict[str, Any]:
-    "Adds match ratio metadata"
-    if fragment:
-        api_scene["__match_metadata"] = {}
-        if fragment_title := fragment.get("title"):
-            api_scene["__match_metadata"]["title"] = SequenceMatcher(
-                None, fragment_title.lower(), api_scene.get("title").lower()
-            ).ratio()
-        if fragment_date := fragment.get("date"):
-            api_scene["__match_metadata"]["date"] = SequenceMatcher(
-                None, fragment_date, api_scene.get("release_date")
-            ).ratio()
-        if (
-            (fragment_director := fragment.get("director"))
-            and (api_scene_directors := api_scene.get("directors"))
-        ):
-            api_scene["__match_metadata"]["director"] = SequenceMatcher(
-                None, fragment_director, name_values_as_csv(api_scene_directors)
-            ).ratio()
-        if (
-            (fragment_details := fragment.get("details"))
-            and (api_scene_description := api_scene.get("description"))
-        ):
-            api_scene["__match_metadata"]["details"] = SequenceMatcher(
-                None, fragment_details, clean_text(api_scene_description)
-            ).ratio()
-        if fragment_files := fragment.get("files"):
-            if api_scene_length := api_scene.get("length"):
-                api_scene["__match_metadata"]["duration"] = scalar_match(
-                    fragment_files[0]["duration"], api_scene_length
-                )
-            if (
-                (api_scene_video_formats := api_scene.get("video_formats"))
-                and (api_scene_size := next(iter([
-                    video_format for video_format in api_scene_video_formats
-                    if video_format.get("format") == f'{fragment_files[0]["height"]}p'
-                ]), {}).get("size"))
-            ):
-                api_scene["__match_metadata"]["size"] = scalar_match(
-                    fragment_files[0]["size"], int(api_scene_size)
-                )
-        log.debug(
-            f"API scene title: {api_scene.get('title')}, "
-            f"__match_metadata: {api_scene['__match_metadata']}"
-        )
-    return api_scene
+def case_sensitive(reference: str | None) -> Scorer | None:
+    "Scores candidates against the reference without ignoring case"
+    return Scorer(reference, case_sensitive=True) if reference else None
+
+def scene_match_fields(fragment: dict[str, Any]) -> dict[str, tuple[Any, Callable]]:
+    "Fields of API scenes to compare with the fragment, for match.rank"
+    fragment_file = (fragment.get("files") or [{}])[0]
+
+    def size(api_scene: dict[str, Any]) -> int | None:
+        height = f'{fragment_file.get("height")}p'
+        for video_format in api_scene.get("video_formats") or []:
+            if video_format.get("format") == height and video_format.get("size"):
+                return int(video_format["size"])
+        return None
+
+    return {
+        "title": (fragment.get("title"), lambda api_scene: api_scene.get("title")),
+        "date": (
+            case_sensitive(fragment.get("date")),
+            lambda api_scene: api_scene.get("release_date"),
+        ),
+        "director": (
+            case_sensitive(fragment.get("director")),
+            lambda api_scene: name_values_as_csv(api_scene.get("directors") or []),
+        ),
+        "details": (
+            case_sensitive(fragment.get("details")),
+            lambda api_scene: clean_text(api_scene.get("description") or ""),
+        ),
+        "duration": (fragment_file.get("duration"), lambda api_scene: api_scene.get("length") or None),
+        "size": (fragment_file.get("size"), size),
+    }
 
 def sort_api_scenes_by_match(
     api_scenes: list[dict[str, Any]],
@@ -391,14 +339,14 @@ def sort_api_scenes_by_match(
     "Sorts the list of API scenes by the closeness match(es) to fragment key-values"
     log.debug(f'Evaluating API scenes closeness match score, with fragment: {fragment}')
     if fragment:
-        return sorted(
-            [add_scene_match_metadata(api_scene, fragment) for api_scene in api_scenes],
-            key=lambda api_scene: sum(
-                                        api_scene.get("__match_metadata").values()
-                                    ) / len(api_scene.get("__match_metadata"))
-                                    if api_scene.get("__match_metadata").values() else 0,
-            reverse=True,
-        )
+        ranked = rank(api_scenes, scene_match_fields(fragment))
+        for api_scene, _, scores in ranked:
+            api_scene["__match_metadata"] = scores
+            log.debug(
+                f"API scene title: {api_scene.get('title')}, "
+                f"__match_metadata: {scores}"
+            )
+        return [api_scene for api_scene, _, _ in ranked]
     return api_scenes
 
 def api_scene_from_id(
@@ -593,9 +541,10 @@ def movie_cover_image_urls(
         back_image_url = movie_cover_image_url(cover_path, 'back')
         if is_valid_url(back_image_url):
             headers = headers_for_homepage(homepage_url(site))
-            res_front = requests.get(front_image_url, headers=headers, timeout=10)
-            res_back = requests.get(back_image_url, headers=headers, timeout=10)
-            if back_is_duplicate := b64encode(res_front.content) == b64encode(res_back.content):
+            front_image, back_image = images.fetch_many(
+                [front_image_url, back_image_url], headers=headers, timeout=10
+            )
+            if back_is_duplicate := front_image == back_image:
                 log.debug("Front and Back images identical, NOT scraping back image")
     return (
         front_image_url if is_valid_url(front_image_url) else None,
@@ -749,62 +698,30 @@ def scene_search(
             ]
     return []
 
-def add_photoset_match_metadata(
-    api_photoset: dict[str, Any],
-    fragment: dict[str, Any] | None,
+def photoset_match_fields(
+    fragment: dict[str, Any],
     db_gallery_file_count: int | None,
-) -> dict[str, Any]:
-    "Adds match ratio metadata"
-    if fragment:
-        api_photoset["__match_metadata"] = {}
-        if fragment_title := fragment.get("title"):
-            api_photoset["__match_metadata"]["title"] = SequenceMatcher(
-                None,
-                fragment_title.lower(),
-                api_photoset.get("title").lower()
-            ).ratio()
-        if fragment_date := fragment.get("date"):
-            api_photoset["__match_metadata"]["date"] = SequenceMatcher(
-                None,
-                fragment_date,
-                api_photoset.get("date_online")
-            ).ratio()
-        if (
-            (fragment_photographer := fragment.get("photographer"))
-            and (api_photoset_directors := api_photoset.get("directors"))
-        ):
-            api_photoset["__match_metadata"]["director"] = SequenceMatcher(
-                None,
-                fragment_photographer,
-                name_values_as_csv(api_photoset_directors)
-            ).ratio()
-        if (
-            (fragment_details := fragment.get("details"))
-            and (api_photoset_description := api_photoset.get("description"))
-        ):
-            api_photoset["__match_metadata"]["details"] = SequenceMatcher(
-                None,
-                fragment_details,
-                clean_text(api_photoset_description)
-            ).ratio()
-        if (
-            db_gallery_file_count
-            and (api_photoset_num_of_pictures := api_photoset.get("num_of_pictures"))
-            and int(api_photoset_num_of_pictures) != 0
-        ):
-            log.debug(
-                f"db_gallery_file_count: ({type(db_gallery_file_count)}): {db_gallery_file_count}, "
-                f"api_photoset_num_of_pictures: ({type(api_photoset_num_of_pictures)}): "
-                f"{api_photoset_num_of_pictures}"
-            )
-            api_photoset["__match_metadata"]["num_of_pictures"] = scalar_match(
-                db_gallery_file_count, int(api_photoset_num_of_pictures)
-            )
-        log.debug(
-            f"name: {api_photoset.get('title')}, "
-            f"__match_metadata: {api_photoset['__match_metadata']}"
-        )
-    return api_photoset
+) -> dict[str, tuple[Any, Callable]]:
+    "Fields of API photosets to compare with the fragment, for match.rank"
+    return {
+        "title": (fragment.get("title"), lambda api_photoset: api_photoset.get("title")),
+        "date": (
+            case_sensitive(fragment.get("date")),
+            lambda api_photoset: api_photoset.get("date_online"),
+        ),
+        "director": (
+            case_sensitive(fragment.get("photographer")),
+            lambda api_photoset: name_values_as_csv(api_photoset.get("directors") or []),
+        ),
+        "details": (
+            case_sensitive(fragment.get("details")),
+            lambda api_photoset: clean_text(api_photoset.get("description") or ""),
+        ),
+        "num_of_pictures": (
+            db_gallery_file_count or None,
+            lambda api_photoset: int(api_photoset.get("num_of_pictures") or 0) or None,
+        ),
+    }
 
 def sort_api_photosets_by_match(
     api_photosets: list[dict[str, Any]],
@@ -824,17 +741,14 @@ def sort_api_photosets_by_match(
                 with ZipFile(db_gallery_path, 'r') as zip_gallery:
                     db_gallery_file_count = len(zip_gallery.namelist())
         log.debug(f"db_gallery_file_count: {db_gallery_file_count}")
-        return sorted(
-            [
-                add_photoset_match_metadata(api_photoset, fragment, db_gallery_file_count)
-                for api_photoset in api_photosets
-            ],
-            key=lambda api_photoset: sum(
-                                        api_photoset.get("__match_metadata").values()
-                                    ) / len(api_photoset.get("__match_metadata"))
-                                    if api_photoset.get("__match_metadata").values() else 0,
-            reverse=True,
-        )
+        ranked = rank(api_photosets, photoset_match_fields(fragment, db_gallery_file_count))
+        for api_photoset, _, scores in ranked:
+            api_photoset["__match_metadata"] = scores
+            log.debug(
+                f"name: {api_photoset.get('title')}, "
+                f"__match_metadata: {scores}"
+            )
+        return [api_photoset for api_photoset, _, _ in ranked]
     return api_photosets
 
 def gallery_search(
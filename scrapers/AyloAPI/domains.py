@@ -1,28 +1,47 @@
-import atexit
 import datetime
 import json
 from pathlib import Path
 from typing import Callable
 from urllib.parse import urlparse
 
+from py_common import tokens
+
 """
 Keeps a cache of instance tokens for the Aylo API.
 
 Domains are assumed to omit the TLD, e.g. "brazzers" instead of "brazzers.com"
 """
 
+PROVIDER = "aylo"
 
+# Instance tokens used to be kept in this file: we import them once
+# so the list of known domains used for searching carries over
 __TOKENS_FILE = Path(__file__).parent / "aylo_tokens.json"
-try:
-    __TOKENS = json.load(__TOKENS_FILE.open(encoding="utf-8"))
-except (FileNotFoundError, json.JSONDecodeError):
-    __TOKENS = {}
+
+# Instance tokens are valid for at least a day
+TOKEN_TTL = 24 * 60 * 60
+
+
+def __import_legacy_tokens():
+    if not __TOKENS_FILE.exists() or tokens.sites(PROVIDER):
+        return
+    try:
+        legacy = json.loads(__TOKENS_FILE.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return
+    today = datetime.date.today()
+    end_of_today = datetime.datetime.combine(
+        today + datetime.timedelta(days=1), datetime.time()
+    ).timestamp()
+    for domain, entry in legacy.items():
+        if not entry.get("token"):
+            continue
+        # Tokens from previous days are kept for their domain but fetched again
+        expires = end_of_today if entry.get("date") == today.isoformat() else 0
+        tokens.put(PROVIDER, domain, entry["token"], expires)
 
 
-@atexit.register
-def __save_domains():
-    sorted_domains = dict(sorted(__TOKENS.items(), key=lambda x: x[0]))
-    json.dump(sorted_domains, __TOKENS_FILE.open("w", encoding="utf-8"), indent=2)
+__import_legacy_tokens()
 
 
 def site_name(url: str) -> str:
@@ -39,24 +58,8 @@ def get_token_for(domain: str, fallback: Callable[[str], str | None]) -> str | N
 
     If the fallback function returns None, it will return None.
     """
-    today = datetime.datetime.today().strftime("%Y-%m-%d")
-
-    # If the domain is in the list and if the token is still valid we just return it
-    if (entry := __TOKENS.get(domain)) and entry["date"] == today and entry["token"]:
-        return entry["token"]
-
-    # Generate the token using the provided fallback function
     url = f"https://www.{domain}.com"
-    token = fallback(url)
-    if not token:
-        return None
-    # And persist it
-    __TOKENS[domain] = {
-        "token": token,
-        "date": today,
-    }
-
-    return token
+    return tokens.get(PROVIDER, domain, lambda: fallback(url), ttl=TOKEN_TTL)
 
 
 def all_domains() -> list[str]:
@@ -64,4 +67,4 @@ def all_domains() -> list[str]:
     Returns a list of all known domains for the Aylo API
     """
 
-    return list(__TOKENS.keys())
+    return tokens.sites(PROVIDER)
@@ -1,14 +1,16 @@
 import json
 import re
 import sys
-import difflib
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from html import unescape
-from typing import Any, Callable
+from typing import Any, Callable, Iterator
 from urllib.parse import urlparse
 
 import py_common.log as log
+from py_common import http, singleflight
+from py_common.match import Scorer
 from py_common.util import dig, guess_nationality, scraper_args
 from py_common.config import get_config
 from py_common.types import (
@@ -33,6 +35,9 @@
 # Minimum similarity ratio to consider a match when searching
 minimum_similarity = 0.75
 
+# How many sites to search at the same time when searching across the network
+concurrent_searches = 8
+
 # Debug mode will save the latest API response to disk
 debug = False
 """
@@ -51,29 +56,24 @@ def partition(pred, iterable):
         t1, t2 = tee(iterable)
         return list(filter(pred, t2)), list(filterfalse(pred, t1))
 
-    from py_common.graphql import callGraphQL
+    from py_common import tag_index
+    from py_common.graphql import callGraphQL, callGraphQLBatch
 
     def format_time(seconds: int) -> str:
         if seconds > 3600:
             return f"{seconds // 3600}:{(seconds // 60) % 60:02}:{seconds % 60:02}"
         return f"{(seconds // 60) % 60}:{seconds % 60:02}"
 
-    raw_tags = callGraphQL("query allTags { allTags { name id aliases } }")
-    if not raw_tags:
-        log.error("Failed to get tags from Stash")
-        return
-
-    tags = {tag["name"].lower(): tag["id"] for tag in raw_tags["allTags"]}
-    tags |= {
-        alias.lower(): tag["id"]
-        for tag in raw_tags["allTags"]
-        for alias in tag["aliases"]
+    # Only the tags we need, from the local index instead of every tag in Stash
+    tags = {
+        name.lower(): tag_id
+        for name, tag_id in tag_index.lookup(m["name"] for m in markers).items()
     }
     existing_markers = callGraphQL(
         "query FindScene($id: ID!){ findScene(id: $id) { scene_markers { title seconds } } }",
         {"id": scene_id},
     )
-    if not existing_markers:
+    if not existing_markers or not existing_markers["findScene"]:
         log.error("Failed to get existing markers from Stash")
         return
 
@@ -86,46 +86,69 @@ def format_time(seconds: int) -> str:
 
     log.debug(f"Adding {len(valid)} out of {len(markers)} markers to scene {scene_id}")
     create_query = "mutation SceneMarkerCreate($input: SceneMarkerCreateInput!) { sceneMarkerCreate(input: $input) {id}}"
+    existing_seconds = {m["seconds"] for m in existing_markers}
+    to_create = []
     for marker in sorted(valid, key=lambda m: m["seconds"]):
         name = marker["name"]
         seconds = marker["seconds"]
-        if any(m["seconds"] == marker["seconds"] for m in existing_markers):
+        if seconds in existing_seconds:
             log.debug(
                 f"Skipping marker '{name}' at {format_time(seconds)} because it already exists"
             )
             continue
-        variables = {
+        to_create.append(marker)
+
+    # All markers are created in a single request
+    variables = [
+        {
             "input": {
-                "title": name,
-                "primary_tag_id": tags[name.lower()],
-                "seconds": int(seconds),
+                "title": marker["name"],
+                "primary_tag_id": tags[marker["name"].lower()],
+                "seconds": int(marker["seconds"]),
                 "scene_id": scene_id,
                 "tag_ids": [],
             }
         }
-        callGraphQL(create_query, variables)
-        log.debug(f"Added marker '{name}' at {format_time(seconds)}")
+        for marker in to_create
+    ]
+    results = callGraphQLBatch([(create_query, v) for v in variables])
+    for marker, result in zip(to_create, results):
+        name = marker["name"]
+        seconds = marker["seconds"]
+        if result and result["sceneMarkerCreate"]:
+            log.debug(f"Added marker '{name}' at {format_time(seconds)}")
+        else:
+            log.error(f"Failed to add marker '{name}' at {format_time(seconds)}")
 
 
 # network stuff
-def __raw_request(url, headers) -> requests.Response:
+def __raw_request(url, headers) -> requests.Response | None:
     log.trace(f"Sending GET request to {url}")
-    response = requests.get(url, headers=headers, timeout=10)
+    # py_common.http already backs off and retries when rate limited,
+    # together with every other scraper that talks to the same host
+    response = http.get(url, headers=headers, timeout=10)
 
     if response.status_code == 429:
         log.error(
             "[REQUEST] 429 Too Many Requests: "
             "you have sent too many requests in a given amount of time."
         )
-        sys.exit(1)
+        return None
 
     # Even a 404 will contain an instance token
     return response
 
 
 def __api_request(url: str, headers: dict) -> dict | None:
-    result = __raw_request(url, headers)
-    api_response = result.json()
+    def fetch():
+        result = __raw_request(url, headers)
+        return result.json() if result is not None else None
+
+    # The tagger often scrapes the same performer for several scenes at once:
+    # only one of those processes sends the request, the others share its response
+    api_response = singleflight.do(f"aylo {headers.get('Origin')} {url}", fetch)
+    if api_response is None:
+        return None
     if isinstance(api_response, list):
         api_search_errors = "\n- ".join(
             json.dumps(res, indent=None) for res in api_response
@@ -165,6 +188,33 @@ def get_instance_token(url: str) -> str | None:
     return api_headers
 
 
+def _search_domains(
+    search_url: str, search_domains: list[str]
+) -> Iterator[tuple[str, list[dict] | None]]:
+    """
+    Sends the same search to every domain concurrently: the results are
+    based on the token used, so each domain searches its own site
+
+    Results are yielded in the order of search_domains so callers can keep
+    their priorities, and searches that have not started yet are cancelled
+    as soon as the caller stops iterating
+    """
+
+    def search(domain: str) -> list[dict] | None:
+        log.debug(f"Searching '{domain}'")
+        api_headers = _create_headers_for(domain)
+        return __api_request(search_url, api_headers)
+
+    workers = max(1, min(config.concurrent_searches, len(search_domains)))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [(domain, executor.submit(search, domain)) for domain in search_domains]
+        for domain, future in futures:
+            yield domain, future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 def _construct_url(api_result: dict) -> str | None:
     """
     Tries to construct a valid public URL for an API result
@@ -585,7 +635,7 @@ def find_scene(
     returning early as soon as it finds a match that exceeds the threshold.
 
     If search_domains is provided it will only search those domains,
-    otherwise it will search all (this could be very slow!)
+    otherwise it will search all known domains concurrently
 
     Domains should not include the "www." or ".com" parts of the domain: 'brazzers', 'realitykings', etc.
 
@@ -596,26 +646,15 @@ def find_scene(
         return None
 
     if not search_domains:
-        log.warning("Searcing all known domains, this could be very slow!")
+        log.info("Searching all known domains")
         search_domains = domains.all_domains()
 
     log.debug(f"Matching '{query}' against {len(search_domains)} sites")
 
-    def matcher(candidate_title: str):
-        return round(
-            difflib.SequenceMatcher(
-                None, query.lower(), candidate_title.lower()
-            ).ratio(),
-            3,
-        )
-
-    for domain in search_domains:
-        log.debug(f"Searching '{domain}'")
-
-        api_headers = _create_headers_for(domain)
-        search_url = f"https://site-api.project1service.com/v2/releases?search={query}&type=scene"
-        api_response = __api_request(search_url, api_headers)
+    matcher = Scorer(query)
 
+    search_url = f"https://site-api.project1service.com/v2/releases?search={query}&type=scene"
+    for domain, api_response in _search_domains(search_url, search_domains):
         if api_response is None:
             log.error(f"Failed to search '{domain}'")
             continue
@@ -623,8 +662,7 @@ def matcher(candidate_title: str):
             log.debug(f"No results from '{domain}'")
             continue
 
-        best_match = max(api_response, key=lambda x: matcher(x["title"]))
-        ratio = matcher(best_match["title"])
+        best_match, ratio = matcher.best(api_response, key=lambda x: x["title"])
         if ratio >= min_ratio:
             log.info(
                 f"Found scene '{best_match['title']}' with {ratio:.2%} similarity "
@@ -661,7 +699,7 @@ def find_performer(
     returning early as soon as it finds a match that exceeds the threshold.
 
     If search_domains is provided it will only search those domains,
-    otherwise it will search all (this could be very slow!)
+    otherwise it will search all known domains concurrently
 
     Domains should not include the "www." or ".com" parts of the domain: 'brazzers', 'realitykings', etc.
 
@@ -672,26 +710,15 @@ def find_performer(
         return None
 
     if not search_domains:
-        log.warning("Searcing all known domains, this could be very slow!")
+        log.info("Searching all known domains")
         search_domains = domains.all_domains()
 
     log.debug(f"Matching '{query}' against {len(search_domains)} sites")
 
-    def matcher(candidate_name: str):
-        return round(
-            difflib.SequenceMatcher(
-                None, query.lower(), candidate_name.lower()
-            ).ratio(),
-            3,
-        )
-
-    for domain in search_domains:
-        log.debug(f"Searching {domain}")
-
-        api_headers = _create_headers_for(domain)
-        search_url = f"https://site-api.project1service.com/v1/actors?search={query}"
-        api_response = __api_request(search_url, api_headers)
+    matcher = Scorer(query)
 
+    search_url = f"https://site-api.project1service.com/v1/actors?search={query}"
+    for domain, api_response in _search_domains(search_url, search_domains):
         if api_response is None:
             log.error(f"Failed to search {domain}")
             continue
@@ -699,8 +726,7 @@ def matcher(candidate_name: str):
             log.debug(f"No results from {domain}")
             continue
 
-        best_match = max(api_response, key=lambda x: matcher(x["name"]))
-        ratio = matcher(best_match["name"])
+        best_match, ratio = matcher.best(api_response, key=lambda x: x["name"])
         if ratio >= min_ratio:
             log.info(
                 f"Found performer '{best_match['name']}' with {ratio:.2%} similarity "
@@ -727,7 +753,7 @@ def scene_search(
     Searches the Aylo API for the given query and returns a list of ScrapedScene
 
     If search_domains is provided it will only search those domains,
-    otherwise it will search all known domains (this could be very slow!)
+    otherwise it will search all known domains concurrently
 
     Domains should not include the "www." or ".com" parts of the domain: 'brazzers', 'realitykings', etc.
 
@@ -738,7 +764,7 @@ def scene_search(
         return []
 
     if not search_domains:
-        log.warning("Searcing all known domains, this could be very slow!")
+        log.info("Searching all known domains")
         search_domains = domains.all_domains()
 
     log.debug(f"Searching for '{query}' on {len(search_domains)} sites")
@@ -748,21 +774,12 @@ def scene_search(
     search_results = []
     already_seen = set()
 
-    def matcher(candidate: ScrapedScene):
-        return round(
-            difflib.SequenceMatcher(
-                None,
-                query.lower(),
-                candidate["title"].lower(),  # type: ignore (title is always set)
-            ).ratio(),
-            3,
-        )
+    title_scorer = Scorer(query)
 
-    for domain in search_domains:
-        log.debug(f"Searching {domain}")
+    def matcher(candidate: ScrapedScene):
+        return title_scorer(candidate.get("title"))
 
-        api_headers = _create_headers_for(domain)
-        api_response = __api_request(search_url, api_headers)
+    for domain, api_response in _search_domains(search_url, search_domains):
         if api_response is None:
             log.error(f"Failed to search {domain}")
             continue
@@ -803,7 +820,7 @@ def performer_search(
     Searches the Aylo API for the given query and returns a list of ScrapedPerformer
 
     If search_domains is provided it will only search those domains,
-    otherwise it will search all known domains (this could be very slow!)
+    otherwise it will search all known domains concurrently
 
     Domains should not include the "www." or ".com" parts of the domain: 'brazzers', 'realitykings', etc.
 
@@ -814,7 +831,7 @@ def performer_search(
         return []
 
     if not search_domains:
-        log.warning("Searcing all known domains, this could be very slow!")
+        log.info("Searching all known domains")
         search_domains = domains.all_domains()
 
     log.debug(f"Searching for '{query}' on {len(search_domains)} sites")
@@ -826,21 +843,12 @@ def performer_search(
     search_results = []
     already_seen = set()
 
-    def matcher(candidate: ScrapedPerformer):
-        return round(
-            difflib.SequenceMatcher(
-                None,
-                query.lower(),
-                candidate["name"].lower(),  # type: ignore (name is always set)
-            ).ratio(),
-            3,
-        )
+    name_scorer = Scorer(query)
 
-    for domain in search_domains:
-        log.debug(f"Searching {domain}")
+    def matcher(candidate: ScrapedPerformer):
+        return name_scorer(candidate.get("name"))
 
-        api_headers = _create_headers_for(domain)
-        api_response = __api_request(search_url, api_headers)
+    for domain, api_response in _search_domains(search_url, search_domains):
         if api_response is None:
             log.error(f"Failed to search {domain}")
             continue
@@ -882,7 +890,7 @@ def scene_from_fragment(
     - title: the title of the scene
 
     If domains is provided it will only search those domains,
-    otherwise it will search all known domains (this could be very slow!)
+    otherwise it will search all known domains concurrently
 
     If min_ratio is provided _AND_ the fragment contains a title but no URL,
     the search will only return a scene if a match with at least that ratio is found
@@ -926,7 +934,7 @@ def gallery_from_fragment(
     - title: the title of the scene the gallery belongs to
 
     If domains is provided it will only search those domains,
-    otherwise it will search all known domains (this could be very slow!)
+    otherwise it will search all known domains concurrently
 
     If min_ratio is provided _AND_ the fragment contains a title but no URL,
     the search will only return a scene if a match with at least that ratio is found
@@ -964,7 +972,7 @@ def performer_from_fragment(
     - name: the name of the performer
 
     If domains is provided it will only search those domains,
-    otherwise it will search all known domains (this could be very slow!)
+    otherwise it will search all known domains concurrently
 
     If min_ratio is provided _AND_ the fragment contains a title but no URL,
     the search will only return a scene if a match with at least that ratio is found
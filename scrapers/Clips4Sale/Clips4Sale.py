@@ -81,7 +81,7 @@ def normalize_url(url: Optional[str]) -> Optional[str]:
 def get_user_agent() -> str:
     default_ua = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/143.0.0.0 Safari/537.36"
     try:
-        config = configuration()
+        config = configuration(fields=["scraping.scraperUserAgent"])
         if config:
             return dig(config, "scraping", "scraperUserAgent") or default_ua
     except Exception:
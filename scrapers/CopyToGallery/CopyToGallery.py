@@ -112,7 +112,21 @@ def find_galleries(scene_id, scene_path):
 log.debug("FRAGMENT " + str(FRAGMENT))
 SCENE_ID = FRAGMENT.get("id")
 
-scene = graphql.getScene(SCENE_ID)
+scene = graphql.getScene(
+    SCENE_ID,
+    fields=[
+        "urls",
+        "title",
+        "code",
+        "date",
+        "details",
+        "files.path",
+        "galleries.id",
+        "studio.id",
+        "tags.id",
+        "performers.id",
+    ],
+)
 if not scene:
     log.error(f"Scene with id '{SCENE_ID}' not found")
     sys.exit(1)
@@ -187,7 +201,21 @@ def find_images(input):
 
 GALLERY_ID = gallery_ids[0]
 
-gallery = graphql.getGallery(GALLERY_ID)
+gallery = graphql.getGallery(
+    GALLERY_ID,
+    fields=[
+        "title",
+        "code",
+        "date",
+        "details",
+        "photographer",
+        "urls",
+        "studio.id",
+        "tags.id",
+        "performers.id",
+        "performers.gender",
+    ],
+)
 log.debug(gallery)
 if not gallery:
     log.error(f"Gallery with id '{GALLERY_ID}' not found")
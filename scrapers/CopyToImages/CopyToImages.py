@@ -69,7 +69,20 @@ def find_images(input):
 log.debug("FRAGMENT " + str(FRAGMENT))
 GALLERY_ID = FRAGMENT.get("id")
 
-gallery = graphql.getGallery(GALLERY_ID)
+gallery = graphql.getGallery(
+    GALLERY_ID,
+    fields=[
+        "title",
+        "code",
+        "date",
+        "details",
+        "photographer",
+        "urls",
+        "studio.id",
+        "tags.id",
+        "performers.id",
+    ],
+)
 log.debug(gallery)
 if not gallery:
     log.error(f"Gallery with id '{GALLERY_ID}' not found")
@@ -1,7 +1,9 @@
+import atexit
 from datetime import datetime
 import hashlib
 import json
 import os
+import sqlite3
 import sys
 
 from py_common import graphql, log
@@ -23,12 +25,15 @@
     import pyexiv2
 # might fail due to old GLIBC, fall back to exiftool
 except:
-	try:
-		import exiftool
-	except:
-		log.error("You need to install the pyexiv2 or exiftool module.")
-		log.error("If you have pip (normally installed with python), run this command in a terminal (cmd): pip install pyexiv2 exiftool")
-		sys.exit()
+	pyexiv2 = None
+try:
+	import exiftool
+except:
+	exiftool = None
+if pyexiv2 is None and exiftool is None:
+	log.error("You need to install the pyexiv2 or exiftool module.")
+	log.error("If you have pip (normally installed with python), run this command in a terminal (cmd): pip install pyexiv2 exiftool")
+	sys.exit()
 
 details_date_fields = config.details_date_fields if hasattr(config, 'details_date_fields') else False
 details_title_fields = config.details_title_fields if hasattr(config, 'details_title_fields') else False
@@ -39,6 +44,9 @@
 details_upprocessed_fields_ignored = config.details_upprocessed_fields_ignored if hasattr(config, 'details_upprocessed_fields_ignored') else []
 details_upprocessed_fields_unignored = config.details_upprocessed_fields_unignored if hasattr(config, 'details_upprocessed_fields_unignored') else []
 
+metadata_cache = config.metadata_cache if hasattr(config, 'metadata_cache') else True
+METADATA_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metadata-cache.sqlite')
+
 details_ignored_labels = {
 	'ExifTag', 'Orientation', 'PhotometricInterpretation', 'ResolutionUnit', 'Contrast', 'CustomRendered', 'DigitalZoomRatio', 'ExposureBiasValue', 'ExposureMode', 'ExposureProgram', 'ExposureTime', 'ExposureCompensation', 
 	'ColorSpace', 'ComponentsConfiguration', 'CompressedBitsPerPixel', 'ExifVersion', 'FlashpixVersion', 'YCbCrPositioning', 'JPEGInterchangeFormat', 'JPEGInterchangeFormatLength', 'BaselineExposureOffset',
@@ -55,19 +63,117 @@
 details_ignored_labels.difference_update(details_upprocessed_fields_unignored)
 
 
-def process_image(image_path: str):
-	data: dict[str, str] = {}
-	
+_exiftool = None
+_cache = None
+
+
+def _exiftool_worker():
+	# A single exiftool process started with -stay_open serves every file
+	# instead of launching a new Perl interpreter per image
+	global _exiftool
+	if _exiftool is None:
+		_exiftool = exiftool.ExifToolHelper()
+		_exiftool.run()
+		atexit.register(_exiftool.terminate)
+	return _exiftool
+
+
+def _metadata_cache():
+	global _cache
+	if _cache is None:
+		_cache = sqlite3.connect(METADATA_CACHE_PATH, timeout=10)
+		_cache.execute("PRAGMA journal_mode=WAL")
+		_cache.execute("CREATE TABLE IF NOT EXISTS metadata (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, data TEXT)")
+	return _cache
+
+
+def _file_key(image_path: str):
+	stat = os.stat(image_path)
+	return stat.st_size, stat.st_mtime_ns
+
+
+def _cached_metadata(image_paths: list[str]) -> dict[str, dict]:
+	found = {}
 	try:
-		with pyexiv2.Image(image_path) as img:
-			data.update(img.read_exif())
-			data.update(img.read_iptc())
-			data.update(img.read_xmp())
-	except:
-		with exiftool.ExifToolHelper() as et:
-			metadata = et.get_metadata(image_path)
-			log.debug(f"exiftool metadata {metadata}")
-			data.update(metadata[0])
+		cache = _metadata_cache()
+		for image_path in image_paths:
+			row = cache.execute("SELECT size, mtime, data FROM metadata WHERE path = ?", (image_path,)).fetchone()
+			if row and tuple(row[:2]) == _file_key(image_path):
+				found[image_path] = json.loads(row[2])
+	except (OSError, sqlite3.Error, ValueError) as e:
+		log.debug(f"Failed to read metadata cache: {e}")
+	return found
+
+
+def _store_metadata(metadata: dict[str, dict]):
+	try:
+		cache = _metadata_cache()
+		with cache:
+			cache.executemany(
+				"INSERT OR REPLACE INTO metadata (path, size, mtime, data) VALUES (?, ?, ?, ?)",
+				[(image_path, *_file_key(image_path), json.dumps(data)) for image_path, data in metadata.items()]
+			)
+	except (OSError, sqlite3.Error, TypeError, ValueError) as e:
+		log.debug(f"Failed to write metadata cache: {e}")
+
+
+def _exiftool_metadata(image_paths: list[str]):
+	"""
+	Reads the images with exiftool in a single batch, or one at a time if the
+	batch fails so a single unreadable file doesn't cost us the others
+	"""
+	try:
+		return list(zip(image_paths, _exiftool_worker().get_metadata(image_paths)))
+	except exiftool.exceptions.ExifToolExecuteError as e:
+		if len(image_paths) == 1:
+			log.warning(f"exiftool could not read {image_paths[0]}: {e}")
+			return []
+	log.debug("exiftool failed on the batch, reading the images one at a time")
+	return [item for image_path in image_paths for item in _exiftool_metadata([image_path])]
+
+
+def read_metadata(image_paths: list[str]) -> dict[str, dict]:
+	"""
+	Reads the embedded metadata of several images, keyed by path
+
+	Files that did not change since they were last read come from the cache,
+	pyexiv2 is tried for the others and whatever it fails on is sent to
+	exiftool as a single batch: files exiftool can't read are left out
+	"""
+	metadata = _cached_metadata(image_paths) if metadata_cache else {}
+	fresh = {}
+	fallback = []
+
+	for image_path in image_paths:
+		if image_path in metadata:
+			continue
+		if pyexiv2 is None:
+			fallback.append(image_path)
+			continue
+		data = {}
+		try:
+			with pyexiv2.Image(image_path) as img:
+				data.update(img.read_exif())
+				data.update(img.read_iptc())
+				data.update(img.read_xmp())
+			fresh[image_path] = data
+		except:
+			fallback.append(image_path)
+
+	if fallback and exiftool is not None:
+		for image_path, data in _exiftool_metadata(fallback):
+			log.debug(f"exiftool metadata {data}")
+			fresh[image_path] = data
+
+	if metadata_cache and fresh:
+		_store_metadata(fresh)
+	metadata.update(fresh)
+	return metadata
+
+
+def process_image(image_path: str, data: dict | None = None):
+	if data is None:
+		data = read_metadata([image_path]).get(image_path, {})
 
 	ret = {}
 
@@ -395,9 +501,10 @@ def get_imape_paths(image_id):
 		case "image-by-fragment", {"id": image_id} if image_id:
 			files = get_imape_paths(image_id)
 			ret = {}
+			metadata = read_metadata(files)
 	
 			for file in files:
-				data = process_image(file)
+				data = process_image(file, metadata.get(file, {}))
 				ret.update(data)
 			
 			print(json.dumps(ret))
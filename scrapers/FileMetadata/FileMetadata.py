@@ -1,10 +1,15 @@
 import json
+import os
+import struct
 import sys
 import subprocess as sp
 from datetime import datetime
 from urllib.parse import urlparse
 
 from py_common import log
+from py_common.cache import cache_to_disk
+
+from container_tags import UnsupportedContainer, read_tags
 
 
 def parse_url(comment):
@@ -14,7 +19,7 @@ def parse_url(comment):
     return None
 
 
-def scrape_file(path):
+def ffprobe_tags(path):
     video_data = sp.check_output(
         [
             "ffprobe",
@@ -30,9 +35,31 @@ def scrape_file(path):
     )
     if not video_data:
         log.error("Could not scrape video: ffprobe returned null")
+        return None
+
+    return json.loads(video_data).get("format", {}).get("tags", {})
+
+
+# The size and modification time are part of the cache key
+# so files are read again as soon as they change
+@cache_to_disk(ttl=30 * 24 * 60 * 60)
+def file_tags(path, size, mtime):
+    try:
+        # MP4/MOV and MKV/WebM tags are read straight from the headers
+        return read_tags(path)
+    except UnsupportedContainer:
+        pass
+    except (OSError, ValueError, EOFError, IndexError, struct.error) as e:
+        log.debug(f"Could not read tags from the headers of {path}, using ffprobe: {e}")
+    return ffprobe_tags(path)
+
+
+def scrape_file(path):
+    stat = os.stat(path)
+    metadata = file_tags(path, stat.st_size, stat.st_mtime_ns)
+    if metadata is None:
         return
 
-    metadata = json.loads(video_data)["format"]["tags"]
     metadata_insensitive = {key.lower(): metadata[key] for key in metadata}
 
     scene = {}
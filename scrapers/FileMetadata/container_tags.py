@@ -0,0 +1,314 @@
+"""
+Reads container-level tags from MP4/MOV and Matroska/WebM files
+
+Only the headers are read: media data is skipped over with seek, so this stays
+cheap even for large files on network mounts. Tag names follow what ffprobe
+reports in format_tags so the results can be used interchangeably
+"""
+
+from datetime import datetime, timedelta, timezone
+import struct
+from typing import BinaryIO
+
+
+class UnsupportedContainer(ValueError):
+    pass
+
+
+# iTunes-style item list atoms and the names ffprobe gives them
+MP4_TAG_NAMES = {
+    b"\xa9nam": "title",
+    b"\xa9ART": "artist",
+    b"aART": "album_artist",
+    b"\xa9alb": "album",
+    b"\xa9cmt": "comment",
+    b"desc": "description",
+    b"ldes": "synopsis",
+    b"\xa9day": "date",
+    b"\xa9gen": "genre",
+    b"\xa9too": "encoder",
+    b"\xa9wrt": "composer",
+    b"cprt": "copyright",
+    b"\xa9cpy": "copyright",
+    b"\xa9grp": "grouping",
+    b"\xa9lyr": "lyrics",
+    b"tvsh": "show",
+    b"keyw": "keywords",
+}
+
+# Atoms we descend into on the way to the tags
+MP4_CONTAINERS = {b"moov", b"udta", b"meta", b"ilst"}
+
+MP4_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+MKV_EPOCH = datetime(2001, 1, 1, tzinfo=timezone.utc)
+
+EBML_HEADER = 0x1A45DFA3
+MKV_SEGMENT = 0x18538067
+MKV_SEEK_HEAD = 0x114D9B74
+MKV_SEEK = 0x4DBB
+MKV_SEEK_ID = 0x53AB
+MKV_SEEK_POSITION = 0x53AC
+MKV_INFO = 0x1549A966
+MKV_TITLE = 0x7BA9
+MKV_DATE_UTC = 0x4461
+MKV_TAGS = 0x1254C367
+MKV_TAG = 0x7373
+MKV_TARGETS = 0x63C0
+MKV_SIMPLE_TAG = 0x67C8
+MKV_TAG_NAME = 0x45A3
+MKV_TAG_STRING = 0x4487
+MKV_CLUSTER = 0x1F43B675
+# Targets pointing at a track, edition, chapter or attachment are not file-level tags
+MKV_TARGET_UIDS = {0x63C5, 0x63C9, 0x63C4, 0x63C6}
+
+
+def _format_time(time: datetime) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _mp4_atoms(f: BinaryIO, start: int, end: int):
+    """
+    Yields (type, payload start, payload end) for every atom between start and end
+    """
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack(">I4s", header)
+        offset = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            offset = 16
+        elif size == 0:
+            size = end - position
+        if size < offset:
+            raise ValueError(f"Invalid atom size {size} at {position}")
+        yield kind, position + offset, min(position + size, end)
+        position += size
+
+
+def _mp4_text(f: BinaryIO, start: int, end: int) -> str | None:
+    for kind, data_start, data_end in _mp4_atoms(f, start, end):
+        if kind != b"data":
+            continue
+        f.seek(data_start)
+        # 4 bytes of type (1 is UTF-8) followed by 4 bytes of locale
+        data_type = struct.unpack(">I", f.read(4))[0] & 0xFFFFFF
+        f.seek(4, 1)
+        value = f.read(data_end - data_start - 8)
+        if data_type == 1:
+            return value.decode("utf-8", errors="replace")
+        if data_type == 2:
+            return value.decode("utf-16-be", errors="replace")
+    return None
+
+
+def _mp4_tags(f: BinaryIO, start: int, end: int, tags: dict[str, str], path=()):
+    keys: list[str] = []
+    for kind, child_start, child_end in _mp4_atoms(f, start, end):
+        if kind == b"mvhd":
+            f.seek(child_start)
+            version = f.read(4)[0]
+            seconds = struct.unpack(">Q" if version == 1 else ">I", f.read(8 if version == 1 else 4))[0]
+            if seconds:
+                created = MP4_EPOCH + timedelta(seconds=seconds)
+                tags.setdefault("creation_time", _format_time(created))
+        elif kind == b"keys" and path[-1:] == (b"meta",):
+            # QuickTime metadata: item list entries refer to these keys by index
+            f.seek(child_start + 4)
+            (count,) = struct.unpack(">I", f.read(4))
+            position = child_start + 8
+            for _ in range(count):
+                f.seek(position)
+                size, _namespace = struct.unpack(">I4s", f.read(8))
+                keys.append(f.read(size - 8).decode("utf-8", errors="replace"))
+                position += size
+        elif kind == b"meta":
+            # MP4 meta is a full box with 4 bytes of version and flags, QuickTime's isn't
+            f.seek(child_start + 4)
+            is_full_box = f.read(4) != b"hdlr"
+            _mp4_tags(f, child_start + (4 if is_full_box else 0), child_end, tags, (*path, kind))
+        elif kind == b"ilst":
+            for item, item_start, item_end in _mp4_atoms(f, child_start, child_end):
+                if keys and (index := int.from_bytes(item, "big")) and index <= len(keys):
+                    name = keys[index - 1]
+                elif item in MP4_TAG_NAMES:
+                    name = MP4_TAG_NAMES[item]
+                else:
+                    continue
+                if (value := _mp4_text(f, item_start, item_end)) is not None:
+                    tags.setdefault(name, value)
+        elif kind in MP4_CONTAINERS:
+            _mp4_tags(f, child_start, child_end, tags, (*path, kind))
+        elif kind in MP4_TAG_NAMES and path[-1:] == (b"udta",):
+            # QuickTime user data text: 2 bytes of length and 2 bytes of language
+            f.seek(child_start)
+            length = struct.unpack(">H", f.read(2))[0]
+            f.seek(2, 1)
+            value = f.read(min(length, child_end - child_start - 4))
+            tags.setdefault(MP4_TAG_NAMES[kind], value.decode("utf-8", errors="replace"))
+
+
+def read_mp4_tags(f: BinaryIO, size: int) -> dict[str, str]:
+    tags: dict[str, str] = {}
+    for kind, start, end in _mp4_atoms(f, 0, size):
+        # The movie header can come before or after the media data:
+        # either way we seek over mdat without reading it
+        if kind == b"moov":
+            _mp4_tags(f, start, end, tags, (kind,))
+            break
+    return tags
+
+
+def _ebml_vint(f: BinaryIO, keep_marker: bool) -> tuple[int | None, int]:
+    """
+    Reads an EBML variable length integer, returning its value and length
+
+    The value is None for sizes with all bits set, which means unknown
+    """
+    first = f.read(1)
+    if not first:
+        raise EOFError
+    length = 9 - first[0].bit_length()
+    if length > 8:
+        raise ValueError("Invalid EBML variable length integer")
+    data = first + f.read(length - 1)
+    value = int.from_bytes(data, "big")
+    if keep_marker:
+        return value, length
+    value &= (1 << (7 * length)) - 1
+    if value == (1 << (7 * length)) - 1:
+        return None, length
+    return value, length
+
+
+def _ebml_elements(f: BinaryIO, start: int, end: int | None):
+    """
+    Yields (id, data start, data end) for every element between start and end
+    """
+    position = start
+    while end is None or position < end:
+        f.seek(position)
+        try:
+            element_id, id_length = _ebml_vint(f, keep_marker=True)
+            size, size_length = _ebml_vint(f, keep_marker=False)
+        except EOFError:
+            return
+        data_start = position + id_length + size_length
+        data_end = None if size is None else data_start + size
+        yield element_id, data_start, data_end
+        if data_end is None:
+            # Unknown sizes are only used for live streams: nothing we can skip over
+            return
+        position = data_end
+
+
+def _ebml_read(f: BinaryIO, start: int, end: int) -> bytes:
+    f.seek(start)
+    return f.read(end - start)
+
+
+def _mkv_string(f: BinaryIO, start: int, end: int) -> str:
+    return _ebml_read(f, start, end).rstrip(b"\0").decode("utf-8", errors="replace")
+
+
+def _mkv_tags(f: BinaryIO, start: int, end: int, tags: dict[str, str]):
+    for element, tag_start, tag_end in _ebml_elements(f, start, end):
+        if element != MKV_TAG or tag_end is None:
+            continue
+        simple_tags = []
+        file_level = True
+        for child, child_start, child_end in _ebml_elements(f, tag_start, tag_end):
+            if child == MKV_TARGETS:
+                for target, _, _ in _ebml_elements(f, child_start, child_end):
+                    if target in MKV_TARGET_UIDS:
+                        file_level = False
+            elif child == MKV_SIMPLE_TAG:
+                simple_tags.append((child_start, child_end))
+        if not file_level:
+            continue
+        for simple_start, simple_end in simple_tags:
+            name = value = None
+            for field, field_start, field_end in _ebml_elements(f, simple_start, simple_end):
+                if field == MKV_TAG_NAME:
+                    name = _mkv_string(f, field_start, field_end)
+                elif field == MKV_TAG_STRING:
+                    value = _mkv_string(f, field_start, field_end)
+            if name and value is not None:
+                tags.setdefault(name, value)
+
+
+def _mkv_tags_position(f: BinaryIO, start: int, end: int) -> int | None:
+    """
+    Finds the position of the Tags element relative to the segment in a SeekHead
+    """
+    for seek, seek_start, seek_end in _ebml_elements(f, start, end):
+        if seek != MKV_SEEK or seek_end is None:
+            continue
+        seek_id = seek_position = None
+        for field, field_start, field_end in _ebml_elements(f, seek_start, seek_end):
+            if field == MKV_SEEK_ID:
+                seek_id = int.from_bytes(_ebml_read(f, field_start, field_end), "big")
+            elif field == MKV_SEEK_POSITION:
+                seek_position = int.from_bytes(_ebml_read(f, field_start, field_end), "big")
+        if seek_id == MKV_TAGS:
+            return seek_position
+    return None
+
+
+def read_mkv_tags(f: BinaryIO) -> dict[str, str]:
+    tags: dict[str, str] = {}
+    segment = next(
+        ((start, end) for element, start, end in _ebml_elements(f, 0, None) if element == MKV_SEGMENT),
+        None,
+    )
+    if segment is None:
+        raise ValueError("No Matroska segment found")
+
+    segment_start, segment_end = segment
+    tags_position = None
+    for element, start, end in _ebml_elements(f, segment_start, segment_end):
+        if end is None:
+            break
+        if element == MKV_SEEK_HEAD:
+            if (position := _mkv_tags_position(f, start, end)) is not None:
+                tags_position = segment_start + position
+        elif element == MKV_INFO:
+            for field, field_start, field_end in _ebml_elements(f, start, end):
+                if field == MKV_TITLE:
+                    tags.setdefault("title", _mkv_string(f, field_start, field_end))
+                elif field == MKV_DATE_UTC:
+                    nanoseconds = int.from_bytes(_ebml_read(f, field_start, field_end), "big", signed=True)
+                    created = MKV_EPOCH + timedelta(microseconds=nanoseconds // 1000)
+                    tags.setdefault("creation_time", _format_time(created))
+        elif element == MKV_TAGS:
+            _mkv_tags(f, start, end, tags)
+            break
+        elif element == MKV_CLUSTER and tags_position is not None:
+            # Media data starts here: jump straight to the tags the seek head
+            # pointed us to instead of walking over every cluster
+            for element, start, end in _ebml_elements(f, tags_position, None):
+                if element == MKV_TAGS and end is not None:
+                    _mkv_tags(f, start, end, tags)
+                break
+            break
+    return tags
+
+
+def read_tags(path: str) -> dict[str, str]:
+    """
+    Reads the container tags of an MP4/MOV or Matroska/WebM file
+
+    Raises UnsupportedContainer for any other kind of file
+    """
+    with open(path, "rb") as f:
+        head = f.read(12)
+        f.seek(0, 2)
+        size = f.tell()
+        if head[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"wide", b"skip"):
+            return read_mp4_tags(f, size)
+        if int.from_bytes(head[:4], "big") == EBML_HEADER:
+            return read_mkv_tags(f)
+    raise UnsupportedContainer(f"Unsupported container: {path}")
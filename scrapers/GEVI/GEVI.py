@@ -6,6 +6,7 @@
 from bs4 import BeautifulSoup, Tag
 import cloudscraper
 
+from py_common import http_cache
 from py_common.config import get_config
 from py_common.types import ScrapedPerformer, ScrapedScene, ScrapedMovie, ScrapedStudio
 from py_common.util import scraper_args, guess_nationality
@@ -38,6 +39,13 @@ def abs_url(url: str) -> str:
 scraper = cloudscraper.create_scraper()
 scraper.headers.update({"Referer": base_url.netloc})
 
+# Scene, performer and movie pages rarely change once published
+CACHE_TTL = 7 * 24 * 60 * 60
+
+
+def fetch(url: str):
+    return http_cache.get(url, ttl=CACHE_TTL, session=scraper)
+
 
 def parse_name(name: str) -> tuple[str, str | None]:
     "Parses a name and optional disambiguation from a string"
@@ -66,7 +74,7 @@ def from_table(soup: Tag, key: str) -> str | None:
 
 
 def scene_from_url(url: str) -> ScrapedScene | None:
-    res = scraper.get(url)
+    res = fetch(url)
     soup = BeautifulSoup(res.text, "html.parser")
     soup = soup.select("div#data section")
     if not soup:
@@ -120,7 +128,7 @@ def scene_from_fragment(args: dict) -> ScrapedScene | None:
 
 
 def performer_from_url(url: str) -> ScrapedPerformer | None:
-    res = scraper.get(url)
+    res = fetch(url)
     soup = BeautifulSoup(res.text, "html.parser")
     soup = soup.select("div#data section")
     if not soup:
@@ -227,7 +235,7 @@ def performer_search(name: str) -> list[ScrapedPerformer]:
 
 
 def movie_from_url(url: str) -> ScrapedMovie | None:
-    res = scraper.get(url)
+    res = fetch(url)
     soup = BeautifulSoup(res.text, "html.parser")
     movie_section = next(iter(soup.select("section#data section")), None)
     if not movie_section:
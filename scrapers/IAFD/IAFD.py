@@ -1,25 +1,28 @@
 import json
 import random
 import re
-import requests
 import sys
-import time
 from typing import Iterable, Callable, TypeVar
 from datetime import datetime
+from itertools import islice
 
+from py_common import http, images, ratelimit
 from py_common.util import guess_nationality, scraper_args
 import py_common.log as log
 from py_common.deps import ensure_requirements
 
-ensure_requirements("cloudscraper", "lxml")
+ensure_requirements("lxml")
 
-import cloudscraper  # noqa: E402
 from lxml import html  # noqa: E402
 
 stash_date = "%Y-%m-%d"
 iafd_date = "%B %d, %Y"
 iafd_date_scene = "%b %d, %Y"
 
+# IAFD sends no caching headers: keep pages for a day so a tagging session
+# that revisits the same performers and movies does not download them again
+CACHE_TTL = 24 * 60 * 60
+
 T = TypeVar("T")
 
 SHARED_SELECTORS = {
@@ -90,11 +93,10 @@ def clean_alias(alias: str) -> str | None:
     return re.sub(r"\s*\(.*$", "", alias)
 
 
-def base64_image(url) -> str:
-    import base64
-
-    b64img_bytes = base64.b64encode(scraper.get(url).content)
-    return f"data:image/jpeg;base64,{b64img_bytes.decode('utf-8')}"
+def base64_images(urls: list[str]) -> list[str]:
+    # Headshots are fetched concurrently and cached so the same performer
+    # showing up in several scenes is only downloaded once
+    return [image for image in images.data_urls(urls, cloudflare=True) if image]
 
 
 def performer_haircolor(tree):
@@ -328,17 +330,11 @@ def video_url(tree):
     )
 
 
-# Only create a single scraper: this saves time when scraping multiple pages
-# because it doesn't need to get past Cloudflare each time
-scraper = cloudscraper.create_scraper()
-
-
 def scrape(url: str, retries=0):
+    # Requests share a pooled session that retries timeouts on its own
+    # and only falls back to cloudscraper / FlareSolverr when blocked by Cloudflare
     try:
-        scraped = scraper.get(url, timeout=(3, 7))
-    except requests.exceptions.Timeout as exc_time:
-        log.debug(f"Timeout: {exc_time}")
-        return scrape(url, retries + 1)
+        scraped = http.get(url, cloudflare=True, timeout=(3, 7), cache=CACHE_TTL)
     except Exception as e:
         log.error(f"scrape error {e}")
         sys.exit(1)
@@ -346,7 +342,8 @@ def scrape(url: str, retries=0):
         if retries < 10:
             wait_time = random.randint(1, 4)
             log.debug(f"HTTP Error: {scraped.status_code}, waiting {wait_time} seconds")
-            time.sleep(wait_time)
+            # Other IAFD scrapes running at the same time wait as well
+            ratelimit.backoff(url, wait_time)
             return scrape(url, retries + 1)
         log.error(f"HTTP Error: {scraped.status_code}, giving up")
         sys.exit(1)
@@ -402,13 +399,17 @@ def performer_from_tree(tree):
         "tattoos": performer_tattoos(tree),
         "piercings": performer_piercings(tree),
         "eye_color": performer_eyecolor(tree),
-        "images": [
-            base64_image(url) for url in tree.xpath('//div[@id="headshot"]//img/@src')
-        ],
+        "images": base64_images(tree.xpath('//div[@id="headshot"]//img/@src')),
     }
 
 
 def scene_from_tree(tree):
+    cast = tree.xpath('//div[@class="castbox"]/p/a')
+    cast_images = [p.xpath("img/@src") for p in cast]
+    # Fetch every headshot in one go instead of one performer at a time
+    headshots = iter(
+        images.data_urls([url for urls in cast_images for url in urls], cloudflare=True)
+    )
     return {
         "title": scene_title(tree),
         "date": scene_date(tree),
@@ -419,9 +420,9 @@ def scene_from_tree(tree):
             {
                 "name": p.text_content(),
                 "urls": [f"https://www.iafd.com{p.get('href')}"],
-                "images": [base64_image(url) for url in p.xpath("img/@src")],
+                "images": [image for image in islice(headshots, len(urls)) if image],
             }
-            for p in tree.xpath('//div[@class="castbox"]/p/a')
+            for p, urls in zip(cast, cast_images)
         ],
         "urls": [video_url(tree)],
     }
@@ -1,14 +1,14 @@
 """JAVLibrary python scraper"""
-import base64
 import json
 import re
 import sys
 import threading
-import time
+from concurrent.futures import Future
 from urllib.parse import urlparse
 
 try:
-    from py_common import log
+    from py_common import images, log, ratelimit
+    from py_common.cache import cache_to_disk
 except ModuleNotFoundError:
     print("You need to download the folder 'py_common' from the community repo! (CommunityScrapers/tree/master/scrapers/py_common)", file=sys.stderr)
     sys.exit()
@@ -38,6 +38,7 @@
 
 JAV_SEARCH_HTML = None
 JAV_MAIN_HTML = None
+SCENE_CODE = None
 PROTECTION_CLOUDFLARE = False
 
 # Flaresolverr
@@ -86,6 +87,8 @@
 WAIT_FOR_ALIASES = False
 # All javlib sites
 SITE_JAVLIB = ["javlibrary"]
+# Number of seconds movie pages are cached for, by DVD code
+PAGE_CACHE_TTL = 7 * 24 * 60 * 60
 
 BANNED_WORDS = {
     "A******ation": "Asphyxiation",
@@ -420,12 +423,37 @@ class ResponseHTML:
     status_code = 0
     url = ""
 
+
+class PageUnavailable(Exception):
+    pass
+
+
+def submit(func, *args):
+    """
+    Runs func in a background thread and returns a Future for its result
+
+    The thread is a daemon so a task we end up not waiting for
+    never keeps the scraper from exiting
+    """
+    future = Future()
+
+    def run():
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(func(*args))
+            except BaseException as exc:
+                future.set_exception(exc)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
 def bypass_protection(url, retries=4):
     url_domain = re.sub(r"www\.|\.com", "", urlparse(url).netloc)
     log.debug("=== Checking Status of Javlib site ===")
     response_html = ResponseHTML()
     site = "javlibrary"
     url_n = url.replace(url_domain, site)
+    ratelimit.wait(url_n)
     try:
         if FLARESOLVERR_ENABLED:             
             url = FLARESOLVERR_URL
@@ -465,8 +493,8 @@ def bypass_protection(url, retries=4):
         if retries == 4:
             retries = retries - 1
             log.warning(f"Retrying once normally after 7s delay [retries left: {retries}] for site: {site}")
-            time.sleep(7.2)
-            return bypass_protection(url, retries)
+            ratelimit.backoff(url_n, 7.2)
+            return bypass_protection(url_n, retries)
         else:
             return None, None
     if response_html.url == "https://www.javlib.com/maintenance.html":
@@ -485,16 +513,13 @@ def bypass_protection(url, retries=4):
     return None, None
 
 
-def send_request(url, head, retries=0, delay=2.5):
+def send_request(url, head, retries=0):
     if retries > 3:
         log.warning(f"Scrape for {url} failed after retrying {retries} times")
         return None
 
     global JAV_DOMAIN
 
-    if delay != 0:
-        log.info(f"Delaying request by {delay} seconds to prevent Cloudflare rate limiting")
-        time.sleep(delay)
     url_domain = re.sub(r"www\.|\.com", "", urlparse(url).netloc)
     response = None
     if url_domain in SITE_JAVLIB:
@@ -511,6 +536,9 @@ def send_request(url, head, retries=0, delay=2.5):
             return None
         url = url.replace(url_domain, JAV_DOMAIN)
     log.debug(f"[{threading.get_ident()}] Request URL: {url}")
+    # Spaced out to prevent Cloudflare rate limiting,
+    # see host_requests_per_second in py_common/config.ini
+    ratelimit.wait(url)
     try:
         response = requests.get(url, headers=head, timeout=10)
     except requests.exceptions.Timeout as exc_timeout:
@@ -518,10 +546,7 @@ def send_request(url, head, retries=0, delay=2.5):
         return send_request(url, head, retries+1)
     except Exception as exc_req:
         log.error(f"scrape error exception {exc_req}")
-        if delay != 0:
-            error_delay = delay+2.75
-            log.info(f"Delaying request by {error_delay} seconds and retrying")
-            time.sleep(error_delay)
+        ratelimit.backoff(url, attempt=retries)
         return send_request(url, head, retries+1)
     if response.status_code != 200:
         log.debug(f"[Request] Error, Status Code: {response.status_code}")
@@ -690,72 +715,84 @@ def buildlist_tagperf(data, type_scrape=""):
     return list_tmp
 
 
-def th_request_perfpage(page_url, perf_url):
-    # vl_star.php?s=afhvw
-    #log.debug("[DEBUG] Aliases Thread: {}".format(threading.get_ident()))
+def as_response(page):
+    response_html = ResponseHTML()
+    response_html.content = page["content"]
+    response_html.html = page["content"]
+    response_html.status_code = 200
+    response_html.url = page["url"]
+    return response_html
+
+
+def as_page(response_html):
+    content = response_html.content
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", errors="replace")
+    return {"url": response_html.url, "content": content}
+
+
+@cache_to_disk(ttl=PAGE_CACHE_TTL)
+def movie_page(code, language):
+    """
+    Searches for a DVD code and returns the movie page in the given language,
+    which is passed in so pages cached in another language are not reused
+
+    Failures raise instead of returning so they are not cached
+    """
+    search_html = send_request(
+        f"https://www.javlibrary.com/{language}/vl_searchbyid.php?keyword={code}",
+        JAV_HEADERS)
+    if not search_html:
+        raise PageUnavailable(f"Search for {code} failed")
+    main_html = jav_search(search_html, jav_xPath_search)
+    if not main_html:
+        raise PageUnavailable(f"No movie page found for {code}")
+    return as_page(main_html)
+
+
+@cache_to_disk(ttl=PAGE_CACHE_TTL)
+def alias_page(code, page_url):
+    """
+    Gets the Japanese version of the movie page for the performer aliases
+    """
     javlibrary_ja_html = send_request(re.sub(r"/(en|ja|tw|cn)/", "/ja/", page_url),
                                       JAV_HEADERS)
-    if javlibrary_ja_html:
-        javlibrary_perf_ja = lxml.html.fromstring(javlibrary_ja_html.content)
-        list_tmp = []
-        try:
-            for p_v in perf_url:
-                list_tmp.append(
-                    javlibrary_perf_ja.xpath('//a[@href="' + p_v +
-                                             '"]/text()')[0])
-            if list_tmp:
-                jav_result['performer_aliases'] = list_tmp
-                log.debug(f"Got the aliases: {list_tmp}")
-        except:
-            log.debug("Error with the aliases")
-    else:
+    if not javlibrary_ja_html:
+        raise PageUnavailable(f"Japanese page for {code} failed")
+    return as_page(javlibrary_ja_html)
+
+
+def fetch_aliases(code, page_url, perf_url):
+    # vl_star.php?s=afhvw
+    try:
+        javlibrary_ja_html = as_response(alias_page(code, page_url))
+    except PageUnavailable:
         log.debug("Can't get the Jap HTML")
+        return None
+    javlibrary_perf_ja = lxml.html.fromstring(javlibrary_ja_html.content)
+    list_tmp = []
+    try:
+        for p_v in perf_url:
+            list_tmp.append(
+                javlibrary_perf_ja.xpath('//a[@href="' + p_v +
+                                         '"]/text()')[0])
+        if list_tmp:
+            log.debug(f"Got the aliases: {list_tmp}")
+            return list_tmp
+    except:
+        log.debug("Error with the aliases")
+    return None
 
 
-def th_imageto_base64(imageurl, typevar):
-    #log.debug("[DEBUG] {} thread: {}".format(typevar,threading.get_ident()))
-    head = JAV_HEADERS
-    if isinstance(imageurl,list):
-        for image_index, image_url in enumerate(imageurl):
-            try:
-                img = requests.get(image_url.replace(
-                    "ps.jpg", "pl.jpg"),
-                                   timeout=10,
-                                   headers=head)
-                if img.status_code != 200:
-                    log.debug(
-                        "[Image] Got a bad request (status: "\
-                        f"{img.status_code}) for <{image_url}>"
-                    )
-                    imageurl[image_index] = None
-                    continue
-                base64image = base64.b64encode(img.content)
-                imageurl[
-                    image_index] = "data:image/jpeg;base64," + base64image.decode(
-                        'utf-8')
-            except:
-                log.debug(
-                    f"[{typevar}] Failed to get the base64 of the image"
-                )
-    else:
-        try:
-            img = requests.get(imageurl.replace("ps.jpg", "pl.jpg"),
-                               timeout=10,
-                               headers=head)
-            if img.status_code != 200:
-                log.debug(
-                    f"[Image] Got a bad request (status: {img.status_code}) for <{imageurl}>"
-                )
-                return
-            base64image = base64.b64encode(img.content)
-            if typevar == "JAV":
-                jav_result[
-                    "image"] = "data:image/jpeg;base64," + base64image.decode(
-                        'utf-8')
-            log.debug(f"[{typevar}] Converted the image to base64!")
-        except:
-            log.debug(f"[{typevar}] Failed to get the base64 of the image")
-    return
+def fetch_image(imageurl, typevar):
+    base64image = images.data_url(imageurl.replace("ps.jpg", "pl.jpg"),
+                                  timeout=10,
+                                  headers=JAV_HEADERS)
+    if base64image is None:
+        log.debug(f"[{typevar}] Failed to get the base64 of the image")
+        return None
+    log.debug(f"[{typevar}] Converted the image to base64!")
+    return base64image
 
 
 #log.debug(f"[DEBUG] Main Thread: {threading.get_ident()}")
@@ -792,9 +829,7 @@ def th_imageto_base64(imageurl, typevar):
             log.warning(f"The URL is not from JavLibrary ({SCENE_URL})")
     if JAV_MAIN_HTML is None and SCENE_TITLE:
         log.debug(f"Using search with Title: {SCENE_TITLE}")
-        JAV_SEARCH_HTML = send_request(
-            f"https://www.javlibrary.com/{LANGUAGE}/vl_searchbyid.php?keyword={SCENE_TITLE}",
-            JAV_HEADERS)
+        SCENE_CODE = SCENE_TITLE.strip().upper()
 
 # XPATH
 jav_xPath_search = {}
@@ -834,6 +869,8 @@ def th_imageto_base64(imageurl, typevar):
 jav_xPath["image"] = '//div[@id="video_jacket"]/img/@src'
 
 jav_result = {}
+image_future = None
+aliases_future = None
 
 if "searchName" in sys.argv:
     if JAV_SEARCH_HTML:
@@ -870,8 +907,11 @@ def th_imageto_base64(imageurl, typevar):
                 }]))
     sys.exit()
 
-if JAV_SEARCH_HTML:
-    JAV_MAIN_HTML = jav_search(JAV_SEARCH_HTML, jav_xPath_search)
+if JAV_MAIN_HTML is None and SCENE_CODE:
+    try:
+        JAV_MAIN_HTML = as_response(movie_page(SCENE_CODE, LANGUAGE))
+    except PageUnavailable as exc:
+        log.debug(str(exc))
 
 if JAV_MAIN_HTML:
     #log.debug("[DEBUG] Javlibrary Page ({})".format(JAV_MAIN_HTML.url))
@@ -895,13 +935,7 @@ def th_imageto_base64(imageurl, typevar):
                 )
                 jav_result["image"] = None
             else:
-                imageBase64_jav_thread = threading.Thread(
-                    target=th_imageto_base64,
-                    args=(
-                        jav_result["image"],
-                        "JAV",
-                    ))
-                imageBase64_jav_thread.start()
+                image_future = submit(fetch_image, jav_result["image"], "JAV")
         if jav_result.get("url"):
             jav_result["url"] = "https:" + jav_result["url"][0]
         if jav_result.get("details") and LEGACY_FIELDS:
@@ -918,14 +952,13 @@ def th_imageto_base64(imageurl, typevar):
         #if jav_result.get("label"):
         #    jav_result["label"] = jav_result["label"][0]
         if jav_result.get("performers_url") and IGNORE_ALIASES is False:
-            javlibrary_aliases_thread = threading.Thread(
-                target=th_request_perfpage,
-                args=(
-                    JAV_MAIN_HTML.url,
-                    jav_result["performers_url"],
-                ))
-            javlibrary_aliases_thread.daemon = True
-            javlibrary_aliases_thread.start()
+            # Fetched alongside the image: both only depend on the movie page
+            aliases_future = submit(
+                fetch_aliases,
+                next(iter(jav_result.get("code", [])), JAV_MAIN_HTML.url),
+                JAV_MAIN_HTML.url,
+                jav_result["performers_url"],
+            )
 
 if JAV_MAIN_HTML is None:
     log.info("No results found")
@@ -956,12 +989,11 @@ def th_imageto_base64(imageurl, typevar):
 #    'name': jav_result.get('label'),
 #}
 
-if WAIT_FOR_ALIASES and not IGNORE_ALIASES:
-    try:
-        if javlibrary_aliases_thread.is_alive():
-            javlibrary_aliases_thread.join()
-    except NameError:
-        log.debug("No Jav Aliases Thread")
+if aliases_future is None:
+    log.debug("No Jav Aliases Task")
+elif WAIT_FOR_ALIASES or aliases_future.done():
+    if performer_aliases := aliases_future.result():
+        jav_result["performer_aliases"] = performer_aliases
 scrape['performers'] = buildlist_tagperf(jav_result, "perf_jav")
 
 scrape['tags'] = buildlist_tagperf(jav_result.get('tags', []), "tags")
@@ -972,12 +1004,9 @@ def th_imageto_base64(imageurl, typevar):
     for tag_name in tag_dict["name"].replace('·', ',').split(",")
 ]
 
-try:
-    if imageBase64_jav_thread.is_alive() is True:
-        imageBase64_jav_thread.join()
-    if jav_result.get('image'):
-        scrape['image'] = jav_result['image']
-except NameError:
-    log.debug("No image JAV Thread")
+if image_future is None:
+    log.debug("No image JAV Task")
+elif image := image_future.result():
+    scrape['image'] = image
 
 print(json.dumps(scrape))
@@ -6,6 +6,7 @@
 from unicodedata import normalize
 from html.parser import HTMLParser
 
+from py_common import http
 import py_common.log as log
 from py_common.types import ScrapedMovie, ScrapedPerformer, ScrapedScene, ScrapedStudio
 from py_common.util import dig, guess_nationality, replace_all, scraper_args
@@ -167,8 +168,12 @@ def get_data(self):
     return normalize("NFKD", s.get_data())
 
 
+# Seconds to keep pages when the site sends no caching headers
+CACHE_TTL = 24 * 60 * 60
+
+
 def fetch_page_props(url: str) -> dict | None:
-    r = requests.get(url)
+    r = http.get(url, cache=CACHE_TTL)
 
     if r.status_code != 200:
         log.error(f"Failed to fetch page HTML: {r.status_code}")
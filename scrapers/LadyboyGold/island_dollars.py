@@ -1,19 +1,29 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
 from datetime import datetime
 import json
+from pathlib import Path
 import re
+import sqlite3
 import sys
+import time
 from typing import Any
 
-import requests
-
+from py_common import http
 import py_common.log as log
 from py_common.types import ScrapedGallery, ScrapedPerformer, ScrapedScene
 from py_common.util import guess_nationality, scraper_args
 
-CACHED_GALLERIES_FILE = "islanddollars-galleries-cache.json"
-CACHED_PERFORMERS_FILE = "islanddollars-performers-cache.json"
-CACHED_SCENES_FILE = "islanddollars-scenes-cache.json"
+# Local copy of the sets and models of every site: searches and lookups are
+# answered from here and only new sets and models are fetched from the API
+MIRROR_FILE = Path(__file__).parent / "islanddollars-mirror.sqlite"
+# Seconds between checks for new sets and models on a site
+SYNC_INTERVAL = 60 * 60
+# Sets and models requested per page while syncing
+SYNC_PAGE_SIZE = 50
+# Pages fetched per scrape: the first sync of a site is spread over several scrapes
+SYNC_MAX_PAGES = 10
+CDN_SERVERS_TTL = 24 * 60 * 60
 CONFIG = {
     "ladyboycrush": {
         "cms_area_id": "74175374-c756-4ae9-97b2-e011512a1521",
@@ -89,6 +99,306 @@ def headers_for_domain(domain: str) -> dict[str, str]:
         "x-nats-natscode": "MC4wLjAuMC4wLjAuMC4wLjA"
     }
 
+def open_mirror() -> sqlite3.Connection:
+    db = sqlite3.connect(MIRROR_FILE, timeout=30)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS sets (
+            domain TEXT NOT NULL,
+            content_type TEXT NOT NULL,
+            cms_set_id TEXT NOT NULL,
+            slug TEXT COLLATE NOCASE,
+            added TEXT,
+            search_text TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (domain, content_type, cms_set_id)
+        );
+        CREATE INDEX IF NOT EXISTS sets_slug ON sets (domain, content_type, slug);
+        CREATE INDEX IF NOT EXISTS sets_id ON sets (domain, cms_set_id);
+        CREATE TABLE IF NOT EXISTS models (
+            domain TEXT NOT NULL,
+            slug TEXT NOT NULL COLLATE NOCASE,
+            name TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (domain, slug)
+        );
+        CREATE TABLE IF NOT EXISTS sync (
+            domain TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            synced REAL NOT NULL,
+            complete INTEGER NOT NULL,
+            next_start INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (domain, kind)
+        );
+        CREATE TABLE IF NOT EXISTS cdn_servers (
+            domain TEXT PRIMARY KEY,
+            fetched REAL NOT NULL,
+            data TEXT NOT NULL
+        );
+        """
+    )
+    return db
+
+def sync_state(db: sqlite3.Connection, domain: str, kind: str) -> tuple[float, bool, int]:
+    row = db.execute(
+        "SELECT synced, complete, next_start FROM sync WHERE domain = ? AND kind = ?",
+        (domain, kind),
+    ).fetchone()
+    return (row[0], bool(row[1]), row[2]) if row else (0, False, 0)
+
+def save_sync_state(
+        db: sqlite3.Connection,
+        domain: str,
+        kind: str,
+        synced: float,
+        complete: bool,
+        next_start: int = 0,
+    ):
+    with db:
+        db.execute(
+            "INSERT OR REPLACE INTO sync (domain, kind, synced, complete, next_start) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (domain, kind, synced, complete, next_start),
+        )
+
+def set_search_text(cms_set: Any) -> str:
+    """Everything a text search can match a set on, lowercased"""
+    fields = [cms_set.get("title"), cms_set.get("name"), cms_set.get("description"), cms_set.get("slug")]
+    for data_type in ("Models", "Tags", "Category"):
+        fields.extend(extract_names(cms_set, data_type))
+    return " ".join(f for f in fields if f).lower()
+
+def store_sets(db: sqlite3.Connection, domain: str, content_type: str, cms_sets: list[Any]):
+    with db:
+        db.executemany(
+            "INSERT OR REPLACE INTO sets "
+            "(domain, content_type, cms_set_id, slug, added, search_text, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    domain,
+                    content_type,
+                    str(cms_set["cms_set_id"]),
+                    cms_set.get("slug"),
+                    cms_set.get("added_nice"),
+                    set_search_text(cms_set),
+                    json.dumps(cms_set),
+                )
+                for cms_set in cms_sets
+            ),
+        )
+
+def store_models(db: sqlite3.Connection, domain: str, models: list[Any]):
+    with db:
+        db.executemany(
+            "INSERT OR REPLACE INTO models (domain, slug, name, data) VALUES (?, ?, ?, ?)",
+            ((domain, model["slug"], model["name"], json.dumps(model)) for model in models),
+        )
+
+def sync_catalog(
+        db: sqlite3.Connection,
+        domain: str,
+        kind: str,
+        fetch_page,
+        known_keys,
+        store,
+        force: bool = False,
+    ):
+    """
+    Pages through the API newest first, storing everything on the way, until a page
+    contains something we already know: the API is only asked for what is new.
+
+    The first sync of a site walks the whole catalog, at most SYNC_MAX_PAGES per call:
+    the offset is saved after every page so the next scrape carries on from there,
+    even if this one was interrupted
+    """
+    synced, complete, start = sync_state(db, domain, kind)
+    if complete:
+        if not force and time.time() - synced < SYNC_INTERVAL:
+            return
+        start = 0
+    log.debug(f"Syncing {kind} for {domain} from {start}")
+    done = False
+    for _ in range(SYNC_MAX_PAGES):
+        page, total_count = fetch_page(start)
+        if not page:
+            done = True
+            break
+        known = known_keys(page)
+        store(page)
+        start += len(page)
+        if start >= total_count or (complete and known):
+            done = True
+            break
+        if not complete:
+            save_sync_state(db, domain, kind, synced, False, start)
+    if done:
+        log.debug(f"Synced {kind} for {domain}")
+        save_sync_state(db, domain, kind, time.time(), True)
+    else:
+        # Out of pages: the walk goes on in the next scrape, without stopping at known sets
+        log.debug(f"Synced {start} {kind} for {domain} so far")
+        save_sync_state(db, domain, kind, time.time(), False, start)
+
+def sync_sets(db: sqlite3.Connection, domain: str, content_type: str, force: bool = False):
+    def fetch_page(start):
+        result = fetch_sets(domain, content_type=content_type, start=start, count=SYNC_PAGE_SIZE)
+        return result["sets"], result["total_count"]
+
+    def known_keys(page):
+        ids = [str(cms_set["cms_set_id"]) for cms_set in page]
+        return db.execute(
+            "SELECT cms_set_id FROM sets WHERE domain = ? AND content_type = ? "
+            f"AND cms_set_id IN ({','.join('?' * len(ids))})",
+            (domain, content_type, *ids),
+        ).fetchall()
+
+    sync_catalog(
+        db,
+        domain,
+        f"sets:{content_type}",
+        fetch_page,
+        known_keys,
+        lambda page: store_sets(db, domain, content_type, page),
+        force,
+    )
+
+def sync_models(db: sqlite3.Connection, domain: str, force: bool = False):
+    def fetch_page(start):
+        result = fetch_models(domain, start=start, count=SYNC_PAGE_SIZE)
+        return result["data_values"], result["total_count"]
+
+    def known_keys(page):
+        slugs = [model["slug"] for model in page]
+        return db.execute(
+            "SELECT slug FROM models WHERE domain = ? "
+            f"AND slug IN ({','.join('?' * len(slugs))})",
+            (domain, *slugs),
+        ).fetchall()
+
+    sync_catalog(
+        db,
+        domain,
+        "models",
+        fetch_page,
+        known_keys,
+        lambda page: store_models(db, domain, page),
+        force,
+    )
+
+def like_pattern(text: str) -> str:
+    return "%" + re.sub(r"([%_\\])", r"\\\1", text) + "%"
+
+def find_sets(
+        db: sqlite3.Connection,
+        domain: str,
+        content_type: str | None = None,
+        text_search: str | None = None,
+        slug: str | None = None,
+        cms_set_id: str | None = None,
+    ) -> list[Any]:
+    conditions = ["domain = ?"]
+    params: list[Any] = [domain]
+    if content_type is not None:
+        conditions.append("content_type = ?")
+        params.append(content_type)
+    if slug is not None:
+        conditions.append("slug = ?")
+        params.append(slug)
+    if cms_set_id is not None:
+        conditions.append("cms_set_id = ?")
+        params.append(str(cms_set_id))
+    # every word of the query has to appear somewhere in the set
+    for word in (text_search or "").lower().split():
+        conditions.append("search_text LIKE ? ESCAPE '\\'")
+        params.append(like_pattern(word))
+    rows = db.execute(
+        f"SELECT data FROM sets WHERE {' AND '.join(conditions)} ORDER BY added DESC",
+        params,
+    )
+    return [json.loads(data) for (data,) in rows]
+
+def find_models(
+        db: sqlite3.Connection,
+        domain: str,
+        name: str | None = None,
+        slug: str | None = None,
+    ) -> list[Any]:
+    conditions = ["domain = ?"]
+    params: list[Any] = [domain]
+    if slug is not None:
+        conditions.append("slug = ?")
+        params.append(slug)
+    if name is not None:
+        conditions.append("name LIKE ? ESCAPE '\\'")
+        params.append(like_pattern(name))
+    rows = db.execute(f"SELECT data FROM models WHERE {' AND '.join(conditions)}", params)
+    return [json.loads(data) for (data,) in rows]
+
+def local_sets(
+        db: sqlite3.Connection,
+        domain: str,
+        content_type: str,
+        text_search: str | None = None,
+        slug: str | None = None,
+    ) -> list[Any]:
+    """
+    Searches the mirror after syncing any new sets from the API, and the API itself
+    while the mirror is still incomplete or doesn't have a match
+    """
+    try:
+        sync_sets(db, domain, content_type)
+    except Exception as e:
+        log.warning(f"Failed to sync {content_type} sets for {domain}, using local copy: {e}")
+    cms_sets = find_sets(db, domain, content_type, text_search=text_search, slug=slug)
+    _, complete, _ = sync_state(db, domain, f"sets:{content_type}")
+    if complete and cms_sets:
+        return cms_sets
+    # Older sets may not be mirrored yet, or were renamed or re-enabled since
+    if api_sets := get_sets(domain, content_type=content_type, text_search=text_search, slug=slug):
+        store_sets(db, domain, content_type, api_sets)
+        return api_sets
+    return cms_sets
+
+def local_models(
+        db: sqlite3.Connection,
+        domain: str,
+        name: str | None = None,
+        slug: str | None = None,
+    ) -> list[Any]:
+    """
+    Searches the mirror after syncing any new models from the API, and the API itself
+    while the mirror is still incomplete or doesn't have a match
+    """
+    try:
+        sync_models(db, domain)
+    except Exception as e:
+        log.warning(f"Failed to sync models for {domain}, using local copy: {e}")
+    models = find_models(db, domain, name=name, slug=slug)
+    _, complete, _ = sync_state(db, domain, "models")
+    if complete and models:
+        return models
+    if api_models := get_models(domain, name=name, slug=slug):
+        store_models(db, domain, api_models)
+        return api_models
+    return models
+
+def cached_cdn_servers(db: sqlite3.Connection, domain: str) -> dict[str, Any]:
+    row = db.execute(
+        "SELECT data FROM cdn_servers WHERE domain = ? AND fetched > ?",
+        (domain, time.time() - CDN_SERVERS_TTL),
+    ).fetchone()
+    if row:
+        return json.loads(row[0])
+    cdn_servers = get_cdn_servers(domain)
+    with db:
+        db.execute(
+            "INSERT OR REPLACE INTO cdn_servers (domain, fetched, data) VALUES (?, ?, ?)",
+            (domain, time.time(), json.dumps(cdn_servers)),
+        )
+    return cdn_servers
+
 def get_cdn_servers(domain: str) -> dict[str, Any]:
     search_params = {
         "cms_area_id": CONFIG[domain]["cms_area_id"]
@@ -99,7 +409,7 @@ def get_cdn_servers(domain: str) -> dict[str, Any]:
         "x-nats-natscode": "MC4wLjAuMC4wLjAuMC4wLjA"
     }
     url = "https://nats.islanddollars.com/tour_api.php/content/config"
-    res = requests.get(url, params=search_params, headers=headers, timeout=REQUESTS_TIMEOUT)
+    res = http.get(url, params=search_params, headers=headers, timeout=REQUESTS_TIMEOUT)
     _result = res.json()
     return _result['servers']
 
@@ -278,7 +588,10 @@ def parse_model_as_performer(domain: str, cms_data: Any, cdn_servers: dict[str,
             if first_cms_set_id := next(iter(cms_data.get("cms_set_id", [])), None):
                 log.debug(f"first_cms_set_id: {first_cms_set_id}")
                 # get added date from cms_set
-                cms_sets = get_sets(domain, cms_set_id=first_cms_set_id)
+                with closing(open_mirror()) as db:
+                    cms_sets = find_sets(db, domain, cms_set_id=first_cms_set_id)
+                if not cms_sets:
+                    cms_sets = get_sets(domain, cms_set_id=first_cms_set_id)
                 if cms_sets and "added_nice" in cms_sets[0]:
                     added_nice = cms_sets[0]["added_nice"]
                     added = datetime.strptime(added_nice, "%Y-%m-%d")
@@ -333,11 +646,18 @@ def extract_names(cms_set, data_type_name):
         for value in data_type['data_values']
     ]
 
-def get_models(domain: str, start: int = 0, name: str | None = None, slug: str | None = None):
+def fetch_models(
+        domain: str,
+        start: int = 0,
+        name: str | None = None,
+        slug: str | None = None,
+        count: int = 10,
+    ) -> dict[str, Any]:
+    """Fetches a page of models, raising if the API does not answer with one"""
     search_params = {
         "cms_data_type_id": "4",
         "start": f"{start}",
-        "count": "10",
+        "count": f"{count}",
         "orderby": "published_desc",
         "cms_block_id": CONFIG[domain]["sets"]["cms_block_id"],
         "name": name,
@@ -345,33 +665,38 @@ def get_models(domain: str, start: int = 0, name: str | None = None, slug: str |
     }
     headers = headers_for_domain(domain)
     url = "https://nats.islanddollars.com/tour_api.php/content/data-values"
-    res = requests.get(url, params=search_params, headers=headers, timeout=REQUESTS_TIMEOUT)
+    res = http.get(url, params=search_params, headers=headers, timeout=REQUESTS_TIMEOUT)
+    _result = res.json()
+    if _result is None or "total_count" not in _result:
+        raise ValueError(f"Unexpected response: {res.text}")
+    return _result
+
+def get_models(domain: str, start: int = 0, name: str | None = None, slug: str | None = None):
     data_values = []
     try:
-        _result = res.json()
+        _result = fetch_models(domain, start=start, name=name, slug=slug)
     except Exception as e:
         log.error(f"Error parsing JSON response: {e}")
-        _result = {"data_values": []}
     else:
-        if _result is not None and "total_count" in _result:
-            log.debug(f"Total count at domain: {domain}: {_result['total_count']}")
-            data_values.extend(_result["data_values"])
+        log.debug(f"Total count at domain: {domain}: {_result['total_count']}")
+        data_values.extend(_result["data_values"])
     log.trace(f"get_models result: {data_values}")
     return data_values
 
-def get_sets(
+def fetch_sets(
         domain: str,
         content_type: str | None = None,
         cms_set_id: str | None = None,
         start: int = 0,
         text_search: str | None = None,
-        slug : str | None = None
-    ) -> list[Any]:
-
+        slug : str | None = None,
+        count: int = 5,
+    ) -> dict[str, Any]:
+    """Fetches a page of sets, raising if the API does not answer with one"""
     search_params = {
         "data_types": "1",
         "content_count": "1",
-        "count": "5",
+        "count": f"{count}",
         "start": f"{start}",
         "cms_block_id": CONFIG[domain]["sets"]["cms_block_id"],
         "orderby": "published_desc",
@@ -389,22 +714,37 @@ def get_sets(
     headers = headers_for_domain(domain)
     log.debug(f"Searching domain {domain} with params: {search_params} and headers: {headers}")
     url = "https://nats.islanddollars.com/tour_api.php/content/sets"
-    res = requests.get(url, params=search_params, headers=headers, timeout=REQUESTS_TIMEOUT)
+    res = http.get(url, params=search_params, headers=headers, timeout=REQUESTS_TIMEOUT)
     log.trace(f"Content-Length: {res.headers.get('Content-Length')}")
     log.trace(f"Content-Type: {res.headers.get('Content-Type')}")
+    _result = res.json()
+    if _result is None or "total_count" not in _result:
+        raise ValueError(f"No results found for domain {domain}, response content: {res.text}")
+    return _result
+
+def get_sets(
+        domain: str,
+        content_type: str | None = None,
+        cms_set_id: str | None = None,
+        start: int = 0,
+        text_search: str | None = None,
+        slug : str | None = None
+    ) -> list[Any]:
     cms_sets = []
     try:
-        _result = res.json()
+        _result = fetch_sets(
+            domain,
+            content_type=content_type,
+            cms_set_id=cms_set_id,
+            start=start,
+            text_search=text_search,
+            slug=slug,
+        )
     except Exception as e:
         log.error(f"Error parsing JSON response: {e}")
-        _result = {"sets": []}
     else:
-        if _result is not None and "total_count" in _result:
-            log.debug(f"Search hits for domain {domain}: {_result['total_count']}")
-            cms_sets.extend(_result["sets"])
-        else:
-            log.debug(f"No results found for domain {domain}")
-            log.debug(f"Response content: {res.text}")
+        log.debug(f"Search hits for domain {domain}: {_result['total_count']}")
+        cms_sets.extend(_result["sets"])
     log.trace(f"get_sets result: {cms_sets}")
     return cms_sets
 
@@ -433,10 +773,11 @@ def scene_search(
     parsed_scenes: list[ScrapedScene] = []
 
     def fetch_domain(domain):
-        cdn_servers = get_cdn_servers(domain)
-        log.trace(f"CDN servers: {cdn_servers}")
-        log.trace(f"Searching domain: {domain} for query: {query}")
-        video_sets = get_sets(domain, content_type="video", text_search=query, slug=slug)
+        with closing(open_mirror()) as db:
+            cdn_servers = cached_cdn_servers(db, domain)
+            log.trace(f"CDN servers: {cdn_servers}")
+            log.trace(f"Searching domain: {domain} for query: {query}")
+            video_sets = local_sets(db, domain, "video", text_search=query, slug=slug)
         return [parse_set_as_scene(domain, cms_set, cdn_servers) for cms_set in video_sets]
 
     with ThreadPoolExecutor() as executor:
@@ -449,11 +790,6 @@ def fetch_domain(domain):
                 log.error(f"Error processing domain {futures[future]}: {e}")
                 log.debug(e.with_traceback())
 
-    # cache results
-    log.debug(f"writing {len(parsed_scenes)} parsed scenes to {CACHED_SCENES_FILE}")
-    with open(CACHED_SCENES_FILE, 'w', encoding='utf-8') as f:
-        f.write(json.dumps(parsed_scenes))
-
     return parsed_scenes
 
 
@@ -471,10 +807,11 @@ def gallery_search(
     parsed_galleries: list[ScrapedGallery] = []
 
     def fetch_domain(domain):
-        cdn_servers = get_cdn_servers(domain)
-        log.trace(f"CDN servers: {cdn_servers}")
-        log.trace(f"Searching domain: {domain} for query: {query}")
-        photo_sets = get_sets(domain, content_type="image", text_search=query, slug=slug)
+        with closing(open_mirror()) as db:
+            cdn_servers = cached_cdn_servers(db, domain)
+            log.trace(f"CDN servers: {cdn_servers}")
+            log.trace(f"Searching domain: {domain} for query: {query}")
+            photo_sets = local_sets(db, domain, "image", text_search=query, slug=slug)
         return [parse_set_as_gallery(domain, cms_set, cdn_servers) for cms_set in photo_sets]
 
     with ThreadPoolExecutor() as executor:
@@ -487,11 +824,6 @@ def fetch_domain(domain):
                 log.error(f"Error processing domain {futures[future]}: {e}")
                 log.debug(e.with_traceback())
 
-    # cache results
-    log.debug(f"writing {len(parsed_galleries)} parsed galleries to {CACHED_GALLERIES_FILE}")
-    with open(CACHED_GALLERIES_FILE, 'w', encoding='utf-8') as f:
-        f.write(json.dumps(parsed_galleries))
-
     return parsed_galleries
 
 
@@ -509,10 +841,11 @@ def performer_search(
     parsed_performers: list[ScrapedPerformer] = []
 
     def fetch_domain(domain):
-        cdn_servers = get_cdn_servers(domain)
-        log.trace(f"CDN servers: {cdn_servers}")
-        log.trace(f"Searching domain: {domain} for query: {name}")
-        models = get_models(domain, name=name, slug=slug)
+        with closing(open_mirror()) as db:
+            cdn_servers = cached_cdn_servers(db, domain)
+            log.trace(f"CDN servers: {cdn_servers}")
+            log.trace(f"Searching domain: {domain} for query: {name}")
+            models = local_models(db, domain, name=name, slug=slug)
         return [parse_model_as_performer(domain, cms_data, cdn_servers) for cms_data in models]
 
     with ThreadPoolExecutor() as executor:
@@ -524,11 +857,6 @@ def fetch_domain(domain):
             except Exception as e:
                 log.error(f"Error processing domain {futures[future]}: {e}")
 
-    # cache results
-    log.debug(f"writing {len(parsed_performers)} parsed performers to {CACHED_PERFORMERS_FILE}")
-    with open(CACHED_PERFORMERS_FILE, 'w', encoding='utf-8') as f:
-        f.write(json.dumps(parsed_performers))
-
     return parsed_performers
 
 
@@ -541,20 +869,10 @@ def scene_from_fragment(
         return None
     log.debug(f"fragment: {fragment}")
 
-    # attempt to get from cached results first
-    cached_results = load_cached_results(CACHED_SCENES_FILE)
-
-    # if a matching scene is found in the cached results, return it
-    match = None
-    if cached_results and (match := get_matching_scene(fragment, cached_results)):
-        log.debug(f"Found matching scene in cached results: {match}")
+    # searches are answered from the local mirror
+    search_results = scene_search(fragment["title"], search_domains=search_domains)
+    if search_results and (match := get_matching_scene(fragment, search_results)):
         return match
-
-    # if no scenes retrieved from cached file, do an API search
-    if cached_results is None or match is None:
-        search_results = scene_search(fragment["title"], search_domains=search_domains)
-        if search_results and (match := get_matching_scene(fragment, search_results)):
-            return match
     return None
 
 def get_matching_scene(fragment, search_results):
@@ -570,25 +888,6 @@ def get_matching_scene(fragment, search_results):
     return first_match
 
 
-def load_cached_results(filepath: str) -> list[ScrapedGallery] | list[ScrapedScene] |None:
-    cached_results = None
-    try:
-        log.debug(f"Attempting to get search results from {filepath}")
-        with open(filepath, 'r', encoding='utf-8') as f:
-            log.debug(f"Opened cache file {filepath}")
-            cached_results = json.load(f)
-            log.debug(f"cached_results: {cached_results}")
-    except FileNotFoundError:
-        log.error(f"Cache file {filepath} not found")
-    except json.JSONDecodeError:
-        log.error(f"Error decoding JSON from {filepath}")
-    except (OSError, IOError) as e:
-        log.error(f"An I/O error occurred with file {filepath}: {e}")
-    except Exception as e:
-        log.error(f"An unexpected error occurred with file {filepath}: {e}")
-    return cached_results
-
-
 def gallery_from_fragment(
     fragment,
     search_domains: list[str] | None = None,
@@ -598,23 +897,10 @@ def gallery_from_fragment(
         return None
     log.debug(f"fragment: {fragment}")
 
-    # attempt to get from cached results first
-    cached_results = load_cached_results(CACHED_GALLERIES_FILE)
-
-    # if a matching gallery is found in the cached results, return it
-    match = None
-    if cached_results and (match := get_matching_gallery(fragment, cached_results)):
-        log.debug(f"Found matching gallery in cached results: {match}")
-        return match
-
-    # if no galleries retrieved from cached file, do an API search
-    if cached_results is None or match is None:
-        log.debug(f"No matching gallery found in cached results, performing API search for title: {fragment['title']}")
-        search_results = gallery_search(fragment["title"], search_domains=search_domains)
-        log.debug(f"search_results: {search_results}")
-        match = get_matching_gallery(fragment, search_results)
-        return match
-    return None
+    # searches are answered from the local mirror
+    search_results = gallery_search(fragment["title"], search_domains=search_domains)
+    log.debug(f"search_results: {search_results}")
+    return get_matching_gallery(fragment, search_results)
 
 def get_matching_gallery(fragment, search_results):
     first_match = next(
@@ -698,20 +984,11 @@ def performer_by_fragment(
         return None
     log.debug(f"fragment: {fragment}")
 
-    # attempt to get from cached results first
-    cached_results = load_cached_results(CACHED_PERFORMERS_FILE)
-
-    # if a matching performer is found in the cached results, return it
-    match = None
-    if cached_results and (match := get_matching_performer(fragment, cached_results)):
+    # searches are answered from the local mirror
+    search_results = performer_search(fragment["name"], search_domains=search_domains)
+    log.debug(f"search_results: {search_results}")
+    if search_results and (match := get_matching_performer(fragment, search_results)):
         return match
-
-    # if no performers retrieved from cached file, or no matches found, do an API search
-    if search_results is None or match is None:
-        search_results = performer_search(fragment["name"], search_domains=search_domains)
-        log.debug(f"search_results: {search_results}")
-        if search_results and (match := get_matching_performer(fragment, search_results)):
-            return match
     return None
 
 def get_matching_performer(fragment, search_results):
@@ -4,6 +4,7 @@
 import sys
 from typing import Any
 
+from py_common import http_cache
 import py_common.log as log
 from py_common.util import scraper_args
 from py_common.types import ScrapedPerformer
@@ -12,6 +13,9 @@
 
 scraper = cloudscraper.create_scraper()
 
+# Performer profiles only change when new releases are added
+CACHE_TTL = 24 * 60 * 60
+
 XPATHS = {
     "birthdate": "//span[text()='生年月日']/../p/text()",
     "career": "//span[text()='AV出演期間']/../p/text()",
@@ -180,7 +184,7 @@ def get_xpath_result(tree: Any, xpath_string: str) -> str | list[str] | None:
 
 
 def performer_by_url(url, lang="EN"):
-    request = scraper.get(url)
+    request = http_cache.get(url, ttl=CACHE_TTL, session=scraper)
     log.debug(request.status_code)
 
     tree = etree.HTML(request.text)
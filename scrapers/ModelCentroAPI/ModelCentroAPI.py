@@ -1,12 +1,10 @@
 import datetime
 import json
-import os
 import re
 import sys
-from configparser import ConfigParser, NoSectionError
 from urllib.parse import urlparse
 
-from py_common import log
+from py_common import log, tokens
 import requests
 
 def sendRequest(url, req_headers):
@@ -22,43 +20,28 @@ def sendRequest(url, req_headers):
     return req
 
 
-def check_config(time_now):
-    if os.path.isfile(SET_FILE_URL):
-        config = ConfigParser()
-        config.read(SET_FILE_URL)
-        try:
-            ini_keys1 = config.get(DOMAIN_URL, 'keys1')
-            ini_keys2 = config.get(DOMAIN_URL, 'keys2')
-            ini_date = config.get(DOMAIN_URL, 'date')
-            time_past = datetime.datetime.strptime(ini_date, '%Y-%m-%d %H:%M:%S.%f')
-            # Key for 1 days
-            if time_past.day - time_now == 0:
-                log.debug("Using old API keys")
-                return ini_keys1, ini_keys2
-            log.debug("Need new API keys")
-        except NoSectionError:
-            pass
-    return None, None
-
-
-def write_config(keys1, keys2):
-    config = ConfigParser()
-    config.read(SET_FILE_URL)
+def fetch_api_keys():
+    log.debug("Going to the URL...")
+    url_headers = {
+        'User-Agent': USER_AGENT
+    }
+    r = sendRequest(SCENE_URL, url_headers)
+    page_html = r.text
     try:
-        config.get(DOMAIN_URL, 'date')
-    except NoSectionError:
-        config.add_section(DOMAIN_URL)
-    config.set(DOMAIN_URL, 'keys1', keys1)
-    config.set(DOMAIN_URL, 'keys2', keys2)
-    config.set(DOMAIN_URL, 'date', str(datetime.datetime.now()))
-    with open(SET_FILE_URL, 'w', encoding='utf-8') as configfile:
-        config.write(configfile)
+        api_function = re.findall(
+            r'_fox_init(.+)</script>', page_html, re.DOTALL | re.MULTILINE)[0]
+        api_key1 = re.findall(
+            r'ah":"([a-zA-Z0-9_-]+)"', api_function, re.MULTILINE)[0]
+        api_key2 = re.findall(r'aet":(\d+),"', api_function, re.MULTILINE)[0]
+    except IndexError:
+        return None
+    # Need to reverse this key
+    return [api_key1[::-1], api_key2]
 
 FRAGMENT = json.loads(sys.stdin.read())
 SCENE_URL = FRAGMENT["url"]
 DOMAIN_URL = urlparse(SCENE_URL).netloc
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:79.0) Gecko/20100101 Firefox/79.0'
-SET_FILE_URL = "ModelCentroAPI.ini"
 
 studioMap = {
     "amberlilyshow":"Amber Lily Show",
@@ -336,27 +319,12 @@ def write_config(keys1, keys2):
     log.error(f"Error with the ID ({SCENE_URL})\nAre you sure that your URL is correct ?")
     sys.exit(1)
 
-timenow = datetime.datetime.now()
-api_key1, api_key2 = check_config(timenow.day)
-if api_key1 is None:
-    log.debug("Going to the URL...")
-    url_headers = {
-        'User-Agent': USER_AGENT
-    }
-    r = sendRequest(SCENE_URL, url_headers)
-    page_html = r.text
-    try:
-        api_function = re.findall(
-            r'_fox_init(.+)</script>', page_html, re.DOTALL | re.MULTILINE)[0]
-        api_key1 = re.findall(
-            r'ah":"([a-zA-Z0-9_-]+)"', api_function, re.MULTILINE)[0]
-        api_key2 = re.findall(r'aet":(\d+),"', api_function, re.MULTILINE)[0]
-        # Need to reverse this key
-        api_key1 = api_key1[::-1]
-        write_config(api_key1, api_key2)
-    except IndexError:
-        log.error("There is a problem with getting API identification")
-        sys.exit(1)
+# Keys for 1 day, shared between every scrape of the same site
+api_keys = tokens.get("modelcentro", DOMAIN_URL, fetch_api_keys, ttl=24 * 60 * 60)
+if api_keys is None:
+    log.error("There is a problem with getting API identification")
+    sys.exit(1)
+api_key1, api_key2 = api_keys
 
 log.debug("Asking the Scene API...")
 api_url = f"https://{DOMAIN_URL}/sapi/{api_key1}/{api_key2}/content.load?_method=content.load&tz=1&filter[id][fields][0]=id&filter[id][values][0]={scene_id}&transitParameters[v1]=ykYa8ALmUD&transitParameters[preset]=scene"
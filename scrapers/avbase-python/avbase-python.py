@@ -1,4 +1,3 @@
-import base64
 import json
 import sys
 from datetime import datetime
@@ -7,6 +6,7 @@
 import requests
 from lxml import html
 from py_common.types import ScrapedScene, SceneSearchResult
+from py_common import images
 from py_common.util import scraper_args
 from py_common.proxy import StashRequests
 
@@ -18,21 +18,22 @@ def scene_search(url) -> list[ScrapedScene]:
     scraped = requests.get(url).text
     tree = html.fromstring(scraped)
     scenes = tree.xpath('//div[@class="relative"]')
+    # Download all the thumbnails at once instead of one result at a time
+    thumbnails = images.data_urls(
+        [node.xpath('.//img[@loading]/@src')[0] for node in scenes], cloudflare=True
+    )
 
-    return list(map(map_scene, scenes))
+    return list(map(map_scene, scenes, thumbnails))
 
 
 def process_date(date_string):
     return datetime.strptime(date_string, '%Y/%m/%d').date().isoformat()
 
 
-def map_scene(node) -> SceneSearchResult:
+def map_scene(node, image_base64: str | None) -> SceneSearchResult:
     title = node.xpath('.//div[@class="grow"]/a[contains(@href,"/works")]')[0].text.strip()
     performers = list(map(map_by_name, node.xpath('.//a[contains(@href,"/talents")]/span')))
     maker = node.xpath('.//a[contains(@href,"label")]')[0].text
-    scraped_image = node.xpath('.//img[@loading]/@src')[0]
-    image_bytes = fetch_as_base64(scraped_image)
-    image_base64 = f"data:image/jpeg;base64,{image_bytes}"
     url = BASE_URL + node.xpath('.//div[@class="grow"]/a[contains(@href,"/works")]/@href')[0]
     raw_date = node.xpath('.//a[contains(@href,"/works/date")]')[0].text
     date = process_date(raw_date)
@@ -70,8 +71,7 @@ def scene_by_url(url) -> ScrapedScene:
     title = tree.xpath("//h1[contains(@class, 'text-lg')]")[0].text
     performers = list(map(map_by_name, tree.xpath("//a[contains(@class, 'chip')]/span[1]")))
     image_url = tree.xpath("//a[contains(@class,'md:grow')]/div/img/@src")[0]
-    image_bytes = fetch_as_base64(image_url)
-    image_base64 = f"data:image/jpg;base64,{image_bytes}"
+    image_base64 = images.data_url(image_url, cloudflare=True)
     # url = tree.xpath("html/head//link[@rel='canonical']/@href")[0]
     tags = list(map(map_by_name, tree.xpath("//a[contains(@href,'/tags/')]")))
     code = tree.xpath("//span[contains(text(), '名寄せID: ')]/following-sibling::div/span[contains(text(),'-')]")[0].text
@@ -94,9 +94,6 @@ def scene_by_url(url) -> ScrapedScene:
     return scene
 
 
-def fetch_as_base64(url: str) -> str | None:
-    return base64.b64encode(requests.get(url).content).decode('utf-8')
-
 if __name__ == "__main__":
     op, args = scraper_args()
     result = None
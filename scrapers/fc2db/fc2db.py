@@ -10,7 +10,7 @@
 import sys
 
 try:
-    from py_common import log
+    from py_common import http, log
     from py_common.util import scraper_args
 except ModuleNotFoundError:
     print(
@@ -43,6 +43,8 @@
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:128.0) Gecko/20100101 Firefox/128.0",
 }
+# Seconds to keep pages when the site sends no caching headers
+CACHE_TTL = 24 * 60 * 60
 
 
 # ---------------------------------------------------------------------------
@@ -52,7 +54,7 @@
 def fetch_page(url: str) -> lxml.html.HtmlElement | None:
     """Fetch a page and return the parsed HTML tree, or None on failure."""
     try:
-        resp = requests.get(url, headers=HEADERS, timeout=15)
+        resp = http.get(url, headers=HEADERS, timeout=15, cache=CACHE_TTL)
         resp.raise_for_status()
         return lxml.html.fromstring(resp.content)
     except requests.RequestException as exc:
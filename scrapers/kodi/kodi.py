@@ -1,14 +1,12 @@
 import sys
 import pathlib
 
-import mimetypes
-import base64
-
 import json
 import xml.etree.ElementTree as ET
 
 import py_common.graphql as graphql
 import py_common.log as log
+from py_common.images import file_data_url
 from py_common.util import scraper_args
 
 """  
@@ -72,24 +70,17 @@ def query_xml(path, title):
             posterElem = tree.find("art").find("poster")
             if posterElem.text != None:
                 if not rewriteBasePath and pathlib.Path(posterElem.text).is_file():
-                    res["image"] = make_image_data_url(posterElem.text)
+                    res["image"] = file_data_url(posterElem.text)
                 elif rewriteBasePath:
                     rewrittenPath = posterElem.text.replace(basePathBefore, basePathAfter).replace("\\", "/")
                     if pathlib.Path(rewrittenPath).is_file():
-                        res["image"] = make_image_data_url(rewrittenPath)
+                        res["image"] = file_data_url(rewrittenPath)
                     else:
                         log.warning("Can't find image: " + posterElem.text.replace(basePathBefore, basePathAfter) + ". Is the base path correct?")
                 else:
                     log.warning("Can't find image: " + posterElem.text + ". Are you using a docker container? Maybe you need to change the base path in the script file.")
     return res
 
-def make_image_data_url(image_path):
-    # type: (str,) -> str
-    mime, _ = mimetypes.guess_type(image_path)
-    with open(image_path, 'rb') as img:
-        encoded = base64.b64encode(img.read()).decode()
-    return 'data:{0};base64,{1}'.format(mime, encoded)
-
 def scene_by_fragment(fragment: dict):
     # Assume that .nfo/.xml is named exactly alike the video file and is at the same location
     # Query graphQL for the file path
@@ -1,24 +1,22 @@
 
+from concurrent.futures import ThreadPoolExecutor
 import json
+import queue
 import sys
+import threading
 
 try:
-    import requests
+    from py_common import graphql
+    from py_common.cache import cache_to_disk
+    from py_common.singleflight import single_flight
 except ModuleNotFoundError:
-    print("You need to install the requests module. (https://docs.python-requests.org/en/latest/user/install/)", file=sys.stderr)
-    print("If you have pip (normally installed with python), run this command in a terminal (cmd): pip install requests", file=sys.stderr)
+    print("You need to download the folder 'py_common' from the community repo! (CommunityScrapers/tree/master/scrapers/py_common)", file=sys.stderr)
     sys.exit()
 
-class multiscrape:
+# Seconds to keep the result of each scraper for a performer
+CACHE_TTL = 24 * 60 * 60
 
-    url="http://localhost:9999/graphql"
-    headers = {
-        "Accept-Encoding": "gzip, deflate, br",
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Connection": "keep-alive",
-        "DNT": "1"
-    }
+class multiscrape:
 
     '''
     update the below config in the preferred order for each field.
@@ -72,24 +70,12 @@ def error(self,s):
 
 
     def __callGraphQL(self, query, variables=None):
-        json = {}
-        json['query'] = query
-        if variables != None:
-            json['variables'] = variables
-
-        # handle cookies
-        response = requests.post(self.url, json=json, headers=self.headers)
-
-        if response.status_code == 200:
-            result = response.json()
-            if result.get("error", None):
-                for error in result["error"]["errors"]:
-                    raise Exception("GraphQL error: {}".format(error))
-            if result.get("data", None):
-                return result.get("data")
-        else:
-            raise Exception(
-                "GraphQL query failed:{} - {}. Query: {}. Variables: {}".format(response.status_code, response.content, query, variables))
+        # Goes through the pooled session in py_common.http, so the
+        # scrapers running in parallel reuse connections to Stash
+        result = graphql.callGraphQL(query, variables)
+        if result is None:
+            raise Exception("GraphQL query failed. Query: {}. Variables: {}".format(query, variables))
+        return result
 
 
     def list_scrapers(self, type):
@@ -158,6 +144,13 @@ def scrape_performer(self, scraper_id, performer):
     piercings
     aliases
     image
+    details
+    death_date
+    hair_color
+    weight
+    tags {
+      name
+    }
     }
 }"""
         variables = {'scraper_id': scraper_id, 'performer': performer}
@@ -176,9 +169,12 @@ def requred_scrapers(self):
     def query_performers(self,name):
         ret=[]
 
-        for scraper in self.requred_scrapers():
-            print("Querying performers "+ scraper, file=sys.stderr)
-            tmp=self.scrape_performer_list(scraper,name)
+        scrapers=self.requred_scrapers()
+        print("Querying performers from "+ ", ".join(scrapers), file=sys.stderr)
+        with ThreadPoolExecutor(max_workers=len(scrapers)) as pool:
+            # results are merged in the same order as before, only fetched at the same time
+            results=list(pool.map(lambda s: self.__try(self.scrape_performer_list, s, name), scrapers))
+        for tmp in results:
             if tmp is not None:
                 for s in tmp:
                     found=False
@@ -189,41 +185,79 @@ def query_performers(self,name):
                         ret.append(s)
         return ret
 
+    def __try(self, func, scraper, *args):
+        try:
+            return func(scraper, *args)
+        except Exception as e:
+            print("Scraper " + scraper + " failed: " + str(e), file=sys.stderr)
+            return None
+
+    def __resolved(self, results):
+        """
+        True once every field is settled: its highest priority scraper that has a
+        value for it has answered, or all of its scrapers answered without one
+        """
+        for field, sources in self.config.items():
+            for s in sources:
+                if s not in results:
+                    return False
+                if has_value(results[s].get(field)):
+                    break
+        return True
+
     def fetch_performer(self,name):
         ret={"name":name}
 
-        scraper_cache={}
+        scrapers=self.requred_scrapers()
+        answers=queue.Queue()
+
+        def run(s):
+            print("Running scraper: " + s, file=sys.stderr)
+            answers.put((s, self.__try(scraped_performer, s, name) or {}))
+
+        # Daemon threads: once every field is settled we don't wait for the
+        # remaining scrapers, not even when the script exits
+        for s in scrapers:
+            threading.Thread(target=run, args=(s,), daemon=True).start()
 
-        for field in self.config.keys():
-            found=False
-            for s in self.config[field]:
-                if s in scraper_cache.keys():
-                    if field in scraper_cache[s]:
-                        ret[field]=scraper_cache[s][field]
-                        print("updating field from cache using scraper: " + s +" for field: " +field, file=sys.stderr)
-                        found=True
-                if s not in scraper_cache.keys() and not found:
-                    print("Running scraper: " + s +" " +field, file=sys.stderr)
-                    spl=self.scrape_performer_list(s, name)
-                    if spl is not None:
-                        for spli in spl:
-                            if spli["name"].lower()==name.lower():
-                                r=self.scrape_performer(s, {"name":spli["name"], "url":spli["url"]})
-                                if r is not None:
-                                    scraper_cache[s]=r
-                                    found=True
-                                    break;
-                    if found:
-                        print("Saving results from scraper: " +field + " " +s,file=sys.stderr)
-                        if field in scraper_cache[s]:
-                            ret[field]=scraper_cache[s][field]
-                        else:
-                            found=False
-                    else:
-                        scraper_cache[s]={}
+        scraper_cache={}
+        while len(scraper_cache) < len(scrapers) and not self.__resolved(scraper_cache):
+            s, result = answers.get()
+            scraper_cache[s]=result
+
+        for field, sources in self.config.items():
+            for s in sources:
+                if s in scraper_cache and has_value(scraper_cache[s].get(field)):
+                    print("Saving results from scraper: " +field + " " +s,file=sys.stderr)
+                    ret[field]=scraper_cache[s][field]
+                    break
         return ret
 
 
+def has_value(value):
+    return value not in (None, "", [])
+
+
+@cache_to_disk(ttl=CACHE_TTL)
+@single_flight()
+def scraped_performer(scraper_id, name):
+    """
+    Scrapes the performer with exactly this name using one scraper,
+    an empty dict if the scraper does not know them
+
+    Other multiscrape processes asking for the same performer at the
+    same time wait for this scrape instead of running their own
+    """
+    scraper=multiscrape()
+    spl=scraper.scrape_performer_list(scraper_id, name)
+    for spli in spl or []:
+        if spli["name"].lower()==name.lower():
+            r=scraper.scrape_performer(scraper_id, {"name":spli["name"], "url":spli["url"]})
+            if r is not None:
+                return r
+    return {}
+
+
 
 if sys.argv[1] == "query":
     fragment = json.loads(sys.stdin.read())
@@ -19,7 +19,9 @@
 scene: dict = None
 path_in_frag = frag.get('path', None)
 if path_in_frag is None:
-    scene: dict = graphql.getScene(id)
+    scene: dict = graphql.getScene(
+        id, fields=["title", "date", "files.path", "studio.name"]
+    )
 else:
     scene = {'path': path_in_frag}
 scene_path: str = scene.get('path')
@@ -0,0 +1,456 @@
+"""
+Records the HTTP traffic of a scraper run and replays it offline
+
+Scrapers are benchmarked the same way Stash runs them: the script is started in
+a fresh process with the operation on the command line and the fragment on stdin.
+While recording, every request made through requests (including cloudscraper and
+py_common.http) and urllib is saved to a cassette file together with the output
+of the scraper. Replaying serves the same responses from the cassette without
+touching the network, so runs are repeatable and work on an air-gapped machine
+
+Run from the scrapers directory:
+
+```sh
+# Record a cassette
+python -m py_common.bench record IAFD/IAFD.py performer-by-url \\
+    '{"url": "https://www.iafd.com/person.rme/id=..."}' IAFD/bench/performer-by-url.json
+
+# Replay one or more cassettes (or directories of them) a few times each
+python -m py_common.bench replay IAFD/bench --runs 5
+```
+
+Every run starts with empty on-disk caches so the same requests are made each
+time: the scraper directory is copied to a temporary directory and the caches in
+py_common are pointed there. Replays report the median wall time of imports and
+of the operation itself, the number of requests and response bytes served, the
+peak memory of the process and whether the output still matches the recording
+"""
+
+import argparse
+import base64
+from collections import defaultdict, deque
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+import runpy
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any
+from urllib.parse import urlsplit, urlunsplit
+
+SCRAPERS_DIR = Path(__file__).resolve().parent.parent
+
+# Responses from requests are stored without these: their body is already decoded
+DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+class NotRecorded(Exception):
+    pass
+
+
+def _encode_body(body: bytes) -> dict[str, str]:
+    try:
+        return {"text": body.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(body).decode("ascii")}
+
+
+def _decode_body(stored: dict[str, str]) -> bytes:
+    if "text" in stored:
+        return stored["text"].encode("utf-8")
+    return base64.b64decode(stored["base64"])
+
+
+def _digest(body: Any) -> str | None:
+    if body is None:
+        return None
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    if not isinstance(body, (bytes, bytearray)):
+        # Streamed uploads can't be hashed without consuming them
+        return None
+    return hashlib.sha256(body).hexdigest()
+
+
+def _without_query(url: str) -> str:
+    return urlunsplit(urlsplit(url)._replace(query="", fragment=""))
+
+
+class Cassette:
+    """
+    The recorded exchanges of a single scraper run
+
+    Replayed responses are matched on method, URL and request body: exchanges with
+    the same key are served in the order they were recorded. Requests whose URL
+    changes from run to run (timestamps, nonces) fall back to matching on the URL
+    without its query string
+    """
+
+    def __init__(self, interactions: list[dict] | None = None):
+        self.interactions = interactions or []
+        self.requests = 0
+        self.bytes = 0
+        self.__lock = threading.Lock()
+        self.__exact: dict[tuple, deque] = defaultdict(deque)
+        self.__loose: dict[tuple, deque] = defaultdict(deque)
+        for interaction in self.interactions:
+            request = interaction["request"]
+            self.__exact[(request["method"], request["url"], request["body"])].append(interaction)
+            self.__loose[(request["method"], _without_query(request["url"]))].append(interaction)
+
+    def record(
+        self,
+        method: str,
+        url: str,
+        body: Any,
+        status: int,
+        reason: str,
+        headers,
+        content: bytes,
+        decoded: bool = True,
+    ):
+        with self.__lock:
+            self.requests += 1
+            self.bytes += len(content)
+            self.interactions.append(
+                {
+                    "request": {"method": method, "url": url, "body": _digest(body)},
+                    "response": {
+                        "status": status,
+                        "reason": reason,
+                        "headers": [
+                            [k, v]
+                            for k, v in headers
+                            if not decoded or k.lower() not in DROPPED_HEADERS
+                        ],
+                        "body": _encode_body(content),
+                    },
+                }
+            )
+
+    def play(self, method: str, url: str, body: Any) -> tuple[int, str, list, bytes]:
+        with self.__lock:
+            queue = self.__exact.get((method, url, _digest(body)))
+            if not queue:
+                queue = self.__loose.get((method, _without_query(url)))
+            if not queue:
+                raise NotRecorded(f"{method} {url} is not in the cassette")
+            # The last exchange keeps being served once a key is exhausted
+            interaction = queue.popleft() if len(queue) > 1 else queue[0]
+            response = interaction["response"]
+            content = _decode_body(response["body"])
+            self.requests += 1
+            self.bytes += len(content)
+        return response["status"], response["reason"], response["headers"], content
+
+
+def __patch_requests(cassette: Cassette, recording: bool):
+    try:
+        from requests.adapters import HTTPAdapter
+        from requests.exceptions import ConnectionError as RequestsConnectionError
+        from urllib3 import HTTPResponse
+    except ImportError:
+        return
+    from http.client import HTTPMessage
+
+    send = HTTPAdapter.send
+
+    def recorded_send(self, request, *args, **kwargs):
+        response = send(self, request, *args, **kwargs)
+        raw_headers = response.raw.headers
+        headers = [(k, v) for k in raw_headers for v in raw_headers.getlist(k)]
+        cassette.record(
+            request.method,
+            request.url,
+            request.body,
+            response.status_code,
+            response.reason,
+            headers,
+            response.content,
+        )
+        return response
+
+    def replayed_send(self, request, *args, **kwargs):
+        try:
+            status, reason, headers, content = cassette.play(request.method, request.url, request.body)
+        except NotRecorded as e:
+            raise RequestsConnectionError(str(e), request=request)
+        message = HTTPMessage()
+        for k, v in headers:
+            message[k] = v
+        raw = HTTPResponse(
+            body=io.BytesIO(content),
+            headers=headers,
+            status=status,
+            reason=reason,
+            preload_content=False,
+            decode_content=False,
+            # requests reads the cookies from here
+            original_response=SimpleNamespace(msg=message, close=lambda: None, isclosed=lambda: True),
+        )
+        return self.build_response(request, raw)
+
+    HTTPAdapter.send = recorded_send if recording else replayed_send
+
+
+def __patch_urllib(cassette: Cassette, recording: bool):
+    import urllib.error
+    import urllib.request
+    from urllib.response import addinfourl
+    from http.client import HTTPMessage
+
+    open_url = urllib.request.OpenerDirector.open
+
+    def response_for(url, status, reason, headers, content):
+        message = HTTPMessage()
+        for k, v in headers:
+            message[k] = v
+        if status >= 400:
+            return urllib.error.HTTPError(url, status, reason, message, io.BytesIO(content))
+        return addinfourl(io.BytesIO(content), message, url, status)
+
+    def request_of(fullurl, data):
+        if isinstance(fullurl, str):
+            return fullurl, "POST" if data is not None else "GET", data
+        return fullurl.full_url, fullurl.get_method(), data if data is not None else fullurl.data
+
+    def recorded_open(self, fullurl, data=None, *args, **kwargs):
+        url, method, body = request_of(fullurl, data)
+        try:
+            response = open_url(self, fullurl, data, *args, **kwargs)
+        except urllib.error.HTTPError as e:
+            content = e.read()
+            cassette.record(method, url, body, e.code, str(e.reason), list(e.headers.items()), content, decoded=False)
+            raise response_for(url, e.code, str(e.reason), list(e.headers.items()), content)
+        content = response.read()
+        headers = list(response.headers.items())
+        cassette.record(method, url, body, response.status, response.reason, headers, content, decoded=False)
+        # The caller still has to decode the body, so keep the encoding headers
+        message = HTTPMessage()
+        for k, v in headers:
+            message[k] = v
+        return addinfourl(io.BytesIO(content), message, response.url, response.status)
+
+    def replayed_open(self, fullurl, data=None, *args, **kwargs):
+        url, method, body = request_of(fullurl, data)
+        try:
+            status, reason, headers, content = cassette.play(method, url, body)
+        except NotRecorded as e:
+            raise urllib.error.URLError(str(e))
+        response = response_for(url, status, reason, headers, content)
+        if isinstance(response, urllib.error.HTTPError):
+            raise response
+        return response
+
+    urllib.request.OpenerDirector.open = recorded_open if recording else replayed_open
+
+
+def __child():
+    """
+    Runs the scraper inside the benchmark process: started by record and replay
+    """
+    spec = json.loads(Path(os.environ["BENCH_CASSETTE"]).read_text(encoding="utf-8"))
+    script = Path(os.environ["BENCH_SCRIPT"])
+    recording = os.environ["BENCH_MODE"] == "record"
+    cassette = Cassette(None if recording else spec.get("interactions", []))
+    __patch_requests(cassette, recording)
+    __patch_urllib(cassette, recording)
+
+    metrics: dict[str, Any] = {}
+    start = time.perf_counter()
+
+    import py_common.util
+
+    scraper_args = py_common.util.scraper_args
+
+    def timed_scraper_args(*args, **kwargs):
+        # Scrapers parse their arguments once their imports are done
+        metrics.setdefault("import", time.perf_counter() - start)
+        return scraper_args(*args, **kwargs)
+
+    py_common.util.scraper_args = timed_scraper_args
+
+    sys.argv = [str(script), *spec["args"]]
+    sys.stdin = io.StringIO(json.dumps(spec["input"]))
+    sys.path[0] = str(script.parent)
+    os.chdir(script.parent)
+    exit_code = 0
+    try:
+        runpy.run_path(str(script), run_name="__main__")
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    finally:
+        sys.stdout.flush()
+        total = time.perf_counter() - start
+        metrics["total"] = total
+        metrics["operation"] = total - metrics.get("import", 0)
+        metrics["requests"] = cassette.requests
+        metrics["bytes"] = cassette.bytes
+        metrics["exit_code"] = exit_code
+        try:
+            import resource
+
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Kilobytes on Linux, bytes on macOS
+            metrics["peak_rss"] = peak if sys.platform == "darwin" else peak * 1024
+        except ImportError:
+            metrics["peak_rss"] = None
+        if recording:
+            metrics["interactions"] = cassette.interactions
+        Path(os.environ["BENCH_METRICS"]).write_text(json.dumps(metrics), encoding="utf-8")
+
+
+def __run(spec: dict, mode: str) -> tuple[dict, str, str]:
+    """
+    Runs a scraper in a fresh process with empty caches
+
+    Returns the metrics, stdout and stderr of the run
+    """
+    source = SCRAPERS_DIR / spec["script"]
+    with tempfile.TemporaryDirectory(prefix="scraper-bench-") as tmp:
+        workdir = Path(tmp) / "scrapers"
+        # Anything stored next to the script (cache_to_disk, indexes) starts out empty
+        shutil.copytree(source.parent, workdir / source.parent.name, ignore=shutil.ignore_patterns("*.sqlite*", "__pycache__"))
+        cassette_file = Path(tmp) / "cassette.json"
+        cassette_file.write_text(json.dumps(spec), encoding="utf-8")
+        metrics_file = Path(tmp) / "metrics.json"
+        env = {
+            **os.environ,
+            "PYTHONPATH": os.pathsep.join(filter(None, [str(SCRAPERS_DIR), os.environ.get("PYTHONPATH")])),
+            "BENCH_MODE": mode,
+            "BENCH_CASSETTE": str(cassette_file),
+            "BENCH_SCRIPT": str(workdir / source.parent.name / source.name),
+            "BENCH_METRICS": str(metrics_file),
+            "SCRAPER_HTTP_CACHE": str(Path(tmp) / "http-cache.sqlite"),
+            "SCRAPER_IMAGE_CACHE_DIR": str(Path(tmp) / "images"),
+            "SCRAPER_TOKENS_FILE": str(Path(tmp) / "tokens.sqlite"),
+            "SCRAPER_RATELIMIT_FILE": str(Path(tmp) / "ratelimit.sqlite"),
+            "SCRAPER_SINGLEFLIGHT_FILE": str(Path(tmp) / "singleflight.sqlite"),
+            "SCRAPER_TAG_INDEX": str(Path(tmp) / "tag-index.sqlite"),
+        }
+        process = subprocess.run(
+            [sys.executable, "-m", "py_common.bench", "_child"],
+            cwd=SCRAPERS_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+        )
+        if not metrics_file.exists():
+            raise RuntimeError(f"Benchmark process failed:\n{process.stderr}")
+        return json.loads(metrics_file.read_text(encoding="utf-8")), process.stdout, process.stderr
+
+
+def __parse_output(stdout: str) -> Any:
+    try:
+        return json.loads(stdout)
+    except json.JSONDecodeError:
+        return stdout
+
+
+def record(script: str, args: list[str], fragment: Any, cassette_path: Path):
+    spec = {
+        "script": Path(script).resolve().relative_to(SCRAPERS_DIR).as_posix(),
+        "args": args,
+        "input": fragment,
+    }
+    metrics, stdout, stderr = __run(spec, "record")
+    if metrics["exit_code"]:
+        print(stderr, file=sys.stderr)
+    spec["interactions"] = metrics["interactions"]
+    spec["output"] = __parse_output(stdout)
+    cassette_path.parent.mkdir(parents=True, exist_ok=True)
+    cassette_path.write_text(json.dumps(spec, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"Recorded {metrics['requests']} requests ({metrics['bytes'] / 1024:.0f} KB) to {cassette_path}")
+
+
+def replay(cassette_path: Path, runs: int) -> dict[str, Any]:
+    spec = json.loads(cassette_path.read_text(encoding="utf-8"))
+    results = []
+    matches = True
+    for _ in range(runs):
+        metrics, stdout, stderr = __run(spec, "replay")
+        if __parse_output(stdout) != spec.get("output"):
+            matches = False
+            print(f"{cassette_path}: output differs from the recording\n{stderr}", file=sys.stderr)
+        results.append(metrics)
+
+    def median(key):
+        values = [m[key] for m in results if m.get(key) is not None]
+        return statistics.median(values) if values else None
+
+    return {
+        "cassette": str(cassette_path),
+        "import": median("import"),
+        "operation": median("operation"),
+        "total": median("total"),
+        "requests": results[-1]["requests"],
+        "bytes": results[-1]["bytes"],
+        "peak_rss": max((m["peak_rss"] for m in results if m["peak_rss"]), default=None),
+        "output": "ok" if matches else "changed",
+    }
+
+
+def __report(rows: list[dict[str, Any]]):
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.0f}"
+
+    table = [("cassette", "import ms", "operation ms", "total ms", "requests", "KB", "peak MB", "output")]
+    for row in rows:
+        table.append(
+            (
+                row["cassette"],
+                ms(row["import"]),
+                ms(row["operation"]),
+                ms(row["total"]),
+                str(row["requests"]),
+                f"{row['bytes'] / 1024:.0f}",
+                "-" if row["peak_rss"] is None else f"{row['peak_rss'] / 1024 / 1024:.0f}",
+                row["output"],
+            )
+        )
+    widths = [max(len(r[i]) for r in table) for i in range(len(table[0]))]
+    for r in table:
+        print("  ".join(cell.ljust(w) if i == 0 else cell.rjust(w) for i, (cell, w) in enumerate(zip(r, widths))))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m py_common.bench", description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="run a scraper against the live site and save its traffic")
+    record_parser.add_argument("script", help="path to the scraper script")
+    record_parser.add_argument("operation", nargs="+", help="extra arguments followed by the operation, e.g. performer-by-url")
+    record_parser.add_argument("fragment", help="JSON fragment passed on stdin, e.g. '{\"url\": \"...\"}'")
+    record_parser.add_argument("cassette", type=Path, help="where to save the cassette")
+
+    replay_parser = subparsers.add_parser("replay", help="benchmark scrapers against recorded cassettes")
+    replay_parser.add_argument("cassettes", nargs="+", type=Path, help="cassette files or directories of them")
+    replay_parser.add_argument("--runs", type=int, default=3, help="runs per cassette, the median is reported")
+
+    subparsers.add_parser("_child")
+
+    args = parser.parse_args()
+    if args.command == "_child":
+        __child()
+    elif args.command == "record":
+        record(args.script, args.operation, json.loads(args.fragment), args.cassette)
+    elif args.command == "replay":
+        files = [
+            file
+            for path in args.cassettes
+            for file in (sorted(path.rglob("*.json")) if path.is_dir() else [path])
+        ]
+        __report([replay(file, args.runs) for file in files])
+
+
+if __name__ == "__main__":
+    main()
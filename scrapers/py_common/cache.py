@@ -1,15 +1,89 @@
-from datetime import datetime, timedelta
 from functools import wraps
 import hashlib
 from inspect import stack
+import os
 from pathlib import Path
 import json
+import sqlite3
+import threading
+import time
 import py_common.log as log
 
+# Users can cap the number of cached results per scraper by setting this
+# environment variable: the least recently used entries are evicted first
+MAX_ENTRIES = int(os.environ.get("SCRAPER_CACHE_MAX_ENTRIES", 0)) or None
 
-def cache_to_disk(ttl: int):
+__connections: dict[Path, sqlite3.Connection] = {}
+# Serializes the use of the shared connections: reentrant so the
+# cached functions can open the connection while holding it
+_lock = threading.RLock()
+
+
+def __connect(cache_file: Path) -> sqlite3.Connection:
+    # Scrapers call cached functions from worker threads too: the connection
+    # is shared by all of them, so every use of it goes through _lock
+    conn = sqlite3.connect(cache_file, timeout=10, check_same_thread=False)
+    # WAL lets several scraper processes read while one of them writes
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def __purge_expired(cache_file: Path):
+    try:
+        conn = __connect(cache_file)
+        with conn:
+            purged = conn.execute(
+                "DELETE FROM cache WHERE expires <= ?", (time.time(),)
+            ).rowcount
+        conn.close()
+        if purged:
+            log.debug(f"Purged {purged} expired entries from '{cache_file}'")
+    except sqlite3.Error as e:
+        log.debug(f"Failed to purge expired entries from '{cache_file}': {e}")
+
+
+def get_connection(cache_file: Path) -> sqlite3.Connection:
+    """
+    Opens the cache database once per process, creating it if needed
+    """
+    with _lock:
+        if conn := __connections.get(cache_file):
+            return conn
+        return __open(cache_file)
+
+
+def __open(cache_file: Path) -> sqlite3.Connection:
+    conn = __connect(cache_file)
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY,
+            expires REAL NOT NULL,
+            accessed REAL NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires);
+        CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+        """
+    )
+    __connections[cache_file] = conn
+
+    # Expired entries are only ever skipped on lookup,
+    # so we clean them up without holding up the scrape
+    threading.Thread(target=__purge_expired, args=(cache_file,), daemon=True).start()
+    return conn
+
+
+def cache_to_disk(ttl: int, max_entries: int | None = MAX_ENTRIES):
     """
     Caches the result of the decorated function for ttl seconds
+
+    Results are stored in a SQLite database next to the calling script
+    that is safe to share between concurrently running scrapers
+
+    If max_entries is set the least recently used results are evicted
+    once the cache grows beyond that size
     """
     paths = [frame.filename for frame in stack() if not frame.filename.startswith("<")]
     if len(paths) < 2:
@@ -18,19 +92,11 @@ def cache_to_disk(ttl: int):
             "the current file and the script that called it"
         )
 
-    cache_file = Path(paths[1]).absolute().with_name("cache.json")
+    cache_file = Path(paths[1]).absolute().with_name("cache.sqlite")
 
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            try:
-                data = json.loads(cache_file.read_text(encoding="utf-8"))
-            except FileNotFoundError:
-                data = {}
-            except json.JSONDecodeError | UnicodeDecodeError:
-                log.error(f"Failed to parse cache file '{cache_file}'")
-                return func(*args, **kwargs)
-
             # Use the args to generate a synthetic cache key
             args_tuple = (args, sorted(kwargs.items()))
             args_hash = hashlib.sha256(
@@ -38,21 +104,45 @@ def wrapper(*args, **kwargs):
             ).hexdigest()
             synthetic_key = f"{func.__name__}_{args_hash}"
 
-            if (
-                synthetic_key in data
-                and datetime.fromisoformat(data[synthetic_key]["expires"])
-                > datetime.now()
-            ):
-                log.debug(f"Using cached value for {synthetic_key}")
-                return data[synthetic_key]["data"]
+            try:
+                with _lock:
+                    conn = get_connection(cache_file)
+                    now = time.time()
+                    row = conn.execute(
+                        "SELECT data FROM cache WHERE key = ? AND expires > ?",
+                        (synthetic_key, now),
+                    ).fetchone()
+                    if row and max_entries:
+                        with conn:
+                            conn.execute(
+                                "UPDATE cache SET accessed = ? WHERE key = ?",
+                                (now, synthetic_key),
+                            )
+                if row:
+                    log.debug(f"Using cached value for {synthetic_key}")
+                    return json.loads(row[0])
+            except (sqlite3.Error, json.JSONDecodeError) as e:
+                log.error(f"Failed to read cache file '{cache_file}': {e}")
+                return func(*args, **kwargs)
 
             result = func(*args, **kwargs)
-            data[synthetic_key] = {
-                "expires": (datetime.now() + timedelta(seconds=ttl)).isoformat(),
-                "data": result,
-            }
-            json_data = json.dumps(data, ensure_ascii=False, indent=2)
-            cache_file.write_text(json_data, encoding="utf-8")
+            try:
+                json_data = json.dumps(result, ensure_ascii=False)
+                now = time.time()
+                with _lock, conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO cache (key, expires, accessed, data) "
+                        "VALUES (?, ?, ?, ?)",
+                        (synthetic_key, now + ttl, now, json_data),
+                    )
+                    if max_entries:
+                        conn.execute(
+                            "DELETE FROM cache WHERE key IN "
+                            "(SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                            (max_entries,),
+                        )
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                log.error(f"Failed to write cache file '{cache_file}': {e}")
             return result
 
         return wrapper
@@ -4,7 +4,7 @@
 import py_common.log as log
 
 
-def get_config(default: str | None = None) -> "CustomConfig":
+def get_config(default: str | None = None, shared: bool = False) -> "CustomConfig":
     """
     Gets the config for the currently executing script, taking a default config as a fallback:
     This allows scrapers to define their own configuration options in a way that lets them
@@ -13,6 +13,9 @@ def get_config(default: str | None = None) -> "CustomConfig":
     The default config must have the same format as a simple .ini config file consisting of
     key-value pairs separated by an equals sign, and can optionally contain comments and blank lines
     for readability
+
+    Modules that share a config file with others (like the py_common modules) set shared:
+    their options are added to the file when it already exists
     """
     config = CustomConfig(default)
     if not default:
@@ -50,7 +53,19 @@ def get_config(default: str | None = None) -> "CustomConfig":
         config_path.write_text(str(config), encoding="utf-8")
     else:
         log.debug(f"[{prefix}] Reading config from {config_path}")
-        config.update(config_path.read_text(encoding="utf-8"))
+        existing = config_path.read_text(encoding="utf-8")
+        config.update(existing)
+        known = CustomConfig(existing).config_dict
+        missing = [key for key in config.config_dict if key not in known]
+        if shared and missing:
+            log.debug(f"[{prefix}] Adding {', '.join(missing)} to {config_path}")
+            added = [
+                "\n".join([*config.comments[key], f"{key} = {config[key]}"]).strip()
+                for key in reversed(missing)
+            ]
+            config_path.write_text(
+                "\n\n".join([existing.rstrip(), *added]) + "\n", encoding="utf-8"
+            )
 
     return config
 
@@ -0,0 +1,285 @@
+"""
+Resident worker for Python scrapers
+
+Every script scraper is normally started as a brand new interpreter that has to
+import requests, lxml, cloudscraper and friends before it can do any work: when
+tagging thousands of scenes most of the time is spent starting up
+
+This module can run as a long-lived daemon that imports the heavy dependencies once
+and then forks a warm child for every scrape. The child inherits the caller's
+stdin, stdout and stderr over a Unix socket so Stash talks to it exactly like it
+would talk to a normal scraper process, and every scrape still gets its own copy
+of the module-level state that scrapers rely on
+
+Start the daemon from the scrapers folder:
+```sh
+python py_common/daemon.py --serve
+```
+
+Then point a scraper at the launcher instead of running the script directly:
+```yaml
+sceneByURL:
+  - action: script
+    url:
+      - example.com/video/
+    script:
+      - python
+      - ../py_common/daemon.py
+      - scraper.py
+      - scene-by-url
+```
+
+If the daemon is not running (or the platform has no Unix sockets) the launcher
+runs the scraper in-process, so this is always safe to use
+"""
+
+# The launcher runs for every scrape so it must stay as cheap as possible:
+# only import builtin modules here and leave everything else to the daemon
+import os
+import sys
+
+if __name__ == "__main__":
+    # Running as a script puts this folder first on the path, which would shadow
+    # standard library modules like 'types' with our own py_common modules
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import json
+import socket
+import struct
+
+DEFAULT_PRELOAD = ("requests", "lxml.html", "cloudscraper", "bs4")
+
+# Length prefix for the messages exchanged between the launcher and the daemon
+_HEADER = struct.Struct("!I")
+
+
+def socket_path() -> str:
+    """
+    Gets the path of the daemon socket: can be overridden with
+    the SCRAPER_DAEMON_SOCKET environment variable
+    """
+    if path := os.environ.get("SCRAPER_DAEMON_SOCKET"):
+        return path
+    import tempfile
+    import zlib
+
+    # Several Stash instances can have their own scrapers folder
+    scrapers = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    tag = zlib.crc32(scrapers.encode("utf-8"))
+    uid = os.getuid() if hasattr(os, "getuid") else 0
+    return os.path.join(tempfile.gettempdir(), f"stash-scrapers-{uid}-{tag:08x}.sock")
+
+
+def _recv_exact(conn: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed before message was complete")
+        data += chunk
+    return data
+
+
+def _send_message(conn: socket.socket, message: dict):
+    payload = json.dumps(message).encode("utf-8")
+    conn.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_message(conn: socket.socket) -> dict:
+    (size,) = _HEADER.unpack(_recv_exact(conn, _HEADER.size))
+    return json.loads(_recv_exact(conn, size))
+
+
+def _prepare_script(argv: list[str]) -> str:
+    """
+    Makes the interpreter look like it was started with `python <argv>`
+    and returns the absolute path to the script
+    """
+    script = os.path.abspath(argv[0])
+    scrapers = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.argv = [script, *argv[1:]]
+    sys.path[0] = os.path.dirname(script)
+    if scrapers not in sys.path:
+        sys.path.insert(1, scrapers)
+    return script
+
+
+def _run_script(argv: list[str]) -> int:
+    """
+    Runs a scraper script as __main__ and returns its exit code
+    """
+    import runpy
+
+    script = _prepare_script(argv)
+    try:
+        runpy.run_path(script, run_name="__main__")
+        return 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        try:
+            # py_common.log installs a hook that logs the traceback
+            # and exits with a well-known code
+            sys.excepthook(*sys.exc_info())
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        return 1
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except (BrokenPipeError, ValueError):
+                pass
+
+
+def _handle(conn: socket.socket):
+    """
+    Runs in the forked child: takes over the launcher's standard streams,
+    runs the requested script and reports its exit code back
+    """
+    import atexit
+
+    # Only the exit handlers registered by the scraper itself should run
+    atexit._clear()
+    try:
+        _, fds, _, _ = socket.recv_fds(conn, 1, 3)
+        request = _recv_message(conn)
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        code = _run_script(request["argv"])
+        atexit._run_exitfuncs()
+    except BaseException as e:
+        print(f"[daemon] Failed to run scraper: {e}", file=sys.stderr)
+        code = 1
+    try:
+        _send_message(conn, {"code": code})
+    finally:
+        os._exit(0)
+
+
+def serve(path: str, preload: tuple[str, ...] = DEFAULT_PRELOAD, idle_timeout=None):
+    """
+    Listens on a Unix socket and forks a warm child for every scrape
+
+    :param path: path to the Unix socket
+    :param preload: modules to import once so every scrape can reuse them
+    :param idle_timeout: stop after this many seconds without a scrape
+    """
+    import importlib
+    import signal
+
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            print(f"[daemon] Not preloading '{module}': {e}", file=sys.stderr)
+
+    # Children are never waited on: let the kernel reap them
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen(64)
+    server.settimeout(idle_timeout)
+    print(f"[daemon] Listening on {path}", file=sys.stderr)
+
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                print("[daemon] Idle timeout reached, exiting", file=sys.stderr)
+                break
+            sys.stdout.flush()
+            sys.stderr.flush()
+            if os.fork() == 0:
+                server.close()
+                _handle(conn)
+            conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def forward(argv: list[str], path: str) -> int | None:
+    """
+    Forwards a scrape to the daemon and returns the exit code,
+    or None if the daemon is not available
+    """
+    if not hasattr(socket, "AF_UNIX") or not hasattr(socket, "send_fds"):
+        return None
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except OSError:
+        conn.close()
+        return None
+
+    with conn:
+        socket.send_fds(conn, [b"\0"], [0, 1, 2])
+        _send_message(
+            conn, {"argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)}
+        )
+        try:
+            return _recv_message(conn)["code"]
+        except (ConnectionError, ValueError):
+            print("[daemon] Scraper exited unexpectedly", file=sys.stderr)
+            return 1
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        from argparse import ArgumentParser
+
+        parser = ArgumentParser(description="Resident worker for Python scrapers")
+        parser.add_argument("--serve", action="store_true")
+        parser.add_argument("--socket", default=socket_path())
+        parser.add_argument(
+            "--preload",
+            nargs="*",
+            default=DEFAULT_PRELOAD,
+            help="Modules to import once when the daemon starts",
+        )
+        parser.add_argument(
+            "--idle-timeout",
+            type=float,
+            default=None,
+            help="Stop the daemon after this many seconds without a scrape",
+        )
+        args = parser.parse_args()
+        serve(args.socket, tuple(args.preload), args.idle_timeout)
+        return
+
+    if len(sys.argv) < 2:
+        print(
+            "Usage: daemon.py --serve | daemon.py <scraper.py> [args...]",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+
+    argv = sys.argv[1:]
+    code = forward(argv, socket_path())
+    if code is None:
+        # No daemon: behave exactly like `python <scraper.py> [args...]`
+        code = _run_script(argv)
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,18 @@
-import requests
+import copy
+import json
+import re
+from typing import Any, Callable, Iterable
 
+import py_common.http as http
 import py_common.log as log
+from py_common import ratelimit
 from py_common.config import get_config
 from py_common.util import dig
 
 
+# (connect, read) timeout in seconds for requests to Stash
+STASH_TIMEOUT = (5, 10 * 60)
+
 config = get_config(
     default="""
 # URL for your local Stash server
@@ -12,9 +20,17 @@
 
 # API key can be generated in Stash's settings page: `Settings > Security > Authentication`
 api_key =
-"""
+""",
+    shared=True,
 )
 
+# Stash is our own server: batches of queries should not be spaced out
+if config.url:
+    ratelimit.exempt(config.url)
+    # Queries like scrapeSinglePerformer only return once Stash has run the scraper,
+    # which can take minutes when it goes through FlareSolverr
+    http.set_timeout(http.host_of(config.url), STASH_TIMEOUT)
+
 
 def callGraphQL(query: str, variables: dict | None = None):
     api_key = config.api_key
@@ -38,7 +54,7 @@ def callGraphQL(query: str, variables: dict | None = None):
     json: dict[str, str | dict] = {"query": query}
     if variables:
         json["variables"] = variables
-    response = requests.post(stash_url, json=json, headers=headers)
+    response = http.post(stash_url, json=json, headers=headers)
     if response.status_code == 200:
         result = response.json()
         if errors := result.get("error"):
@@ -66,7 +82,287 @@ def callGraphQL(query: str, variables: dict | None = None):
     )
 
 
-def configuration() -> dict | None:
+# Maximum number of operations merged into a single request
+BATCH_SIZE = 50
+
+__NAME = re.compile(r"[_A-Za-z][_0-9A-Za-z]*")
+__DEFINITION = re.compile(r"(query|mutation|subscription|fragment)\b\s*(\w*)\s*")
+# String literals are matched first so variables and comments inside them are left alone
+__STRING = r'"""(?:\\.|[^\\])*?"""|"(?:\\.|[^"\\\n])*"'
+__VARIABLE = re.compile(rf"{__STRING}|\$(\w+)")
+__COMMENT = re.compile(rf"{__STRING}|#[^\n]*")
+
+
+def __skip_block(text: str, start: int, open_char: str, close_char: str) -> int:
+    """
+    Returns the index right after the block that opens at text[start]
+    """
+    depth = 0
+    in_string = False
+    i = start
+    while i < len(text):
+        c = text[i]
+        if in_string:
+            if c == "\\":
+                i += 1
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == open_char:
+            depth += 1
+        elif c == close_char:
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    raise ValueError("Unbalanced GraphQL document")
+
+
+def __skip_ignored(text: str, i: int) -> int:
+    while i < len(text) and (text[i].isspace() or text[i] == ","):
+        i += 1
+    return i
+
+
+def __parse_document(query: str) -> tuple[str, str, str, dict[str, str]]:
+    """
+    Splits a GraphQL document with a single operation into its
+    operation type, variable definitions, selection set and fragments
+    """
+    text = __COMMENT.sub(lambda m: "" if m.group().startswith("#") else m.group(), query)
+    operation = None
+    fragments = {}
+    i = __skip_ignored(text, 0)
+    while i < len(text):
+        if text[i] == "{":
+            kind, variables, start = "query", "", i
+        elif match := __DEFINITION.match(text, i):
+            kind, name = match.groups()
+            j = match.end()
+            if kind == "fragment":
+                end = __skip_block(text, text.index("{", j), "{", "}")
+                fragments[name] = text[i:end].strip()
+                i = __skip_ignored(text, end)
+                continue
+            variables = ""
+            if text[j] == "(":
+                end = __skip_block(text, j, "(", ")")
+                variables = text[j + 1 : end - 1].strip()
+                j = end
+            start = text.index("{", j)
+        else:
+            raise ValueError(f"Unexpected GraphQL syntax at: {text[i:i + 20]}")
+
+        if operation:
+            raise ValueError("Only documents with a single operation can be batched")
+        end = __skip_block(text, start, "{", "}")
+        operation = (kind, variables, text[start + 1 : end - 1])
+        i = __skip_ignored(text, end)
+
+    if not operation:
+        raise ValueError("No operation found in GraphQL document")
+    return *operation, fragments
+
+
+def __alias_fields(selection: str, prefix: str) -> tuple[str, list[str]]:
+    """
+    Prefixes the alias of every top-level field in the selection set
+    so they can live next to the fields of other operations
+
+    Returns the rewritten selection set and the original response keys
+    """
+    parts = []
+    keys = []
+    last = i = 0
+    while (i := __skip_ignored(selection, i)) < len(selection):
+        if selection.startswith("...", i):
+            raise ValueError("Top-level fragment spreads cannot be batched")
+        if not (match := __NAME.match(selection, i)):
+            raise ValueError(f"Unexpected GraphQL syntax at: {selection[i:i + 20]}")
+        key = name = match.group()
+        end = match.end()
+        j = __skip_ignored(selection, end)
+        if j < len(selection) and selection[j] == ":":
+            # Already aliased: keep the alias as the response key
+            match = __NAME.match(selection, __skip_ignored(selection, j + 1))
+            if not match:
+                raise ValueError(f"Unexpected GraphQL syntax at: {selection[j:j + 20]}")
+            name = match.group()
+            end = match.end()
+
+        parts.append(selection[last:i])
+        parts.append(f"{prefix}{key}: {name}")
+        keys.append(key)
+        last = i = end
+
+        # Skip over the arguments, directives and sub-selection of this field
+        while (i := __skip_ignored(selection, i)) < len(selection):
+            if selection[i] == "(":
+                i = __skip_block(selection, i, "(", ")")
+            elif selection[i] == "@" and (match := __NAME.match(selection, i + 1)):
+                i = match.end()
+            elif selection[i] == "{":
+                i = __skip_block(selection, i, "{", "}")
+                break
+            else:
+                break
+
+    parts.append(selection[last:])
+    return "".join(parts), keys
+
+
+def callGraphQLBatch(
+    operations: list[tuple[str, dict | None]], call=callGraphQL
+) -> list[dict | None]:
+    """
+    Sends several queries or mutations to Stash in as few requests as possible
+
+    Operations are merged into a single document by prefixing their variables
+    and top-level fields, identical queries are only sent once and consecutive
+    operations of the same type share a request
+
+    Returns a list with the data for each operation in the same order,
+    or None for operations that failed
+
+    A different transport with the same signature as callGraphQL can be passed
+    for scrapers that talk to Stash on their own
+
+    >>> create = "mutation Create($input: SceneMarkerCreateInput!) { sceneMarkerCreate(input: $input) { id } }"
+    >>> callGraphQLBatch([(create, {"input": marker}) for marker in markers])
+    [{'sceneMarkerCreate': {'id': '1'}}, {'sceneMarkerCreate': {'id': '2'}}]
+    """
+    results: list[dict | None] = [None] * len(operations)
+
+    # Rewrite everything up front: anything we can't merge is sent on its own
+    groups = []
+    for index, (query, variables) in enumerate(operations):
+        prefix = f"b{index}_"
+
+        def rename(match: re.Match) -> str:
+            if match.group(1) is None:
+                return match.group()
+            return f"${prefix}{match.group(1)}"
+
+        try:
+            kind, variables_def, selection, fragments = __parse_document(query)
+            selection, keys = __alias_fields(__VARIABLE.sub(rename, selection), prefix)
+        except ValueError as e:
+            log.debug(f"[GraphQL] Sending operation on its own: {e}")
+            results[index] = call(query, variables)
+            continue
+
+        entry = {
+            "index": index,
+            "definitions": __VARIABLE.sub(rename, variables_def),
+            "selection": selection,
+            "fragments": fragments,
+            "variables": {f"{prefix}{k}": v for k, v in (variables or {}).items()},
+            "keys": [(f"{prefix}{key}", key) for key in keys],
+        }
+        # Consecutive operations of the same type can share a document
+        if groups and groups[-1][0] == kind and len(groups[-1][1]) < BATCH_SIZE:
+            groups[-1][1].append(entry)
+        else:
+            groups.append((kind, [entry]))
+
+    for kind, entries in groups:
+        definitions = []
+        selections = []
+        fragments = {}
+        merged_variables = {}
+        # Response keys for each operation, shared between identical queries
+        response_keys: dict[int, list[tuple[str, str]]] = {}
+        seen: dict[str, int] = {}
+
+        for entry in entries:
+            index = entry["index"]
+            if kind == "query":
+                identity = json.dumps(operations[index], sort_keys=True)
+                if identity in seen:
+                    response_keys[index] = response_keys[seen[identity]]
+                    continue
+                seen[identity] = index
+
+            if entry["definitions"]:
+                definitions.append(entry["definitions"])
+            selections.append(entry["selection"])
+            fragments.update(entry["fragments"])
+            merged_variables |= entry["variables"]
+            response_keys[index] = entry["keys"]
+
+        document = kind
+        if definitions:
+            document += f" Batch({', '.join(definitions)})"
+        document += " {\n" + "\n".join(selections) + "\n}\n"
+        document += "\n".join(fragments.values())
+
+        log.debug(f"[GraphQL] Sending {len(entries)} operations in a single request")
+        data = call(document, merged_variables or None)
+        if not data:
+            continue
+        for index, keys in response_keys.items():
+            results[index] = {key: data.get(alias) for alias, key in keys}
+
+    return results
+
+
+__memo: dict[tuple, Any] = {}
+
+
+def __selection(fields: Iterable[str]) -> str:
+    """
+    Builds a GraphQL selection set from dotted field paths
+
+    >>> __selection(["id", "files.path", "files.size", "studio.parent_studio.id"])
+    'id files { path size } studio { parent_studio { id } }'
+    """
+    tree: dict = {}
+    for field in fields:
+        node = tree
+        for part in field.split("."):
+            node = node.setdefault(part, {})
+
+    def render(node: dict) -> str:
+        return " ".join(
+            f"{name} {{ {render(children)} }}" if children else name
+            for name, children in node.items()
+        )
+
+    return render(tree)
+
+
+def __memoized(
+    entity: str, key: Any, fields: Iterable[str] | None, fetch: Callable[[], Any]
+):
+    """
+    Only fetches each (entity, key, fields) combination once per process
+
+    Callers get their own copy so they can safely modify the result
+    """
+    memo_key = (entity, str(key), tuple(sorted(fields)) if fields else None)
+    if memo_key not in __memo:
+        result = fetch()
+        if result is None:
+            return None
+        __memo[memo_key] = result
+    return copy.deepcopy(__memo[memo_key])
+
+
+def clear_memo():
+    """
+    Forgets all memoized results, e.g. after updating an entity in Stash
+    """
+    __memo.clear()
+
+
+def configuration(fields: Iterable[str] | None = None) -> dict | None:
+    """
+    Gets the configuration of your Stash
+
+    Pulling the entire configuration is expensive: pass the fields you need as
+    dotted paths to only fetch those, e.g. `["general.databasePath"]`
+    """
     query = """
     query Configuration {
         configuration {
@@ -240,11 +536,24 @@ def configuration() -> dict | None:
         createMissing
     }
     """
-    result = callGraphQL(query) or {}
-    return dig(result, "configuration")
+    if fields:
+        query = f"query Configuration {{ configuration {{ {__selection(fields)} }} }}"
+    return __memoized(
+        "configuration",
+        None,
+        fields,
+        lambda: dig(callGraphQL(query) or {}, "configuration"),
+    )
 
 
-def getScene(scene_id: str | int) -> dict | None:
+def getScene(scene_id: str | int, fields: Iterable[str] | None = None) -> dict | None:
+    """
+    Gets a scene from Stash
+
+    By default this fetches every field including files, studio, groups, tags
+    and performers: pass the fields you need as dotted paths to only fetch those,
+    e.g. `["title", "files.path", "studio.name"]`
+    """
     query = """
     query FindScene($id: ID!, $checksum: String) {
         findScene(id: $id, checksum: $checksum) {
@@ -453,9 +762,19 @@ def getScene(scene_id: str | int) -> dict | None:
         weight
     }
     """
+    if fields:
+        query = f"""
+        query FindScene($id: ID!) {{
+            findScene(id: $id) {{ {__selection(fields)} }}
+        }}
+        """
     variables = {"id": str(scene_id)}
-    result = callGraphQL(query, variables) or {}
-    return dig(result, "findScene")
+    return __memoized(
+        "scene",
+        scene_id,
+        fields,
+        lambda: dig(callGraphQL(query, variables) or {}, "findScene"),
+    )
 
 
 def getSceneScreenshot(scene_id: str | int) -> str | None:
@@ -474,7 +793,14 @@ def getSceneScreenshot(scene_id: str | int) -> str | None:
     return dig(result, "findScene", "paths", "screenshot")
 
 
-def getSceneByPerformerId(performer_id: str | int) -> dict | None:
+def getSceneByPerformerId(
+    performer_id: str | int, fields: Iterable[str] | None = None
+) -> dict | None:
+    """
+    Gets the first 20 scenes of a performer from Stash
+
+    Pass the scene fields you need as dotted paths to only fetch those
+    """
     query = """
 query FindScenes($filter: FindFilterType, $scene_filter: SceneFilterType, $scene_ids: [Int!]) {
           findScenes(filter: $filter, scene_filter: $scene_filter, scene_ids: $scene_ids) {
@@ -750,8 +1076,23 @@ def getSceneByPerformerId(performer_id: str | int) -> dict | None:
             "performers": {"value": [str(performer_id)], "modifier": "INCLUDES_ALL"}
         },
     }
-    result = callGraphQL(query, variables) or {}
-    return dig(result, "findScenes")
+    if fields:
+        query = f"""
+        query FindScenes($filter: FindFilterType, $scene_filter: SceneFilterType) {{
+            findScenes(filter: $filter, scene_filter: $scene_filter) {{
+                count
+                filesize
+                duration
+                scenes {{ {__selection(fields)} }}
+            }}
+        }}
+        """
+    return __memoized(
+        "scenes_by_performer",
+        performer_id,
+        fields,
+        lambda: dig(callGraphQL(query, variables) or {}, "findScenes"),
+    )
 
 
 def getSceneIdByPerformerId(performer_id: str | int) -> dict | None:
@@ -892,7 +1233,15 @@ def getPerformersIdByName(performer_name: str) -> dict | None:
     return dig(result, "findPerformers")
 
 
-def getGallery(gallery_id: str | int) -> dict | None:
+def getGallery(
+    gallery_id: str | int, fields: Iterable[str] | None = None
+) -> dict | None:
+    """
+    Gets a gallery from Stash
+
+    Pass the fields you need as dotted paths to only fetch those,
+    e.g. `["title", "tags.id", "performers.id"]`
+    """
     query = """
     query FindGallery($id: ID!) {
         findGallery(id: $id) {
@@ -1119,9 +1468,19 @@ def getGallery(gallery_id: str | int) -> dict | None:
         }
     }
     """
+    if fields:
+        query = f"""
+        query FindGallery($id: ID!) {{
+            findGallery(id: $id) {{ {__selection(fields)} }}
+        }}
+        """
     variables = {"id": gallery_id}
-    result = callGraphQL(query, variables) or {}
-    return dig(result, "findGallery")
+    return __memoized(
+        "gallery",
+        gallery_id,
+        fields,
+        lambda: dig(callGraphQL(query, variables) or {}, "findGallery"),
+    )
 
 
 def getGalleryPath(gallery_id: str | int) -> str | None:
@@ -0,0 +1,182 @@
+"""
+Shared HTTP sessions for Python scrapers
+
+Calling `requests.get` directly opens a new connection (and does a new TLS handshake)
+for every request: this module keeps one pooled session per host for the lifetime
+of the process so that consecutive requests to the same site reuse connections
+
+```python
+from py_common import http
+
+# Same interface as requests.get / requests.post
+response = http.get("https://example.com/api", params={"q": "foo"})
+
+# Routes through py_common.proxy: retries with cloudscraper / FlareSolverr if blocked
+response = http.get("https://example.com/video/123", cloudflare=True)
+
+# Goes through the on-disk cache in py_common.http_cache: True follows the
+# caching headers of the site, a number of seconds is used when it sends none
+response = http.get("https://example.com/performer/123", cache=24 * 60 * 60)
+```
+
+Requests are rate limited per host by py_common.ratelimit, across every scraper
+process: a 429 makes all of them wait for the Retry-After of the site
+"""
+
+import threading
+from urllib.parse import urlparse
+
+from py_common import ratelimit
+from py_common.deps import ensure_requirements
+
+ensure_requirements("requests")
+import requests  # noqa: E402
+from requests.adapters import HTTPAdapter  # noqa: E402
+from urllib3.util.retry import Retry  # noqa: E402
+
+# (connect, read) timeout in seconds used when neither the caller
+# nor the per-host configuration specify one
+DEFAULT_TIMEOUT = (5, 20)
+
+# Number of connections kept alive per host: scrapers that fan out
+# requests to the same host in threads need more than one
+POOL_SIZE = 16
+
+# Retries for connection errors and transient server errors, responses with
+# Retry-After (429 and 503) are retried by Session.request through py_common.ratelimit
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (500, 502, 504)
+
+_host_timeouts: dict[str, float | tuple[float, float]] = {}
+_sessions: dict[str, "Session"] = {}
+_lock = threading.Lock()
+
+
+def __accept_encoding() -> str:
+    # Only advertise brotli if urllib3 will be able to decode it
+    for module in ("brotli", "brotlicffi"):
+        try:
+            __import__(module)
+            return "gzip, deflate, br"
+        except ImportError:
+            pass
+    return "gzip, deflate"
+
+
+ACCEPT_ENCODING = __accept_encoding()
+
+
+def host_of(url: str) -> str:
+    return (urlparse(url).hostname or "").lower()
+
+
+def set_timeout(host: str, timeout: float | tuple[float, float]):
+    """
+    Sets the default timeout for all requests to the given host,
+    e.g. for slow APIs that need a longer read timeout
+    """
+    _host_timeouts[host.lower()] = timeout
+
+
+class Session(requests.Session):
+    """
+    A requests.Session with keep-alive connection pooling,
+    automatic retries with backoff and default timeouts
+    """
+
+    def __init__(self, retries: int = RETRIES, pool_size: int = POOL_SIZE):
+        super().__init__()
+        self.retries = retries
+        retry = Retry(
+            total=retries,
+            backoff_factor=BACKOFF_FACTOR,
+            status_forcelist=RETRY_STATUSES,
+            respect_retry_after_header=False,
+            # Give the caller the last response instead of raising
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=4, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.headers.update(
+            {"Accept-Encoding": ACCEPT_ENCODING, "Connection": "keep-alive"}
+        )
+
+    def request(self, method, url, *args, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = _host_timeouts.get(host_of(url), DEFAULT_TIMEOUT)
+        for attempt in range(self.retries + 1):
+            ratelimit.wait(url)
+            response = super().request(method, url, *args, **kwargs)
+            retry_after = response.headers.get("Retry-After")
+            too_many = response.status_code == 429 or (
+                response.status_code == 503 and retry_after
+            )
+            if not too_many or attempt == self.retries:
+                break
+            # Hand the connection back to the pool before retrying
+            response.close()
+            ratelimit.backoff(url, retry_after, attempt)
+        return response
+
+
+def session_for(url: str) -> Session:
+    """
+    Gets the process-wide session for the host of the given URL
+
+    Sessions are separated by host so cookies from one site never leak into another
+    """
+    host = host_of(url)
+    with _lock:
+        if (session := _sessions.get(host)) is None:
+            session = _sessions[host] = Session()
+        return session
+
+
+def request(
+    method: str,
+    url: str,
+    cloudflare: bool = False,
+    cache: bool | int = False,
+    refresh: bool = False,
+    **kwargs,
+):
+    """
+    Sends a request through the shared session for the host of the URL
+
+    If cloudflare is set the request goes through py_common.proxy which falls back
+    to cloudscraper and FlareSolverr when the site blocks plain requests
+
+    If cache is set GET requests go through py_common.http_cache: pass True to
+    follow the caching headers of the response or a number of seconds to keep
+    responses that come without any, and refresh to skip the cached response
+    """
+    if cache is not False and method.lower() == "get":
+        from py_common import http_cache
+
+        ttl = None if cache is True else int(cache)
+        return http_cache.get(
+            url, ttl=ttl, refresh=refresh, cloudflare=cloudflare, **kwargs
+        )
+    if cloudflare:
+        # Imported lazily: only scrapers for sites behind Cloudflare need it
+        from py_common.proxy import stash_requests
+
+        return stash_requests.request(method, url, **kwargs)
+    return session_for(url).request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("get", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("post", url, **kwargs)
+
+
+def head(url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault("allow_redirects", False)
+    return request("head", url, **kwargs)
@@ -0,0 +1,304 @@
+"""
+On-disk HTTP cache for GET requests
+
+Opt-in: only requests made through this module (or with `cache=` in py_common.http)
+are cached. Responses are stored following the caching headers the site sends:
+Cache-Control and Expires decide how long a response stays fresh, and stale
+responses with an ETag or Last-Modified are revalidated with a conditional GET
+so an unchanged page only costs a 304
+
+```python
+from py_common import http, http_cache
+
+# Honour whatever caching headers the site sends
+response = http.get("https://example.com/performer/123", cache=True)
+
+# Sites that send no caching headers: keep responses for an hour
+response = http.get("https://example.com/performer/123", cache=60 * 60)
+
+# Any requests-compatible session works, e.g. cloudscraper
+response = http_cache.get(url, ttl=60 * 60, session=scraper)
+
+# Skip the cache for this request but store the fresh response
+response = http.get(url, cache=60 * 60, refresh=True)
+```
+
+Scrapers that miss the cache for the same URL at the same time only send one
+request: py_common.singleflight makes the others wait for its response, which
+they get even if it can't be cached
+
+The cache is shared by all scrapers and lives in the temporary directory unless
+the SCRAPER_HTTP_CACHE environment variable points to another file
+"""
+
+import base64
+from email.utils import parsedate_to_datetime
+import json
+import os
+from pathlib import Path
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import py_common.log as log
+from py_common import singleflight
+
+CACHE_PATH = Path(
+    os.environ.get("SCRAPER_HTTP_CACHE")
+    or Path(tempfile.gettempdir()) / "stash-scraper-http-cache.sqlite"
+)
+
+# RFC 7234 4.2.2: without explicit freshness a response with Last-Modified
+# may be considered fresh for a fraction of the time since it was modified
+HEURISTIC_FRACTION = 0.1
+HEURISTIC_MAX = 24 * 60 * 60
+
+# Seconds other scrapers that asked for the same URL at the same time may
+# read the response one of them fetched: responses that can't be cached
+# are handed to them through the single-flight store instead
+SHARED_TTL = 10
+
+# The body we store is already decoded, so these no longer describe it
+DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+_lock = threading.Lock()
+_db: sqlite3.Connection | None = None
+
+
+def __connect() -> sqlite3.Connection:
+    global _db
+    if _db is None:
+        CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _db = sqlite3.connect(CACHE_PATH, timeout=10, check_same_thread=False)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                expires REAL NOT NULL
+            )
+            """
+        )
+    return _db
+
+
+def __cache_control(headers) -> dict[str, str | None]:
+    directives = {}
+    for part in headers.get("Cache-Control", "").split(","):
+        if not (part := part.strip()):
+            continue
+        name, _, value = part.partition("=")
+        directives[name.strip().lower()] = value.strip().strip('"') or None
+    return directives
+
+
+def __parse_date(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def freshness_lifetime(headers, ttl: int | None = None) -> float | None:
+    """
+    How many seconds a response stays fresh, or None if it must not be stored
+
+    ttl is used for responses without explicit freshness information
+    """
+    directives = __cache_control(headers)
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+    for directive in ("s-maxage", "max-age"):
+        if (value := directives.get(directive)) and re.fullmatch(r"\d+", value):
+            age = headers.get("Age", "")
+            return max(int(value) - (int(age) if age.isdigit() else 0), 0)
+    if expires := headers.get("Expires"):
+        date = __parse_date(headers.get("Date")) or time.time()
+        # Invalid dates like "0" mean already expired
+        return max((__parse_date(expires) or date) - date, 0)
+    if ttl is not None:
+        return ttl
+    if modified := __parse_date(headers.get("Last-Modified")):
+        date = __parse_date(headers.get("Date")) or time.time()
+        return min(max(date - modified, 0) * HEURISTIC_FRACTION, HEURISTIC_MAX)
+    return 0
+
+
+def __cache_key(url: str, params) -> str:
+    if not params:
+        return url
+    return requests.Request("GET", url, params=params).prepare().url or url
+
+
+def __load(key: str) -> tuple[int, CaseInsensitiveDict, bytes, float] | None:
+    with _lock:
+        row = __connect().execute(
+            "SELECT status, headers, body, expires FROM responses WHERE url = ?", (key,)
+        ).fetchone()
+    if not row:
+        return None
+    status, headers, body, expires = row
+    return status, CaseInsensitiveDict(json.loads(headers)), body, expires
+
+
+def __stored_headers(headers) -> dict[str, str]:
+    return {k: v for k, v in headers.items() if k.lower() not in DROPPED_HEADERS}
+
+
+def __store(key: str, status: int, headers, body: bytes, lifetime: float):
+    stored = __stored_headers(headers)
+    with _lock:
+        db = __connect()
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses (url, status, headers, body, expires) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, status, json.dumps(stored), body, time.time() + lifetime),
+            )
+
+
+def __response(url: str, status: int, headers, body: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.reason = "OK"
+    response.url = url
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response._content = body
+    response.from_cache = True  # type: ignore[attr-defined]
+    return response
+
+
+def __default_session():
+    # Imported lazily so callers that bring their own session do not need the pool
+    from py_common import http
+
+    return http
+
+
+def get(
+    url: str,
+    ttl: int | None = None,
+    refresh: bool = False,
+    session: Any = None,
+    **kwargs,
+) -> requests.Response:
+    """
+    Sends a GET request through the cache
+
+    :param ttl: seconds to keep responses that come without caching headers
+    :param refresh: ignore the cached response but store the new one
+    :param session: anything with a requests-compatible get method,
+        py_common.http by default (which also accepts cloudflare=True)
+    """
+    session = session or __default_session()
+    key = __cache_key(url, kwargs.get("params"))
+
+    cached = None
+    try:
+        cached = None if refresh else __load(key)
+    except (sqlite3.Error, ValueError) as e:
+        log.debug(f"Failed to read HTTP cache '{CACHE_PATH}': {e}")
+
+    headers = dict(kwargs.pop("headers", None) or {})
+    if cached:
+        status, cached_headers, body, expires = cached
+        if expires > time.time():
+            log.debug(f"Using cached response for {key}")
+            return __response(key, status, cached_headers, body)
+        if etag := cached_headers.get("ETag"):
+            headers["If-None-Match"] = etag
+        if modified := cached_headers.get("Last-Modified"):
+            headers["If-Modified-Since"] = modified
+
+    response = None
+
+    def fetch() -> bool | dict:
+        nonlocal response
+        response = __fetch(session, url, key, ttl, headers, cached, **kwargs)
+        if getattr(response, "from_cache", False) or __is_stored(key):
+            return True
+        if response.status_code == 200:
+            # Not cacheable: the others get the response itself
+            return {
+                "headers": __stored_headers(response.headers),
+                "body": base64.b64encode(response.content).decode("ascii"),
+            }
+        return False
+
+    # Others asking for the same URL at the same time wait for our response,
+    # then read it from the cache or from the shared result
+    shared = singleflight.do(f"http_cache {key}", fetch, ttl=SHARED_TTL)
+    if isinstance(shared, dict) and response is None:
+        log.debug(f"Using uncacheable response for {key} fetched by another scraper")
+        return __response(key, 200, shared["headers"], base64.b64decode(shared["body"]))
+    if shared is True and response is None:
+        try:
+            if stored := __load(key):
+                log.debug(f"Using response for {key} fetched by another scraper")
+                return __response(key, *stored[:3])
+        except (sqlite3.Error, ValueError) as e:
+            log.debug(f"Failed to read HTTP cache '{CACHE_PATH}': {e}")
+    if response is None:
+        response = __fetch(session, url, key, ttl, headers, cached, **kwargs)
+    return response
+
+
+def __is_stored(key: str) -> bool:
+    with _lock:
+        row = __connect().execute(
+            "SELECT 1 FROM responses WHERE url = ? AND expires > ?", (key, time.time())
+        ).fetchone()
+    return row is not None
+
+
+def __fetch(session, url: str, key: str, ttl, headers, cached, **kwargs) -> requests.Response:
+    response = session.get(url, headers=headers or None, **kwargs)
+
+    try:
+        if response.status_code == 304 and cached:
+            log.debug(f"Revalidated cached response for {key}")
+            status, cached_headers, body, _ = cached
+            # Headers from the 304 replace the stored ones, e.g. a new Cache-Control
+            cached_headers.update(response.headers)
+            lifetime = freshness_lifetime(cached_headers, ttl)
+            if lifetime is not None:
+                __store(key, status, cached_headers, body, lifetime)
+            return __response(key, status, cached_headers, body)
+
+        if response.status_code == 200:
+            lifetime = freshness_lifetime(response.headers, ttl)
+            has_validator = "ETag" in response.headers or "Last-Modified" in response.headers
+            # Responses that are stale right away are only worth keeping for revalidation
+            if lifetime is not None and (lifetime > 0 or has_validator):
+                __store(key, 200, response.headers, response.content, lifetime)
+    except (sqlite3.Error, TypeError, ValueError) as e:
+        log.debug(f"Failed to write HTTP cache '{CACHE_PATH}': {e}")
+
+    return response
+
+
+def clear(url: str | None = None):
+    """
+    Removes a single URL from the cache, or everything if no URL is given
+    """
+    with _lock:
+        db = __connect()
+        with db:
+            if url:
+                db.execute("DELETE FROM responses WHERE url = ?", (url,))
+            else:
+                db.execute("DELETE FROM responses")
@@ -0,0 +1,303 @@
+"""
+Fetching images and turning them into data URLs
+
+Stash accepts images as base64 data URLs, which means scrapers for sites that
+block hotlinking have to download every image themselves. This module fetches
+several images at once, sniffs their real type instead of assuming JPEG and keeps
+a content-addressed cache on disk so re-scraping the same performer does not
+download the same headshot again
+
+```python
+from py_common import images
+
+# One image, straight to a data URL (None if it could not be fetched)
+image = images.data_url("https://example.com/cover.jpg")
+
+# Several images fetched concurrently, returned in the same order
+headshots = images.data_urls(urls, cloudflare=True)
+
+# Local files and raw bytes work too
+poster = images.file_data_url("/media/poster.png")
+```
+
+The cache lives in the temporary directory by default and can be tuned
+with these environment variables:
+- SCRAPER_IMAGE_CACHE_DIR: where to keep the cached images
+- SCRAPER_IMAGE_CACHE_TTL: seconds before a cached image is downloaded again
+- SCRAPER_IMAGE_CACHE_MAX_BYTES: total size of the cache, 0 disables caching
+"""
+
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import mimetypes
+import os
+from pathlib import Path
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import BinaryIO, Iterable, Iterator
+
+import py_common.log as log
+
+CACHE_DIR = Path(
+    os.environ.get("SCRAPER_IMAGE_CACHE_DIR")
+    or Path(tempfile.gettempdir()) / "stash-scraper-images"
+)
+CACHE_TTL = int(os.environ.get("SCRAPER_IMAGE_CACHE_TTL", 7 * 24 * 60 * 60))
+CACHE_MAX_BYTES = int(
+    os.environ.get("SCRAPER_IMAGE_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+)
+
+# Images fetched at the same time by data_urls / fetch_many
+MAX_WORKERS = 8
+
+# Base64 turns every 3 bytes into 4 characters: encoding in multiples of 3
+# lets us encode chunk by chunk without padding in the middle of the output
+CHUNK_SIZE = 3 * 64 * 1024
+
+# Magic numbers of the image formats Stash can display
+SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+)
+
+_lock = threading.Lock()
+_db: sqlite3.Connection | None = None
+
+
+def sniff_mime(data: bytes, default: str = "image/jpeg") -> str:
+    """
+    Guesses the MIME type of an image from its first bytes
+    """
+    for signature, mime in SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp" and data[8:12] in (b"avif", b"avis"):
+        return "image/avif"
+    if data.lstrip()[:5] in (b"<svg ", b"<?xml"):
+        return "image/svg+xml"
+    return default
+
+
+def __encode(stream: BinaryIO, head: bytes = b"") -> Iterator[str]:
+    carry = head
+    while chunk := stream.read(CHUNK_SIZE):
+        # Only encode whole 3-byte groups and carry the rest over to the next chunk
+        data = carry + chunk
+        cut = len(data) - len(data) % 3
+        yield b64encode(data[:cut]).decode("ascii")
+        carry = data[cut:]
+    if carry:
+        yield b64encode(carry).decode("ascii")
+
+
+def to_data_url(data: bytes | BinaryIO, mime: str | None = None) -> str:
+    """
+    Encodes raw image bytes or a binary stream as a data URL
+
+    The MIME type is sniffed from the data unless given
+    """
+    if isinstance(data, (bytes, bytearray)):
+        mime = mime or sniff_mime(data)
+        return f"data:{mime};base64,{b64encode(data).decode('ascii')}"
+    head = data.read(16)
+    mime = mime or sniff_mime(head)
+    return f"data:{mime};base64,{''.join(__encode(data, head))}"
+
+
+def file_data_url(path: str | Path) -> str:
+    """
+    Encodes an image file as a data URL without reading it into memory first
+    """
+    with open(path, "rb") as f:
+        head = f.read(16)
+        guessed, _ = mimetypes.guess_type(str(path))
+        mime = sniff_mime(head, default=guessed or "image/jpeg")
+        return f"data:{mime};base64,{''.join(__encode(f, head))}"
+
+
+def __connect() -> sqlite3.Connection:
+    global _db
+    if _db is None:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        _db = sqlite3.connect(
+            CACHE_DIR / "index.sqlite", timeout=10, check_same_thread=False
+        )
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                url TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires REAL NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS images_digest ON images (digest);
+            CREATE INDEX IF NOT EXISTS images_accessed ON images (accessed);
+            """
+        )
+    return _db
+
+
+def __blob_path(digest: str) -> Path:
+    return CACHE_DIR / digest[:2] / digest
+
+
+def __cached(url: str) -> bytes | None:
+    if not CACHE_MAX_BYTES:
+        return None
+    try:
+        with _lock:
+            db = __connect()
+            now = time.time()
+            row = db.execute(
+                "SELECT digest FROM images WHERE url = ? AND expires > ?", (url, now)
+            ).fetchone()
+            if not row:
+                return None
+            with db:
+                db.execute("UPDATE images SET accessed = ? WHERE url = ?", (now, url))
+        return __blob_path(row[0]).read_bytes()
+    except (OSError, sqlite3.Error) as e:
+        log.debug(f"Image cache miss for '{url}': {e}")
+        return None
+
+
+def __evict(db: sqlite3.Connection):
+    """
+    Drops expired entries, then the least recently used ones until the cache fits
+    """
+    with db:
+        db.execute("DELETE FROM images WHERE expires <= ?", (time.time(),))
+        total = 0
+        keep = set()
+        for digest, size in db.execute(
+            "SELECT digest, MAX(size) FROM images GROUP BY digest ORDER BY MAX(accessed) DESC"
+        ):
+            total += size
+            if total > CACHE_MAX_BYTES:
+                break
+            keep.add(digest)
+        stale = {
+            digest
+            for (digest,) in db.execute("SELECT DISTINCT digest FROM images")
+            if digest not in keep
+        }
+        db.executemany("DELETE FROM images WHERE digest = ?", ((d,) for d in stale))
+
+    # Blobs are shared between URLs, so only delete files nothing points to anymore
+    referenced = {digest for (digest,) in db.execute("SELECT digest FROM images")}
+    for blob in CACHE_DIR.glob("??/*"):
+        if blob.name not in referenced and not blob.name.endswith(".tmp"):
+            blob.unlink(missing_ok=True)
+
+
+def __store(url: str, data: bytes):
+    if not CACHE_MAX_BYTES or len(data) > CACHE_MAX_BYTES:
+        return
+    digest = hashlib.sha256(data).hexdigest()
+    blob = __blob_path(digest)
+    try:
+        if not blob.exists():
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary name first so readers never see half an image
+            tmp = blob.with_name(f"{digest}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, blob)
+        with _lock:
+            db = __connect()
+            now = time.time()
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO images (url, digest, size, expires, accessed) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (url, digest, len(data), now + CACHE_TTL, now),
+                )
+            total = db.execute(
+                "SELECT SUM(size) FROM (SELECT MAX(size) AS size FROM images GROUP BY digest)"
+            ).fetchone()[0]
+            if total and total > CACHE_MAX_BYTES:
+                __evict(db)
+    except (OSError, sqlite3.Error) as e:
+        log.debug(f"Failed to cache image '{url}': {e}")
+
+
+def fetch(url: str, cloudflare: bool = False, **kwargs) -> bytes | None:
+    """
+    Downloads an image, or reads it from the cache if it was downloaded recently
+
+    Extra keyword arguments like headers and timeout are passed on to py_common.http
+
+    Returns None if the image could not be downloaded
+    """
+    if (data := __cached(url)) is not None:
+        log.debug(f"Using cached image for '{url}'")
+        return data
+
+    # Imported lazily so scrapers that only encode local files do not need requests
+    from py_common import http
+
+    try:
+        response = http.get(url, cloudflare=cloudflare, **kwargs)
+    except Exception as e:
+        log.debug(f"Failed to fetch image '{url}': {e}")
+        return None
+    if response.status_code != 200 or not response.content:
+        log.debug(f"Failed to fetch image '{url}': status {response.status_code}")
+        return None
+
+    __store(url, response.content)
+    return response.content
+
+
+def fetch_many(
+    urls: Iterable[str], cloudflare: bool = False, **kwargs
+) -> list[bytes | None]:
+    """
+    Downloads several images concurrently, returning them in the same order as the URLs
+
+    Duplicate URLs are only downloaded once
+    """
+    urls = list(urls)
+    unique = list(dict.fromkeys(urls))
+    if len(unique) <= 1:
+        fetched = {url: fetch(url, cloudflare=cloudflare, **kwargs) for url in unique}
+    else:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(unique))) as pool:
+            results = pool.map(
+                lambda url: fetch(url, cloudflare=cloudflare, **kwargs), unique
+            )
+            fetched = dict(zip(unique, results))
+    return [fetched[url] for url in urls]
+
+
+def data_url(url: str, cloudflare: bool = False, **kwargs) -> str | None:
+    """
+    Downloads an image and encodes it as a data URL
+    """
+    if (data := fetch(url, cloudflare=cloudflare, **kwargs)) is None:
+        return None
+    return to_data_url(data)
+
+
+def data_urls(
+    urls: Iterable[str], cloudflare: bool = False, **kwargs
+) -> list[str | None]:
+    """
+    Downloads several images concurrently and encodes them as data URLs,
+    in the same order as the URLs: images that failed to download are None
+    """
+    return [
+        to_data_url(data) if data is not None else None
+        for data in fetch_many(urls, cloudflare=cloudflare, **kwargs)
+    ]
@@ -0,0 +1,158 @@
+"""
+Similarity scoring for matching search results against what we already know
+
+Uses rapidfuzz when it is installed and falls back to difflib otherwise:
+rapidfuzz computes the same kind of 0-1 ratio but is orders of magnitude faster
+when re-ranking hundreds of search results
+
+```python
+from py_common import match
+
+# Score once, then reuse: the query is only normalized once and
+# every candidate is only scored once no matter how often you ask
+title = match.Scorer("Some Scene Title")
+best, ratio = title.best(results, key=lambda r: r["title"])
+
+# Score several fields at once and get the results sorted by the average
+ranked = match.rank(
+    results,
+    {
+        "title": (fragment["title"], lambda r: r["title"]),
+        "date": (fragment["date"], lambda r: r["release_date"]),
+        "duration": (fragment["duration"], lambda r: r["length"]),
+    },
+)
+```
+"""
+
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Any, Callable, Iterable, TypeVar
+
+try:
+    from rapidfuzz.distance import Indel
+
+    def _raw_ratio(a: str, b: str) -> float:
+        return Indel.normalized_similarity(a, b)
+
+except ImportError:
+
+    def _raw_ratio(a: str, b: str) -> float:
+        return SequenceMatcher(None, a, b).ratio()
+
+
+T = TypeVar("T")
+
+
+@lru_cache(maxsize=4096)
+def normalize(text: str) -> str:
+    return text.lower().strip()
+
+
+@lru_cache(maxsize=16384)
+def __cached_ratio(a: str, b: str) -> float:
+    return _raw_ratio(a, b)
+
+
+def ratio(a: str | None, b: str | None, case_sensitive: bool = False) -> float:
+    """
+    Similarity of two strings as a float between 0 and 1
+
+    Missing values never match anything
+    """
+    if not a or not b:
+        return 0.0
+    if not case_sensitive:
+        a, b = normalize(a), normalize(b)
+    return __cached_ratio(a, b)
+
+
+def scalar(candidate: int | float, reference: int | float) -> float:
+    """
+    Similarity of two numbers, e.g. durations in seconds or sizes in bytes
+
+    1 means identical, 0 means they differ by as much as the reference itself or more
+    """
+    if not reference:
+        return 1.0 if candidate == reference else 0.0
+    return max(0.0, 1 - abs(candidate - reference) / reference)
+
+
+class Scorer:
+    """
+    Scores candidates against a single query, caching the score of every candidate
+    """
+
+    def __init__(self, query: str, case_sensitive: bool = False):
+        self.case_sensitive = case_sensitive
+        self.query = query if case_sensitive else normalize(query)
+        self.__scores: dict[str, float] = {}
+
+    def __call__(self, candidate: str | None) -> float:
+        if not candidate:
+            return 0.0
+        if (score := self.__scores.get(candidate)) is None:
+            text = candidate if self.case_sensitive else normalize(candidate)
+            score = self.__scores[candidate] = _raw_ratio(self.query, text)
+        return score
+
+    def scores(self, candidates: Iterable[str | None]) -> list[float]:
+        return [self(candidate) for candidate in candidates]
+
+    def best(
+        self, items: Iterable[T], key: Callable[[T], str | None]
+    ) -> tuple[T | None, float]:
+        """
+        Returns the item that best matches the query along with its score
+        """
+        best_item, best_score = None, -1.0
+        for item in items:
+            if (score := self(key(item))) > best_score:
+                best_item, best_score = item, score
+        return best_item, max(best_score, 0.0)
+
+    def sort(
+        self, items: Iterable[T], key: Callable[[T], str | None], reverse=True
+    ) -> list[T]:
+        """
+        Sorts items by how well they match the query, best match first
+        """
+        return sorted(items, key=lambda item: self(key(item)), reverse=reverse)
+
+
+def rank(
+    items: Iterable[T],
+    fields: dict[str, tuple[Any, Callable[[T], Any]]],
+) -> list[tuple[T, float, dict[str, float]]]:
+    """
+    Scores every item on several fields at once and sorts them by their average score
+
+    Fields map a name to the reference value and a function that extracts the
+    candidate value from an item: strings are compared by similarity and numbers
+    by how close they are. Pass a Scorer as the reference to compare strings with
+    case_sensitive set. Fields without a reference value or without a candidate
+    value are left out of an item's average
+
+    Returns (item, average score, score per field) tuples, best match first
+    """
+    scorers = {
+        name: Scorer(reference) if isinstance(reference, str) else reference
+        for name, (reference, _) in fields.items()
+        if reference not in (None, "")
+    }
+
+    ranked = []
+    for item in items:
+        scores = {}
+        for name, scorer in scorers.items():
+            candidate = fields[name][1](item)
+            if candidate in (None, ""):
+                continue
+            if isinstance(scorer, Scorer):
+                scores[name] = scorer(str(candidate))
+            else:
+                scores[name] = scalar(float(candidate), float(scorer))
+        average = sum(scores.values()) / len(scores) if scores else 0.0
+        ranked.append((item, average, scores))
+
+    return sorted(ranked, key=lambda r: r[1], reverse=True)
@@ -6,13 +6,17 @@
 
 # automatic retries with cloudscraper then (flaresolverr/ byparr) if blocked
 # caches flaresolverr cookies, userAgent for subsequent requests to same host
+# keeps one flaresolverr session (browser) per host alive between calls
 
 import os
+import threading
 import time
 import json
 import urllib.parse
 from pathlib import Path
 
+import py_common.http as http
+import py_common.ratelimit as ratelimit
 import py_common.log as log
 from py_common.cache import cache_to_disk
 from py_common.deps import ensure_requirements
@@ -34,6 +38,9 @@ def is_blocked(res):
       "just a moment", "attention required",
     ))
 
+  def detected(self):
+    return True
+
   def request(self, method, url, **kwargs):
     raise NotImplementedError
 
@@ -41,29 +48,29 @@ class RequestsBackend(RequestBackend):
   name = "requests"
 
   def __init__(self, proxies=None, useragent=None):
-    self.session = requests.Session()
-    if proxies:
-      self.session.proxies = proxies
-    if useragent == "inherit":
-      ua = get_useragent()
-      self.session.headers.update({"User-Agent": ua})
-    elif useragent:
-      self.session.headers.update({"User-Agent": useragent})
-
-  def _apply_cache(self, url):
+    # Connections are pooled per host in py_common.http and shared with
+    # every other scraper module running in this process
+    self.proxies = proxies or None
+    self.useragent = get_useragent() if useragent == "inherit" else useragent
+
+  def _apply_cache(self, url, session):
     cache_entry = cookie_cache.get(url)
     if cache_entry:
       log.debug(f"[proxy] Using cache for {url}")
       for cookie in cache_entry['cookies']:
-        self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'])
-      if cache_entry['useragent']:
-        self.session.headers.update({"User-Agent": cache_entry['useragent']})
-    return bool(cache_entry)
+        session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'])
+      return cache_entry['useragent']
+    return None
 
   def request(self, method, url, **kwargs):
-    self._apply_cache(url)
+    session = http.session_for(url)
+    useragent = self._apply_cache(url, session) or self.useragent
+    if useragent:
+      kwargs["headers"] = {"User-Agent": useragent, **(kwargs.get("headers") or {})}
+    if self.proxies:
+      kwargs.setdefault("proxies", self.proxies)
     try:
-      res = self.session.request(method, url, **kwargs)
+      res = session.request(method, url, **kwargs)
       if not self.is_blocked(res):
         return res
       log.warning(f"[proxy] requests blocked ({res.status_code}).")
@@ -80,6 +87,7 @@ def __init__(self, proxies=None):
       self.scraper.proxies = proxies
 
   def request(self, method, url, **kwargs):
+    ratelimit.wait(url)
     try:
       res = self.scraper.request(method, url, **kwargs)
       if not self.is_blocked(res):
@@ -92,20 +100,39 @@ def request(self, method, url, **kwargs):
 class FlareSolverrBackend(RequestBackend):
   name = "flaresolverr"
 
+  def __init__(self, proxies=None, available=None):
+    # FlareSolverr is only looked for once per backend, not before every request
+    self.available = available
+
+  def detected(self):
+    if self.available is None:
+      self.available = check_flaresolverr(FLARESOLVERR_URL)
+    return self.available
+
   def request(self, method, url, **kwargs):
-    if check_flaresolverr(FLARESOLVERR_URL):
-      log.info(f"[proxy] trying FlareSolverr for {url}")
-      # HEAD is not supported
-      if method == "head":
-        method = "get"
-        log.warning("[proxy] HEAD not supported by FlareSolverr, using GET instead")
+    if not self.detected():
+      raise Exception("FlareSolverr not detected")
+    log.info(f"[proxy] trying FlareSolverr for {url}")
+    # HEAD is not supported
+    if method == "head":
+      method = "get"
+      log.warning("[proxy] HEAD not supported by FlareSolverr, using GET instead")
+    post_data = (kwargs.get("json") or kwargs.get("data")) if method == "post" else None
+    host = urllib.parse.urlparse(url).netloc
+    ratelimit.wait(url)
+    # A saved session can be gone if FlareSolverr restarted: retry once with a new one
+    for _ in range(2):
       try:
-        post_data = (kwargs.get("json") or kwargs.get("data")) if method == "post" else None
-        return flaresolverr_req(url, method=method, postData=post_data, proxy=PROXY_URL)
+        session = flaresolverr_sessions.get(host)
+        # the cookies it returns are cached, so requests to this host go through
+        # the requests backend until the clearance expires
+        return flaresolverr_req(url, method=method, postData=post_data, proxy=PROXY_URL, session=session)
+      except FlareSolverrSessionError as e:
+        log.debug(f"[proxy] FlareSolverr session for {host} is gone: {e}")
+        flaresolverr_sessions.discard(host)
       except Exception as e:
         log.warning(f"[proxy] FlareSolverr request failed: {e}")
-    else:
-      raise Exception("FlareSolverr not detected")
+        break
     raise Exception("FlareSolverr backend failed")
 
 ## END REWRITE
@@ -135,19 +162,32 @@ def get_useragent() -> str:
   chrome_ua = requests.get("https://feederbox826.github.io/user-agents/user-agents.json").json()[3]
   return chrome_ua
 
-def flaresolverr_req(url, method="get", postData=None, proxy=None) -> requests.Response:
+class FlareSolverrSessionError(Exception):
+  pass
+
+def flaresolverr_proxy(proxy):
   if proxy and "@" in proxy:
     log.warning("[proxy] Ignoring unsupported proxy for FlareSolverr")
-    proxy = None
+    return None
+  return { "url": proxy } if proxy else None
+
+def flaresolverr_req(url, method="get", postData=None, proxy=None, session=None) -> requests.Response:
   payload = {
     "cmd": f"request.{method}",
     "url": url,
-    "proxy": { "url": proxy } if proxy else None
   }
+  if session:
+    # the session's browser already has the proxy, and keeps its cookies between calls
+    payload["session"] = session
+    payload["session_ttl_minutes"] = FLARESOLVERR_SESSION_TTL
+  else:
+    payload["proxy"] = flaresolverr_proxy(proxy)
   if postData is not None:
     payload["postData"] = postData
   response = requests.post(FLARESOLVERR_URL, json=payload, timeout=60)
   if response.status_code != 200:
+    if session and "session" in response.text.lower():
+      raise FlareSolverrSessionError(response.text)
     raise Exception(f"FlareSolverr request failed with status code {response.status_code}: {response.text}")
   solution = response.json().get("solution")
   req_response = requests.Response()
@@ -159,6 +199,81 @@ def flaresolverr_req(url, method="get", postData=None, proxy=None) -> requests.R
   cookie_cache.set(req_response.url, solution.get("cookies", []), solution.get("userAgent"))
   return req_response
 
+# FlareSolverr sessions kept open at once, the least recently used one is closed first
+FLARESOLVERR_MAX_SESSIONS = int(os.environ.get("FLARESOLVERR_MAX_SESSIONS", 3))
+# FlareSolverr replaces the browser of a session once it is this many minutes old
+FLARESOLVERR_SESSION_TTL = 30
+
+class FlareSolverrSessions:
+  """
+  Pool of FlareSolverr sessions, one per host
+
+  A session keeps its browser running between requests, so only the first request
+  to a host pays for starting a browser and solving the challenge. The sessions live
+  in FlareSolverr itself: their ids are saved next to this file so later scraper
+  runs keep using them
+  """
+  def __init__(self, url):
+    self.url = url
+    self.lock = threading.Lock()
+    self.sessions = {}
+    self.sessions_file = Path(__file__).parent / "flaresolverr_sessions.json"
+    if self.sessions_file.exists():
+      try:
+        self.sessions = json.loads(self.sessions_file.read_text(encoding="utf-8"))
+      except json.JSONDecodeError:
+        pass
+
+  def command(self, cmd, **params):
+    response = requests.post(self.url, json={ "cmd": cmd, **params }, timeout=60)
+    if response.status_code != 200:
+      raise Exception(f"FlareSolverr {cmd} failed with status code {response.status_code}: {response.text}")
+    return response.json()
+
+  def get(self, host):
+    with self.lock:
+      if entry := self.sessions.get(host):
+        entry["used"] = time.time()
+        self.update()
+        return entry["id"]
+      while len(self.sessions) >= FLARESOLVERR_MAX_SESSIONS:
+        oldest = min(self.sessions, key=lambda h: self.sessions[h]["used"])
+        self.destroy(oldest)
+      session_id = f"stash-{host}"
+      log.debug(f"[proxy] creating FlareSolverr session for {host}")
+      params = { "session": session_id }
+      if proxy := flaresolverr_proxy(PROXY_URL):
+        params["proxy"] = proxy
+      result = self.command("sessions.create", **params)
+      self.sessions[host] = { "id": result.get("session") or session_id, "used": time.time() }
+      self.update()
+      return self.sessions[host]["id"]
+
+  def destroy(self, host):
+    entry = self.sessions.pop(host, None)
+    if not entry:
+      return
+    log.debug(f"[proxy] destroying FlareSolverr session for {host}")
+    try:
+      self.command("sessions.destroy", session=entry["id"])
+    except Exception as e:
+      log.debug(f"[proxy] failed to destroy FlareSolverr session {entry['id']}: {e}")
+    self.update()
+
+  def discard(self, host):
+    with self.lock:
+      self.destroy(host)
+
+  def destroy_all(self):
+    with self.lock:
+      for host in list(self.sessions):
+        self.destroy(host)
+
+  def update(self):
+    self.sessions_file.write_text(json.dumps(self.sessions), encoding="utf-8")
+
+flaresolverr_sessions = FlareSolverrSessions(FLARESOLVERR_URL)
+
 class CookieCache:
   def __init__(self):
     self.cache = {}
@@ -191,39 +306,133 @@ def update(self):
 
 cookie_cache = CookieCache()
 
+# How long the backend that last got through to a host is tried first
+BACKEND_MEMORY_TTL = 24 * 60 * 60
+
+class BackendStats:
+  """
+  Per host memory of which backend last got through, along with the
+  number of successes, failures and the time spent in each backend
+
+  Saved next to this file so later scraper runs start with the backend
+  that works for the host instead of being blocked by the others first
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.hosts = {}
+    self.stats_file = Path(__file__).parent / "proxy_backends.json"
+    if self.stats_file.exists():
+      try:
+        self.hosts = json.loads(self.stats_file.read_text(encoding="utf-8"))
+      except json.JSONDecodeError:
+        pass
+
+  def preferred(self, url):
+    entry = self.hosts.get(urllib.parse.urlparse(url).netloc)
+    if not entry or not entry.get("preferred"):
+      return None
+    if entry.get("since", 0) + BACKEND_MEMORY_TTL < time.time():
+      return None
+    return entry["preferred"]
+
+  def record(self, url, backend, succeeded, seconds):
+    host = urllib.parse.urlparse(url).netloc
+    with self.lock:
+      entry = self.hosts.setdefault(host, { "preferred": None, "since": 0, "backends": {} })
+      stats = entry["backends"].setdefault(backend, { "succeeded": 0, "failed": 0, "seconds": 0.0 })
+      stats["succeeded" if succeeded else "failed"] += 1
+      stats["seconds"] = round(stats["seconds"] + seconds, 3)
+      if succeeded and entry["preferred"] != backend:
+        log.debug(f"[proxy] {backend} is now the preferred backend for {host}")
+        entry["preferred"] = backend
+      if succeeded:
+        entry["since"] = time.time()
+      self.update()
+
+  def summary(self, host=None):
+    """
+    Success rate and average latency of each backend, per host
+    """
+    summary = {}
+    for name, entry in self.hosts.items():
+      if host and name != host:
+        continue
+      summary[name] = { "preferred": entry.get("preferred"), "backends": {} }
+      for backend, stats in entry["backends"].items():
+        attempts = stats["succeeded"] + stats["failed"]
+        summary[name]["backends"][backend] = {
+          "attempts": attempts,
+          "success_rate": round(stats["succeeded"] / attempts, 3) if attempts else None,
+          "average_seconds": round(stats["seconds"] / attempts, 3) if attempts else None,
+        }
+    return summary
+
+  def update(self):
+    self.stats_file.write_text(json.dumps(self.hosts), encoding="utf-8")
+
+backend_stats = BackendStats()
+
 class BackendManager:
+  backend_classes = {
+    "requests": RequestsBackend,
+    "cloudscraper": CloudscraperBackend,
+    "flaresolverr": FlareSolverrBackend,
+  }
+
   def __init__(self, backends=None):
-    proxies = { "http": PROXY_URL, "https": PROXY_URL } if PROXY_URL else {}
-    if not backends:
-      self.backends = [
-        RequestsBackend(proxies=proxies, useragent="inherit"),
-        CloudscraperBackend(proxies=proxies),
-      ]
-      if check_flaresolverr(FLARESOLVERR_URL):
-        self.backends.append(FlareSolverrBackend())
-    else:
-      # populate backends based on name
-      backend_classes = {
-        "requests": RequestsBackend,
-        "cloudscraper": CloudscraperBackend,
-        "flaresolverr": FlareSolverrBackend,
-      }
-      self.backends = []
-      for name in backends:
-        cls = backend_classes.get(name)
-        if cls:
-          self.backends.append(cls(proxies=proxies))
-        else:
-          log.warning(f"[proxy] Unknown backend specified: {name}")
+    self.proxies = { "http": PROXY_URL, "https": PROXY_URL } if PROXY_URL else {}
+    self.names = []
+    for name in backends or self.backend_classes:
+      if name in self.backend_classes:
+        self.names.append(name)
+      else:
+        log.warning(f"[proxy] Unknown backend specified: {name}")
+    # backends are only created once a request needs them
+    self.backends = {}
+
+  def backend(self, name):
+    if name not in self.backends:
+      if name == "requests":
+        self.backends[name] = RequestsBackend(proxies=self.proxies, useragent="inherit")
+      else:
+        self.backends[name] = self.backend_classes[name](proxies=self.proxies)
+    return self.backends[name]
+
+  def order(self, url):
+    """
+    Backends to try for a URL: the one that last got through to the host first,
+    except that cookies FlareSolverr got for the host are meant for requests
+    """
+    names = list(self.names)
+    preferred = self.preferred(url)
+    if preferred in names:
+      names.remove(preferred)
+      names.insert(0, preferred)
+    return names
+
+  def preferred(self, url):
+    if "requests" in self.names and cookie_cache.get(url):
+      return "requests"
+    return backend_stats.preferred(url)
 
   def request(self, method, url, **kwargs):
-    for backend in self.backends:
+    for name in self.order(url):
+      backend = self.backend(name)
+      if not backend.detected():
+        continue
+      start = time.perf_counter()
       try:
-        return backend.request(method, url, **kwargs)
+        res = backend.request(method, url, **kwargs)
+        backend_stats.record(url, name, True, time.perf_counter() - start)
+        return res
       except Exception as e:
-        log.debug(f"[proxy] {backend.name} failed: {e}")
+        backend_stats.record(url, name, False, time.perf_counter() - start)
+        log.debug(f"[proxy] {name} failed: {e}")
     raise Exception("All backends failed")
 
+  def stats(self, url=None):
+    return backend_stats.summary(urllib.parse.urlparse(url).netloc if url else None)
+
 class StashRequests:
   def __init__ (self, cloudflare=False, useragent="inherit"):
     self.proxies = { "http": PROXY_URL, "https": PROXY_URL } if PROXY_URL else {}
@@ -231,6 +440,9 @@ def __init__ (self, cloudflare=False, useragent="inherit"):
     self.useragent = useragent
     self.manager = BackendManager()
 
+  def request(self, method, url, **kwargs):
+    return self.manager.request(method, url, **kwargs)
+
   def get(self, url, **kwargs):
     return self.manager.request("get", url, **kwargs)
 
@@ -0,0 +1,256 @@
+"""
+Per-host rate limiting shared by every scraper process
+
+When Stash scrapes in parallel (e.g. the tagger) every scraper runs in its own
+process, so limits kept in memory only space out the requests of one process.
+This module keeps a token bucket per host in a small SQLite file instead: all
+processes draw from the same bucket, and a 429 seen by one of them makes the
+others back off as well
+
+Requests made through py_common.http are limited automatically:
+
+```python
+from py_common import ratelimit
+
+# Blocks until a request to this host is allowed
+ratelimit.wait("https://www.iafd.com/results.asp")
+
+# The site said we're going too fast: nobody talks to it until Retry-After has passed,
+# or for a jittered exponential backoff if it didn't send one
+ratelimit.backoff("https://www.iafd.com", response.headers.get("Retry-After"), attempt)
+
+# Or for a number of seconds
+ratelimit.backoff("https://www.iafd.com", 10)
+```
+
+Only hosts known to ban scrapers that go too fast are limited by default, and
+servers on the local network never are. Backoffs after a 429 apply to every host.
+
+Limits can be changed in py_common/config.ini. The buckets live in the
+temporary directory unless the SCRAPER_RATELIMIT_FILE environment variable
+points to another file
+"""
+
+from email.utils import parsedate_to_datetime
+import ipaddress
+import os
+from pathlib import Path
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+import py_common.log as log
+from py_common.config import get_config
+
+config = get_config(
+    default="""
+# Requests per second to a single host, shared by all scrapers running at the same time
+# 0 leaves hosts without a limit of their own unlimited
+requests_per_second = 0
+
+# Hosts that need a different limit, as host: requests per second separated by commas
+# A host also covers its subdomains: iafd.com limits www.iafd.com as well
+host_requests_per_second = iafd.com: 1, javlibrary.com: 0.4, javlib.com: 0.4
+""",
+    shared=True,
+)
+
+LIMITS_PATH = Path(
+    os.environ.get("SCRAPER_RATELIMIT_FILE")
+    or Path(tempfile.gettempdir()) / "stash-scraper-ratelimit.sqlite"
+)
+
+# Backoff after a 429 without Retry-After: doubles with every attempt
+BACKOFF_BASE = 2
+BACKOFF_MAX = 5 * 60
+
+_lock = threading.Lock()
+_db: sqlite3.Connection | None = None
+
+
+def __parse_limits(value) -> dict[str, float]:
+    limits = {}
+    for entry in str(value or "").split(","):
+        host, _, rate = entry.partition(":")
+        try:
+            limits[host.strip().lower()] = float(rate)
+        except ValueError:
+            if entry.strip():
+                log.warning(f"Ignoring invalid rate limit '{entry.strip()}'")
+    return limits
+
+
+DEFAULT_RATE = float(config.requests_per_second or 0)
+HOST_RATES = __parse_limits(config.host_requests_per_second)
+
+# Hosts we never limit, like the local Stash server
+_exempt: set[str] = set()
+
+
+def __connect() -> sqlite3.Connection:
+    global _db
+    if _db is None:
+        LIMITS_PATH.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit: transactions are started explicitly with BEGIN IMMEDIATE
+        _db = sqlite3.connect(
+            LIMITS_PATH, timeout=10, isolation_level=None, check_same_thread=False
+        )
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS buckets (
+                host TEXT PRIMARY KEY,
+                next_free REAL NOT NULL DEFAULT 0,
+                blocked_until REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+    return _db
+
+
+def host_of(url: str) -> str:
+    return (urlparse(url).hostname or url).lower()
+
+
+def exempt(url: str):
+    """
+    Stops limiting requests to the host of the URL
+    """
+    _exempt.add(host_of(url))
+
+
+def is_local(host: str) -> bool:
+    """
+    Whether the host is on this machine or the local network, like a Stash or XBVR server
+    """
+    if host == "localhost" or "." not in host or host.endswith((".local", ".lan")):
+        return True
+    try:
+        address = ipaddress.ip_address(host.strip("[]"))
+    except ValueError:
+        return False
+    return address.is_private or address.is_loopback or address.is_link_local
+
+
+def rate_for(host: str) -> float:
+    """
+    Requests per second allowed to a host: the most specific
+    configured domain wins, then the default
+    """
+    if host in _exempt or is_local(host):
+        return 0
+    parts = host.split(".")
+    for i in range(len(parts)):
+        if (domain := ".".join(parts[i:])) in HOST_RATES:
+            return HOST_RATES[domain]
+    return DEFAULT_RATE
+
+
+def __reserve(host: str, rate: float) -> float:
+    """
+    Takes a token from the bucket of a host and returns how long to wait before using it
+
+    The bucket holds up to one second worth of requests and is stored as the time
+    at which it will be full again, so waiting requests queue up in order
+    """
+    interval = 1 / rate
+    # how far ahead of its schedule the bucket may be: the tokens beyond the first
+    tolerance = (max(1.0, rate) - 1) * interval
+    with _lock:
+        db = __connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT next_free, blocked_until FROM buckets WHERE host = ?", (host,)
+            ).fetchone()
+            next_free, blocked_until = row or (0, 0)
+            now = time.time()
+            start = max(now, next_free - tolerance, blocked_until)
+            db.execute(
+                "INSERT INTO buckets (host, next_free) VALUES (?, ?) "
+                "ON CONFLICT (host) DO UPDATE SET next_free = excluded.next_free",
+                (host, max(next_free, start, now) + interval),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+    return start - now
+
+
+def __blocked_for(host: str) -> float:
+    """
+    Seconds left of a backoff for a host without a rate limit
+    """
+    with _lock:
+        row = __connect().execute(
+            "SELECT blocked_until FROM buckets WHERE host = ?", (host,)
+        ).fetchone()
+    return (row[0] - time.time()) if row else 0
+
+
+def wait(url: str):
+    """
+    Blocks until the rate limit of the host of the URL allows another request
+
+    Backoffs apply to every host, even the ones without a rate limit
+    """
+    host = host_of(url)
+    rate = rate_for(host)
+    try:
+        delay = __reserve(host, rate) if rate > 0 else __blocked_for(host)
+    except sqlite3.Error as e:
+        log.debug(f"Failed to read rate limits from '{LIMITS_PATH}': {e}")
+        return
+    if delay > 0:
+        log.debug(f"Rate limiting requests to {host}: waiting {delay:.1f} seconds")
+        time.sleep(delay)
+
+
+def parse_retry_after(value: str | float | None) -> float | None:
+    """
+    Seconds to wait according to a Retry-After header, either in seconds or as a date,
+    never more than BACKOFF_MAX so a site can't stall every scraper for hours
+    """
+    if value is None or value == "":
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(0.0, seconds), BACKOFF_MAX)
+
+
+def backoff(url: str, retry_after: str | float | None = None, attempt: int = 0) -> float:
+    """
+    Stops every process from sending requests to the host of the URL for a while:
+    as long as retry_after says (a Retry-After header or a number of seconds),
+    or a jittered exponential backoff without it
+
+    Returns the number of seconds the host is blocked for
+    """
+    host = host_of(url)
+    delay = parse_retry_after(retry_after)
+    if delay is None:
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt)
+        # Jitter so processes that were blocked together don't all come back at once
+        delay = delay / 2 + random.uniform(0, delay / 2)
+    log.warning(f"Backing off requests to {host} for {delay:.1f} seconds")
+    try:
+        with _lock:
+            db = __connect()
+            db.execute(
+                "INSERT INTO buckets (host, blocked_until) VALUES (?, ?) "
+                "ON CONFLICT (host) DO UPDATE SET "
+                "blocked_until = max(blocked_until, excluded.blocked_until)",
+                (host, time.time() + delay),
+            )
+    except sqlite3.Error as e:
+        log.debug(f"Failed to store backoff in '{LIMITS_PATH}': {e}")
+    return delay
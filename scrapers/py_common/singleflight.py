@@ -0,0 +1,187 @@
+"""
+Deduplicates identical requests made at the same time by several scraper processes
+
+When the Stash tagger scrapes several scenes with the same performer, every scene
+starts its own scraper process and they all fetch the same page at the same time.
+With single-flight only the first process to ask for a key does the work: the
+others wait for it and get its result from a short-lived shared store
+
+```python
+from py_common import singleflight
+
+# Anything that identifies the request: the URL with its parameters for example
+result = singleflight.do(f"iafd {url}", lambda: fetch_performer(url))
+
+# Or for every call of a function, keyed by its arguments
+@singleflight.single_flight(ttl=60)
+def fetch_performer(url):
+    ...
+```
+
+Results must be JSON serializable to be shared: when they are not, or when the
+fetch fails, the waiting processes do the work themselves
+
+The store lives in the temporary directory unless the
+SCRAPER_SINGLEFLIGHT_FILE environment variable points to another file
+"""
+
+from functools import wraps
+import hashlib
+import json
+import os
+from pathlib import Path
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Callable
+
+import py_common.log as log
+
+FLIGHTS_PATH = Path(
+    os.environ.get("SCRAPER_SINGLEFLIGHT_FILE")
+    or Path(tempfile.gettempdir()) / "stash-scraper-singleflight.sqlite"
+)
+
+# Seconds a result is kept for the processes that asked for it at the same time
+RESULT_TTL = 60
+
+# How long a process may take to do the work before others stop waiting for it:
+# long enough for a FlareSolverr request
+LEASE_SECONDS = 90
+POLL_INTERVAL = 0.1
+
+_lock = threading.Lock()
+_db: sqlite3.Connection | None = None
+
+
+def __connect() -> sqlite3.Connection:
+    global _db
+    if _db is None:
+        FLIGHTS_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _db = sqlite3.connect(FLIGHTS_PATH, timeout=10, check_same_thread=False)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS flights (
+                key TEXT PRIMARY KEY,
+                lease REAL NOT NULL DEFAULT 0,
+                result TEXT,
+                expires REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+    return _db
+
+
+def __read(key: str) -> tuple[bool, Any]:
+    """
+    Returns whether there is a shared result for the key, and the result
+    """
+    with _lock:
+        row = __connect().execute(
+            "SELECT result FROM flights WHERE key = ? AND result IS NOT NULL AND expires > ?",
+            (key, time.time()),
+        ).fetchone()
+    if not row:
+        return False, None
+    return True, json.loads(row[0])
+
+
+def __claim(key: str) -> bool:
+    """
+    Takes the lease to do the work for a key, False if another process holds it
+    """
+    now = time.time()
+    with _lock:
+        db = __connect()
+        with db:
+            # Results that have expired are cleaned up as we go
+            db.execute("DELETE FROM flights WHERE expires < ? AND lease < ?", (now, now))
+            db.execute("INSERT OR IGNORE INTO flights (key) VALUES (?)", (key,))
+            claimed = db.execute(
+                "UPDATE flights SET lease = ?, result = NULL "
+                "WHERE key = ? AND lease < ? AND (result IS NULL OR expires <= ?)",
+                (now + LEASE_SECONDS, key, now, now),
+            ).rowcount
+    return claimed == 1
+
+
+def __release(key: str, result: str | None, ttl: float):
+    with _lock:
+        db = __connect()
+        with db:
+            db.execute(
+                "UPDATE flights SET lease = 0, result = ?, expires = ? WHERE key = ?",
+                (result, time.time() + ttl, key),
+            )
+
+
+def do(key: str, fetch: Callable[[], Any], ttl: float = RESULT_TTL) -> Any:
+    """
+    Calls fetch unless another process is already doing so for the same key,
+    in which case this waits for that process and returns its result
+
+    The result is shared for ttl seconds, so processes that ask for
+    the key shortly after it was fetched get the same result
+    """
+    claimed = False
+    try:
+        found, result = __read(key)
+        if found:
+            log.debug(f"Using shared result for '{key}'")
+            return result
+        deadline = time.time() + LEASE_SECONDS
+        while not (claimed := __claim(key)):
+            # Someone else is already fetching this: wait for them
+            time.sleep(POLL_INTERVAL)
+            found, result = __read(key)
+            if found:
+                log.debug(f"Using result for '{key}' from another scraper")
+                return result
+            if time.time() > deadline:
+                break
+    except (sqlite3.Error, ValueError) as e:
+        log.debug(f"Failed to use single-flight store '{FLIGHTS_PATH}': {e}")
+        return fetch()
+
+    if not claimed:
+        # The lease belongs to another process that may still finish: leave it alone
+        log.debug(f"Stopped waiting for '{key}', fetching it ourselves")
+        return fetch()
+
+    shared = None
+    try:
+        result = fetch()
+        try:
+            shared = json.dumps(result, ensure_ascii=False)
+        except (TypeError, ValueError):
+            log.debug(f"Result for '{key}' can't be shared with other scrapers")
+        return result
+    finally:
+        try:
+            __release(key, shared, ttl)
+        except sqlite3.Error as e:
+            log.debug(f"Failed to use single-flight store '{FLIGHTS_PATH}': {e}")
+
+
+def single_flight(ttl: float = RESULT_TTL):
+    """
+    Deduplicates concurrent calls of the decorated function with the same arguments,
+    across every scraper process
+    """
+
+    def decorator(func):
+        # Scripts all run as __main__: the file tells apart functions with the same name
+        name = f"{Path(func.__code__.co_filename).stem}.{func.__qualname__}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            args_hash = hashlib.sha256(
+                json.dumps((args, sorted(kwargs.items())), default=str).encode("utf-8")
+            ).hexdigest()
+            return do(f"{name}_{args_hash}", lambda: func(*args, **kwargs), ttl)
+
+        return wrapper
+
+    return decorator
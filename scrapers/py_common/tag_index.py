@@ -0,0 +1,205 @@
+"""
+Local index of the tags in Stash, to map tag names and aliases to their IDs
+
+Downloading every tag with its aliases to find a few IDs costs megabytes on a
+Stash with tens of thousands of tags. The index keeps that mapping in a SQLite
+file instead and only downloads the tags again when they have changed: a single
+query for the number of tags and the last time one was updated tells us so
+
+```python
+from py_common import tag_index
+
+# Case-insensitive, names take precedence over aliases
+ids = tag_index.lookup(["Blowjob", "Cowgirl", "Not a tag"])
+# {"Blowjob": "12", "Cowgirl": "34"}
+
+tag_id = tag_index.find("Doggystyle")
+
+# Scrapers that talk to Stash with their own settings pass them along
+ids = tag_index.lookup(names, call=callGraphQL, server=SERVER_URL)
+```
+
+The index lives in the temporary directory unless the SCRAPER_TAG_INDEX
+environment variable points to another file
+"""
+
+import os
+from pathlib import Path
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Iterable
+
+import py_common.log as log
+from py_common import singleflight
+
+INDEX_PATH = Path(
+    os.environ.get("SCRAPER_TAG_INDEX")
+    or Path(tempfile.gettempdir()) / "stash-scraper-tag-index.sqlite"
+)
+
+STAMP_QUERY = """
+query TagIndexStamp {
+    findTags(filter: { per_page: 1, sort: "updated_at", direction: DESC }) {
+        count
+        tags { updated_at }
+    }
+}
+"""
+
+TAGS_QUERY = """
+query TagIndex {
+    findTags(filter: { per_page: -1 }) {
+        tags { id name aliases }
+    }
+}
+"""
+
+_lock = threading.Lock()
+_db: sqlite3.Connection | None = None
+# Servers whose index has been checked by this process
+_checked: set[str] = set()
+
+
+def __connect() -> sqlite3.Connection:
+    global _db
+    if _db is None:
+        INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _db = sqlite3.connect(INDEX_PATH, timeout=10, check_same_thread=False)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS tags (
+                server TEXT NOT NULL,
+                name TEXT NOT NULL,
+                tag_id TEXT NOT NULL,
+                PRIMARY KEY (server, name)
+            );
+            CREATE TABLE IF NOT EXISTS stamps (
+                server TEXT PRIMARY KEY,
+                count INTEGER NOT NULL,
+                updated_at TEXT,
+                checked REAL NOT NULL
+            );
+            """
+        )
+    return _db
+
+
+def __default_call() -> tuple[Callable[..., Any], str]:
+    # Imported lazily so scrapers with their own GraphQL settings don't need the config
+    from py_common import graphql
+
+    return graphql.callGraphQL, graphql.config.url
+
+
+def __stored_stamp(server: str) -> tuple[int, str | None] | None:
+    with _lock:
+        row = __connect().execute(
+            "SELECT count, updated_at FROM stamps WHERE server = ?", (server,)
+        ).fetchone()
+    return tuple(row) if row else None
+
+
+def __store(server: str, tags: list[dict], stamp: tuple[int, str | None]):
+    with _lock:
+        db = __connect()
+        with db:
+            db.execute("DELETE FROM tags WHERE server = ?", (server,))
+            db.executemany(
+                "INSERT OR IGNORE INTO tags (server, name, tag_id) VALUES (?, ?, ?)",
+                (
+                    (server, alias.lower(), tag["id"])
+                    for tag in tags
+                    for alias in tag.get("aliases") or []
+                ),
+            )
+            # Names take precedence over aliases
+            db.executemany(
+                "INSERT OR REPLACE INTO tags (server, name, tag_id) VALUES (?, ?, ?)",
+                ((server, tag["name"].lower(), tag["id"]) for tag in tags),
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO stamps (server, count, updated_at, checked) "
+                "VALUES (?, ?, ?, ?)",
+                (server, *stamp, time.time()),
+            )
+
+
+def __revalidate(server: str, call: Callable[..., Any]) -> bool:
+    """
+    Downloads the tags again if they changed since the index was built,
+    returns False if there is no usable index
+    """
+    stored = __stored_stamp(server)
+    result = call(STAMP_QUERY)
+    if not result or not result.get("findTags"):
+        log.warning("Failed to check for changed tags in Stash")
+        return stored is not None
+    found = result["findTags"]
+    stamp = (found["count"], found["tags"][0]["updated_at"] if found["tags"] else None)
+    if stored == stamp:
+        log.debug(f"Tag index for {server} is up to date")
+        return True
+
+    log.debug(f"Tags in {server} changed, rebuilding the tag index")
+    result = call(TAGS_QUERY)
+    if not result or not result.get("findTags"):
+        log.error("Failed to get tags from Stash")
+        return stored is not None
+    __store(server, result["findTags"]["tags"], stamp)
+    return True
+
+
+def lookup(
+    names: Iterable[str],
+    call: Callable[..., Any] | None = None,
+    server: str | None = None,
+) -> dict[str, str]:
+    """
+    Maps tag names and aliases to their tag IDs, ignoring case:
+    names that match no tag are left out
+
+    call and server default to py_common.graphql and the Stash URL in its config
+    """
+    if call is None or server is None:
+        default_call, default_server = __default_call()
+        call = call or default_call
+        server = server or default_server
+    names = list(dict.fromkeys(names))
+    if not names:
+        return {}
+
+    try:
+        if server not in _checked:
+            # Scrapers that start together check the tags in Stash only once
+            if not singleflight.do(f"tag_index {server}", lambda: __revalidate(server, call)):
+                return {}
+            _checked.add(server)
+        with _lock:
+            wanted = {name.lower().strip() for name in names}
+            placeholders = ", ".join("?" * len(wanted))
+            rows = __connect().execute(
+                f"SELECT name, tag_id FROM tags WHERE server = ? AND name IN ({placeholders})",
+                (server, *wanted),
+            ).fetchall()
+    except sqlite3.Error as e:
+        log.error(f"Failed to use tag index '{INDEX_PATH}': {e}")
+        return {}
+
+    tag_ids = dict(rows)
+    return {
+        name: tag_ids[name.lower().strip()]
+        for name in names
+        if name.lower().strip() in tag_ids
+    }
+
+
+def find(
+    name: str, call: Callable[..., Any] | None = None, server: str | None = None
+) -> str | None:
+    """
+    Returns the ID of the tag with this name or alias, ignoring case
+    """
+    return lookup([name], call, server).get(name)
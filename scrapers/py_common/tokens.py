@@ -0,0 +1,244 @@
+"""
+Shared store for API tokens that scrapers have to scrape from a site first
+
+Several API scrapers need a token or key that is embedded in the homepage of a
+site before they can query the API. Fetching it is slow, so tokens are kept in
+a single SQLite file that every scraper process can safely read and write at
+the same time, with an expiry per (provider, site)
+
+```python
+from py_common import tokens
+
+def fetch_key():
+    # Scrape the homepage: return None if no key could be found,
+    # or tokens.Token(value, expires) if the key says when it expires
+    ...
+    return {"app_id": app_id, "api_key": api_key}
+
+key = tokens.get("algolia", "evilangel", fetch_key, ttl=24 * 60 * 60)
+```
+
+Only one process fetches a new token at a time: others that need the same
+token wait for it instead of all scraping the homepage at once. Tokens that
+are about to expire are refreshed in the background while the old one is
+still used, so the fetch overlaps with the scrape instead of delaying it
+
+The store lives next to py_common unless the SCRAPER_TOKENS_FILE environment
+variable points to another file
+"""
+
+import json
+import os
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, NamedTuple
+
+import py_common.log as log
+
+TOKENS_PATH = Path(
+    os.environ.get("SCRAPER_TOKENS_FILE") or Path(__file__).parent / "tokens.sqlite"
+)
+
+# Tokens are refreshed in the background once they are in
+# the last part of their lifetime
+REFRESH_AHEAD = 0.1
+
+# How long a process may take to fetch a token before others stop waiting for it
+LEASE_SECONDS = 30
+POLL_INTERVAL = 0.25
+
+
+class Token(NamedTuple):
+    value: Any
+    # Unix timestamp, falls back to the ttl passed to get when None
+    expires: float | None = None
+
+
+_lock = threading.Lock()
+_db: sqlite3.Connection | None = None
+
+
+def __connect() -> sqlite3.Connection:
+    global _db
+    if _db is None:
+        TOKENS_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _db = sqlite3.connect(TOKENS_PATH, timeout=10, check_same_thread=False)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tokens (
+                provider TEXT NOT NULL,
+                site TEXT NOT NULL,
+                value TEXT,
+                fetched REAL NOT NULL DEFAULT 0,
+                expires REAL NOT NULL DEFAULT 0,
+                lease REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (provider, site)
+            )
+            """
+        )
+    return _db
+
+
+def __read(provider: str, site: str) -> tuple[Any, float, float] | None:
+    with _lock:
+        row = __connect().execute(
+            "SELECT value, fetched, expires FROM tokens "
+            "WHERE provider = ? AND site = ? AND value IS NOT NULL",
+            (provider, site),
+        ).fetchone()
+    if not row:
+        return None
+    value, fetched, expires = row
+    return json.loads(value), fetched, expires
+
+
+def __claim(provider: str, site: str) -> bool:
+    """
+    Takes the lease to fetch a new token, False if another process holds it
+    """
+    now = time.time()
+    with _lock:
+        db = __connect()
+        with db:
+            db.execute(
+                "INSERT OR IGNORE INTO tokens (provider, site) VALUES (?, ?)",
+                (provider, site),
+            )
+            claimed = db.execute(
+                "UPDATE tokens SET lease = ? WHERE provider = ? AND site = ? AND lease < ?",
+                (now + LEASE_SECONDS, provider, site, now),
+            ).rowcount
+    return claimed == 1
+
+
+def __release(provider: str, site: str, token: Token | None, ttl: float):
+    now = time.time()
+    with _lock:
+        db = __connect()
+        with db:
+            if token is None:
+                db.execute(
+                    "UPDATE tokens SET lease = 0 WHERE provider = ? AND site = ?",
+                    (provider, site),
+                )
+            else:
+                db.execute(
+                    "UPDATE tokens SET value = ?, fetched = ?, expires = ?, lease = 0 "
+                    "WHERE provider = ? AND site = ?",
+                    (
+                        json.dumps(token.value),
+                        now,
+                        token.expires or now + ttl,
+                        provider,
+                        site,
+                    ),
+                )
+
+
+def __fetch(
+    provider: str, site: str, fetch: Callable[[], Any], ttl: float
+) -> Token | None:
+    token = None
+    try:
+        result = fetch()
+        if result is not None and not isinstance(result, Token):
+            result = Token(result)
+        if result is not None and result.value is not None:
+            token = result
+    except Exception as e:
+        log.warning(f"Failed to fetch {provider} token for '{site}': {e}")
+    finally:
+        __release(provider, site, token, ttl)
+    return token
+
+
+def get(
+    provider: str,
+    site: str,
+    fetch: Callable[[], Any],
+    ttl: float = 24 * 60 * 60,
+) -> Any | None:
+    """
+    Returns the stored token for a site, fetching a new one if there is none or
+    if it has expired
+
+    fetch is called without arguments and returns the token (anything that can be
+    stored as JSON), a Token with an explicit expiry, or None if it failed.
+    ttl is the lifetime of tokens that come without an explicit expiry
+
+    Returns None if no token could be fetched
+    """
+    try:
+        stored = __read(provider, site)
+    except (sqlite3.Error, ValueError) as e:
+        log.debug(f"Failed to read token store '{TOKENS_PATH}': {e}")
+        token = fetch()
+        return token.value if isinstance(token, Token) else token
+
+    now = time.time()
+    if stored and stored[2] > now:
+        value, fetched, expires = stored
+        if expires - now < (expires - fetched) * REFRESH_AHEAD and __claim(provider, site):
+            log.debug(f"Refreshing {provider} token for '{site}' in the background")
+            # A daemon so the scrape never waits for it: if the process exits first
+            # the lease runs out and the next scraper refreshes the token instead
+            threading.Thread(
+                target=__fetch, args=(provider, site, fetch, ttl), daemon=True
+            ).start()
+        return value
+
+    deadline = now + LEASE_SECONDS
+    while not __claim(provider, site):
+        # Someone else is already fetching this token: wait for them
+        time.sleep(POLL_INTERVAL)
+        if (stored := __read(provider, site)) and stored[2] > time.time():
+            return stored[0]
+        if time.time() > deadline:
+            break
+
+    log.debug(f"Fetching new {provider} token for '{site}'")
+    token = __fetch(provider, site, fetch, ttl)
+    return token.value if token else None
+
+
+def invalidate(provider: str, site: str):
+    """
+    Marks a token as expired, e.g. when the API rejects it
+    """
+    with _lock:
+        db = __connect()
+        with db:
+            db.execute(
+                "UPDATE tokens SET expires = 0 WHERE provider = ? AND site = ?",
+                (provider, site),
+            )
+
+
+def sites(provider: str) -> list[str]:
+    """
+    Lists every site a token has ever been stored for, expired or not
+    """
+    with _lock:
+        rows = __connect().execute(
+            "SELECT site FROM tokens WHERE provider = ? AND value IS NOT NULL ORDER BY site",
+            (provider,),
+        ).fetchall()
+    return [site for (site,) in rows]
+
+
+def put(provider: str, site: str, value: Any, expires: float):
+    """
+    Stores a token directly, e.g. when importing tokens from an older format
+    """
+    with _lock:
+        db = __connect()
+        with db:
+            db.execute(
+                "INSERT INTO tokens (provider, site, value, fetched, expires) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (provider, site) DO UPDATE SET "
+                "value = excluded.value, fetched = excluded.fetched, expires = excluded.expires",
+                (provider, site, json.dumps(value), time.time(), expires),
+            )
@@ -1,10 +1,11 @@
-import base64
-import imghdr
 import json
-import mimetypes
+import os
 import sys
 import sqlite3
 from os import path
+from pathlib import Path
+
+from py_common.images import to_data_url
 
 '''
 This script uses the sqlite database from another stash database and allows you to parse performers
@@ -13,9 +14,63 @@
 This script needs python3
 '''
 
+# Name and alias index kept next to this script: it is rebuilt
+# whenever stash-go.sqlite is replaced with a newer copy
+INDEX_PATH = Path(__file__).parent / 'stash-sqlite-index.sqlite'
+
+def open_source():
+    # The copy is never written to: immutable lets SQLite skip all locking
+    uri = Path('stash-go.sqlite').absolute().as_uri() + '?mode=ro&immutable=1'
+    source = sqlite3.connect(uri, uri=True, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
+    source.execute('PRAGMA mmap_size=268435456')
+    return source
+
+def performer_aliases_query():
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(performers)')]
+    if 'aliases' in columns:
+        return 'SELECT id,name,aliases FROM performers'
+    # Newer Stash schemas keep one row per alias
+    return '''SELECT performers.id,performers.name,group_concat(performer_aliases.alias,', ')
+              FROM performers LEFT JOIN performer_aliases ON performer_aliases.performer_id=performers.id
+              GROUP BY performers.id'''
+
+def open_index():
+    index = sqlite3.connect(INDEX_PATH)
+    index.executescript('''
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS names (name TEXT NOT NULL, id INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS names_name ON names (name);
+    ''')
+    try:
+        index.execute("CREATE VIRTUAL TABLE IF NOT EXISTS performers_fts USING fts5(name, aliases, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        # The trigram tokenizer needs SQLite 3.34: older builds fall back to scanning the names
+        index.execute('CREATE TABLE IF NOT EXISTS performers_fts (name TEXT, aliases TEXT)')
+    stat = os.stat('stash-go.sqlite')
+    source = f'{stat.st_mtime_ns}:{stat.st_size}'
+    row = index.execute("SELECT value FROM meta WHERE key='source'").fetchone()
+    if row is None or row[0] != source:
+        print("Indexing performers in stash-go.sqlite", file=sys.stderr)
+        with index:
+            index.execute('DELETE FROM names')
+            index.execute('DELETE FROM performers_fts')
+            rows = conn.execute(performer_aliases_query()).fetchall()
+            index.executemany('INSERT INTO names (name,id) VALUES (lower(?),?)', ((name, id) for id, name, _ in rows))
+            index.executemany('INSERT INTO performers_fts (rowid,name,aliases) VALUES (?,?,?)', rows)
+            index.execute("INSERT OR REPLACE INTO meta (key,value) VALUES ('source',?)", (source,))
+    return index
+
+def has_trigrams(index):
+    row = index.execute("SELECT sql FROM sqlite_master WHERE name='performers_fts'").fetchone()
+    return 'trigram' in row[0].lower()
+
 def query_performers(name):
-    c = conn.cursor()
-    c.execute('SELECT name FROM performers WHERE lower(name) like lower(?)',('%' + name + '%',))
+    c = index.cursor()
+    if len(name) >= 3 and has_trigrams(index):
+        # Trigrams match substrings of names and aliases without scanning every performer
+        c.execute('SELECT name FROM performers_fts WHERE performers_fts MATCH ? ORDER BY rowid', ('"' + name.replace('"', '""') + '"',))
+    else:
+        c.execute('SELECT name FROM performers_fts WHERE name LIKE ? OR aliases LIKE ? ORDER BY rowid', ('%' + name + '%',) * 2)
     rec=[]
     for row in c.fetchall():
         res={}
@@ -23,16 +78,12 @@ def query_performers(name):
         rec.append(res)
     return rec
 
-def make_image_data_url(image_data):
-    # type: (bytes,) -> str
-    img_type = imghdr.what(None, h=image_data) or 'jpeg'
-    mime = mimetypes.types_map.get('.' + img_type, 'image/jpeg')
-    encoded = base64.b64encode(image_data).decode()
-    return 'data:{0};base64,{1}'.format(mime, encoded)
-
 def fetch_performer_name(name):
+    row = index.execute('SELECT id FROM names WHERE name = lower(?) ORDER BY id LIMIT 1', (name,)).fetchone()
+    if row == None:
+       return {}
     c = conn.cursor()
-    c.execute('SELECT name,gender,url,twitter,instagram,date(birthdate),ethnicity,country,eye_color,height,measurements,fake_tits,career_length,tattoos,piercings,aliases,id FROM performers WHERE lower(name) = lower(?)', (name,))
+    c.execute('SELECT name,gender,url,twitter,instagram,date(birthdate),ethnicity,country,eye_color,height,measurements,fake_tits,career_length,tattoos,piercings,aliases,id FROM performers WHERE id = ?', (row[0],))
 
     row =c.fetchone()
     res={}
@@ -61,7 +112,7 @@ def fetch_performer_name(name):
     if row == None:
         return res
 
-    image = make_image_data_url(row[0])
+    image = to_data_url(row[0])
     res['images']=[image]
 
     return res
@@ -73,7 +124,8 @@ def fetch_performer_name(name):
     exit(1)
 
 
-conn = sqlite3.connect('stash-go.sqlite',detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
+conn = open_source()
+index = open_index()
 
 if sys.argv[1] == "query":
     fragment = json.loads(sys.stdin.read())
@@ -85,6 +137,7 @@ def fetch_performer_name(name):
     else:
         print (json.dumps(result))
     conn.close()
+    index.close()
 
 if sys.argv[1] == "fetch":
     fragment = json.loads(sys.stdin.read())
@@ -96,5 +149,6 @@ def fetch_performer_name(name):
     else:
         print (json.dumps(result))
     conn.close()
+    index.close()
 
 # Last Updated March 31, 2021
@@ -2,18 +2,21 @@
 import json
 import os
 import re
-import difflib
+import sqlite3
 from datetime import datetime
 from pathlib import Path
 
 from py_common.deps import ensure_requirements
-from py_common import graphql
+from py_common import graphql, log, match
 
 ensure_requirements("fastbencode")
 
 from fastbencode import bdecode # noqa: E402
 
 TORRENTS_PATH = Path("torrents")
+# Sizes and names of the files in every torrent, so we don't need
+# to decode every torrent for every scene we look up
+INDEX_PATH = Path(__file__).parent / "torrent-index.sqlite"
 
 
 def get_scene_data(fragment_data):
@@ -21,18 +24,9 @@ def get_scene_data(fragment_data):
     scene_title = fragment_data["title"]
     scene_files = []
 
-    response = graphql.callGraphQL("""
-    query FileInfoBySceneId($id: ID) {
-      findScene(id: $id) {
-        files {
-          path
-          size
-        }
-      }
-    }""", {"id": scene_id})
-
-    if response and response["findScene"]:
-        for f in response["findScene"]["files"]:
+    scene = graphql.getScene(scene_id, fields=["files.path", "files.size"])
+    if scene:
+        for f in scene["files"]:
             scene_files.append({"filename": os.path.basename(f["path"]), "size": f["size"]})
         return {"id": scene_id, "title": scene_title, "files": scene_files}
     return {}
@@ -84,35 +78,197 @@ def decode_bytes(s, encodings=("utf-8", "latin-1")):
     return s.decode("utf-8", "ignore")
 
 
-def scene_in_torrent(scene_data, torrent_data):
-    for scene in scene_data["files"]:
-        if b"length" in torrent_data[b"info"]:
-            if scene["filename"] in decode_bytes(torrent_data[b"info"][b"name"]) and torrent_data[b"info"][b"length"] == scene["size"]:
-                return True
-        elif b"files" in torrent_data[b"info"]:
-            for file in torrent_data[b"info"][b"files"]:
-                if scene["filename"] in decode_bytes(file[b"path"][-1]) and file[b"length"] == scene["size"]:
-                    return True
+def bdecode_skipping(data, i=0, skip=frozenset()):
+    """
+    Minimal bencode decoder that never copies the values of dictionary keys
+    in skip: the piece hashes make up most of a torrent file and we don't need them
+
+    Returns the decoded value and the index right after it
+    """
+    c = data[i : i + 1]
+    if c == b"i":
+        end = data.index(b"e", i)
+        return int(data[i + 1 : end]), end + 1
+    if c == b"l":
+        i += 1
+        items = []
+        while data[i : i + 1] != b"e":
+            item, i = bdecode_skipping(data, i, skip)
+            items.append(item)
+        return items, i + 1
+    if c == b"d":
+        i += 1
+        items = {}
+        while data[i : i + 1] != b"e":
+            key, i = bdecode_skipping(data, i)
+            if key in skip and data[i : i + 1].isdigit():
+                colon = data.index(b":", i)
+                i = colon + 1 + int(data[i:colon])
+                continue
+            items[key], i = bdecode_skipping(data, i, skip)
+        return items, i + 1
+    colon = data.index(b":", i)
+    end = colon + 1 + int(data[i:colon])
+    return data[colon + 1 : end], end
+
+
+def torrent_files(path):
+    """
+    Returns the (filename, length) of every file in a torrent
+    """
+    torrent, _ = bdecode_skipping(path.read_bytes(), skip=frozenset([b"pieces"]))
+    info = torrent[b"info"]
+    if b"length" in info:
+        return [(decode_bytes(info[b"name"]), info[b"length"])]
+    return [
+        (decode_bytes(file[b"path"][-1]), file[b"length"])
+        for file in info.get(b"files", [])
+    ]
+
+
+def open_index():
+    conn = sqlite3.connect(INDEX_PATH)
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS torrents (
+            path TEXT PRIMARY KEY,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS files (
+            torrent TEXT NOT NULL,
+            name TEXT NOT NULL,
+            length INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS files_length ON files (length);
+        CREATE INDEX IF NOT EXISTS files_torrent ON files (torrent);
+        CREATE TABLE IF NOT EXISTS names (
+            path TEXT PRIMARY KEY,
+            title TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS trigrams (
+            trigram TEXT NOT NULL,
+            path TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS trigrams_trigram ON trigrams (trigram);
+        CREATE INDEX IF NOT EXISTS trigrams_path ON trigrams (path);
+        """
+    )
+    return conn
+
+
+def update_index(conn):
+    """
+    Brings the index up to date with the torrents folder: only torrents
+    that were added or modified since the last run are decoded
+    """
+    indexed = {
+        path: (mtime, size)
+        for path, mtime, size in conn.execute("SELECT path, mtime, size FROM torrents")
+    }
+    on_disk = {}
+    for torrent in TORRENTS_PATH.glob("*.torrent"):
+        stat = torrent.stat()
+        on_disk[str(torrent)] = (stat.st_mtime, stat.st_size)
+
+    with conn:
+        for path in indexed.keys() - on_disk.keys():
+            conn.execute("DELETE FROM files WHERE torrent = ?", (path,))
+            conn.execute("DELETE FROM torrents WHERE path = ?", (path,))
+        for path, (mtime, size) in on_disk.items():
+            if indexed.get(path) == (mtime, size):
+                continue
+            try:
+                files = torrent_files(Path(path))
+            except (OSError, ValueError, KeyError) as e:
+                log.warning(f"Unable to index '{path}': {e}")
+                files = []
+            conn.execute("DELETE FROM files WHERE torrent = ?", (path,))
+            conn.executemany(
+                "INSERT INTO files (torrent, name, length) VALUES (?, ?, ?)",
+                [(path, name, length) for name, length in files],
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO torrents (path, mtime, size) VALUES (?, ?, ?)",
+                (path, mtime, size),
+            )
 
 
 def process_torrents(scene_data):
     if scene_data:
-        for name in TORRENTS_PATH.glob("*.torrent"):
-            with open(name, "rb") as f:
-                torrent_data = bdecode(f.read())
-                if scene_in_torrent(scene_data, torrent_data):
-                    return get_torrent_metadata(torrent_data)
+        conn = open_index()
+        update_index(conn)
+        for scene in scene_data["files"]:
+            candidates = conn.execute(
+                "SELECT torrent, name FROM files WHERE length = ?", (scene["size"],)
+            )
+            for torrent, name in candidates:
+                if scene["filename"] in name:
+                    with open(torrent, "rb") as f:
+                        return get_torrent_metadata(bdecode(f.read()))
     return {}
 
 def similarity_file_name(search, fileName):
-    result = difflib.SequenceMatcher(a=search.lower(), b=fileName.lower())
-    return result.ratio()
+    return match.ratio(search, fileName)
 
 def cleanup_name(name):
     ret = str(name)
     ret = ret.removeprefix("torrents\\").removesuffix(".torrent")
     return ret
 
+
+def trigrams(text):
+    normalized = " " + " ".join(re.split(r"[\W_]+", text.lower())).strip() + " "
+    return {normalized[i : i + 3] for i in range(len(normalized) - 2)}
+
+
+def update_name_index(conn):
+    """
+    Keeps the trigram index of torrent names in sync with the torrents folder
+    """
+    indexed = {path for (path,) in conn.execute("SELECT path FROM names")}
+    on_disk = {str(t.absolute()): t for t in TORRENTS_PATH.rglob("*.torrent")}
+    with conn:
+        for path in indexed - on_disk.keys():
+            conn.execute("DELETE FROM trigrams WHERE path = ?", (path,))
+            conn.execute("DELETE FROM names WHERE path = ?", (path,))
+        for path in on_disk.keys() - indexed:
+            title = cleanup_name(on_disk[path])
+            conn.execute("INSERT INTO names (path, title) VALUES (?, ?)", (path, title))
+            conn.executemany(
+                "INSERT INTO trigrams (trigram, path) VALUES (?, ?)",
+                [(trigram, path) for trigram in trigrams(Path(title).name)],
+            )
+    return len(on_disk)
+
+
+def search_torrents(conn, search, limit=5, candidates=50):
+    """
+    Finds the torrents with names most similar to the search
+
+    The trigram index narrows things down to the names that share the most
+    trigrams with the search, and only those are scored
+    """
+    search_trigrams = list(trigrams(search))
+    if search_trigrams:
+        placeholders = ",".join("?" * len(search_trigrams))
+        rows = conn.execute(
+            f"""
+            SELECT names.path, names.title FROM trigrams
+            JOIN names ON names.path = trigrams.path
+            WHERE trigram IN ({placeholders})
+            GROUP BY trigrams.path
+            ORDER BY COUNT(*) DESC
+            LIMIT ?
+            """,
+            (*search_trigrams, candidates),
+        ).fetchall()
+    else:
+        rows = conn.execute("SELECT path, title FROM names").fetchall()
+
+    scored = match.Scorer(search).sort(rows, key=lambda row: row[1])
+    return [{"url": path, "title": title} for path, title in scored[:limit]]
+
 if sys.argv[1] == "query":
     fragment = json.loads(sys.stdin.read())
     print(json.dumps(process_torrents(get_scene_data(fragment))))
@@ -123,18 +279,11 @@ def cleanup_name(name):
         print(json.dumps(get_torrent_metadata(torrent_data)))
 elif sys.argv[1] == "search":
     search = json.loads(sys.stdin.read()).get('name')
-    torrents = list(TORRENTS_PATH.rglob('*.torrent'))
-    if len(torrents) == 0:
+    conn = open_index()
+    if update_name_index(conn) == 0:
         print("No torrents found")
         exit(1)
-    ratios = {}
-    for t in torrents:
-        clean_t = cleanup_name(t)
-        ratios[round(10000*(1-similarity_file_name(search, clean_t)))] = {'url': str(t.absolute()), 'title': clean_t}
-
-    # Order ratios
-    ratios_sorted = dict(sorted(ratios.items())[:5])
 
-    print(json.dumps(list(ratios_sorted.values())))
+    print(json.dumps(search_torrents(conn, search)))
 
 # Last Updated May 29, 2024
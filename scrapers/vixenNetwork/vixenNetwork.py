@@ -3,11 +3,11 @@
 import sys
 from urllib.parse import urlparse
 from datetime import datetime, timedelta
-import py_common.log as log
 
-from py_common.proxy import StashRequests
+import py_common.log as log
 
-requests = StashRequests()
+from py_common import http, tag_index
+from py_common.graphql import callGraphQLBatch
 
 # Max number of scenes that a site can return for the search.
 MAX_SCENES = 6
@@ -46,7 +46,7 @@ def callGraphQL(query, variables=None):
     if variables is not None:
         json["variables"] = variables
     try:
-        response = requests.post(SERVER_URL, json=json, headers=headers)
+        response = http.post(SERVER_URL, json=json, headers=headers)
         if response.status_code == 200:
             result = response.json()
             if result.get("error"):
@@ -68,39 +68,39 @@ def callGraphQL(query, variables=None):
         return None
 
 
-def graphql_findTagbyName(name):
-    query = """
-        query {
-            allTags {
-                id
-                name
-                aliases
-            }
-        }
+def graphql_createMarkers(scene_id, markers):
     """
-    result = callGraphQL(query)
-    normalized_name = name.lower().strip()
-    for tag in result["allTags"]:
-        if tag["name"].lower() == normalized_name:
-            return tag["id"]
-        if tag.get("aliases"):
-            for alias in tag["aliases"]:
-                if alias.lower() == normalized_name:
-                    return tag["id"]
-    return None
+    Creates all markers for a scene in a single request
 
-
-def graphql_createMarker(scene_id, title, main_tag, seconds, tags=[]):
-    main_tag_id = graphql_findTagbyName(main_tag)
-    if main_tag_id is None:
-        log.warning(
-            "The 'Primary Tag' don't exist ({}), marker won't be created.".format(
-                main_tag
+    Each marker is a dict with the title, main tag name and seconds
+    """
+    # All primary tags are looked up at once in the local tag index
+    tag_ids = tag_index.lookup(
+        (marker["main_tag"] for marker in markers), call=callGraphQL, server=SERVER_URL
+    )
+    operations = []
+    for marker in markers:
+        main_tag_id = tag_ids.get(marker["main_tag"])
+        if main_tag_id is None:
+            log.warning(
+                "The 'Primary Tag' don't exist ({}), marker won't be created.".format(
+                    marker["main_tag"]
+                )
             )
-        )
-        return None
-    log.info("Creating Marker: {}".format(title))
-    query = """
+            continue
+        log.info("Creating Marker: {}".format(marker["title"]))
+        variables = {
+            "primary_tag_id": main_tag_id,
+            "scene_id": scene_id,
+            "seconds": marker["seconds"],
+            "title": marker["title"],
+            "tag_ids": marker.get("tags", []),
+        }
+        operations.append((MARKER_CREATE_QUERY, variables))
+    return callGraphQLBatch(operations, call=callGraphQL)
+
+
+MARKER_CREATE_QUERY = """
     mutation SceneMarkerCreate($title: String!, $seconds: Float!, $scene_id: ID!, $primary_tag_id: ID!, $tag_ids: [ID!] = []) {
         sceneMarkerCreate(
             input: {
@@ -136,15 +136,6 @@ def graphql_createMarker(scene_id, title, main_tag, seconds, tags=[]):
         }
     }
     """
-    variables = {
-        "primary_tag_id": main_tag_id,
-        "scene_id": scene_id,
-        "seconds": seconds,
-        "title": title,
-        "tag_ids": tags,
-    }
-    result = callGraphQL(query, variables)
-    return result
 
 
 def graphql_getMarker(scene_id):
@@ -226,6 +217,7 @@ def process_chapters(scene_id, api_json):
                     <= stash_scene_info["duration"]
                     <= api_scene_duration + MARKER_SEC_DIFF
                 ) or (api_scene_duration in [0, 1] and MARKER_DURATION_UNSURE):
+                    new_markers = []
                     for marker in markers:
                         if stash_scene_info.get("marker"):
                             if marker.get("seconds") in stash_scene_info["marker"]:
@@ -235,15 +227,17 @@ def process_chapters(scene_id, api_json):
                                     )
                                 )
                                 continue
-                        try:
-                            graphql_createMarker(
-                                scene_id,
-                                marker.get("title"),
-                                marker.get("title"),
-                                marker.get("seconds"),
-                            )
-                        except:
-                            log.error("Marker failed to create")
+                        new_markers.append(
+                            {
+                                "title": marker.get("title"),
+                                "main_tag": marker.get("title"),
+                                "seconds": marker.get("seconds"),
+                            }
+                        )
+                    try:
+                        graphql_createMarkers(scene_id, new_markers)
+                    except:
+                        log.error("Markers failed to create")
                 else:
                     log.info(
                         "The duration of this scene don't match the duration of stash scene."
@@ -255,7 +249,7 @@ def process_chapters(scene_id, api_json):
 def try_upgrade_image(image_url: str) -> str:
     # replace the resolution of the image (eg. \d+x\d+) with 3840x2160
     high_res = re.sub(r"\d+x\d+", "5760x3240", image_url)
-    if requests.head(high_res).status_code == 200:
+    if http.head(high_res, cloudflare=True).status_code == 200:
         return high_res
     return image_url
 
@@ -319,7 +313,7 @@ def callGraphQL(self, query: dict, referer: str):
             return None
 
         try:
-            response = requests.post(self.api, json=query, headers=headers)
+            response = http.post(self.api, json=query, headers=headers, cloudflare=True)
             if response.status_code == 200:
                 result = response.json()
                 if result.get("error"):
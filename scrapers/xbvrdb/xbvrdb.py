@@ -1,11 +1,15 @@
 import json
+import re
 import sys
 import sqlite3
 import os
-import requests
+import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     import py_common.graphql as graphql
+    import py_common.http as http
     import py_common.log as log
 except ModuleNotFoundError:
     print("You need to download the folder 'py_common' from the community repo! (CommunityScrapers/tree/master/scrapers/py_common)", file=sys.stderr)
@@ -15,6 +19,16 @@
 XBVR_HOST='http://192.168.0.35:9999'
 #XBVR_HOST=None
 
+# Filename -> scene index kept next to this script so that a scrape is a single
+# indexed lookup instead of a download of the whole XBVR catalogue
+INDEX_PATH=Path(__file__).parent / 'xbvr-index.sqlite'
+# Scenes per /api/scene/list request and number of requests sent in parallel
+PAGE_SIZE=500
+PARALLEL_PAGES=4
+# Scenes that were edited, deleted and re-added, or got files attached after they
+# were first indexed are only picked up by a full rescan: do that once every this
+# many seconds, so stored scenes never get older than that
+FULL_SYNC_INTERVAL=3600
 
 ''' This script uses the sqlite database from xbvr (3d porn manager) 
     Copy main.db from yout xbvr configuration and rename this to xbvr.db
@@ -40,8 +54,69 @@ def lookup_scene(id):
     res['performers']=[{"name":x[0]} for x in row]
     return res
 
+def open_index():
+    index=sqlite3.connect(INDEX_PATH)
+    index.executescript('''
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS files (filename TEXT PRIMARY KEY COLLATE NOCASE, scene_id INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS scenes (id INTEGER PRIMARY KEY, scene_id TEXT COLLATE NOCASE, data TEXT);
+        CREATE INDEX IF NOT EXISTS scenes_scene_id ON scenes (scene_id);
+    ''')
+    try:
+        index.execute('CREATE VIRTUAL TABLE IF NOT EXISTS titles USING fts5(title)')
+    except sqlite3.OperationalError:
+        # Python builds without FTS5 fall back to scanning the titles
+        index.execute('CREATE TABLE IF NOT EXISTS titles (title TEXT)')
+    return index
+
+def has_fts5(index):
+    row=index.execute("SELECT sql FROM sqlite_master WHERE name='titles'").fetchone()
+    return 'fts5' in row[0].lower()
+
+def get_meta(index,key,default=None):
+    row=index.execute('SELECT value FROM meta WHERE key=?',(key,)).fetchone()
+    return row[0] if row else default
+
+def set_meta(index,key,value):
+    index.execute('INSERT OR REPLACE INTO meta (key,value) VALUES (?,?)',(key,str(value)))
+
+def clear_index(index,source):
+    for table in ('meta','files','scenes','titles'):
+        index.execute(f'DELETE FROM {table}')
+    set_meta(index,'source',source)
+
+def sync_db_index(index):
+    # xbvr.db is a copy that gets replaced as a whole, so we only rebuild
+    # the index when the file itself changes
+    stat=os.stat('xbvr.db')
+    source=f'xbvr.db:{stat.st_mtime_ns}:{stat.st_size}'
+    if get_meta(index,'source')==source:
+        return
+    log.debug('Indexing xbvr.db')
+    with index:
+        clear_index(index,source)
+        index.executemany('INSERT OR IGNORE INTO files (filename,scene_id) VALUES (?,?)',
+                          conn.execute('SELECT filename,scene_id FROM files WHERE filename IS NOT NULL'))
+        index.executemany('INSERT OR REPLACE INTO scenes (id,scene_id) VALUES (?,?)',
+                          conn.execute('SELECT id,scene_id FROM scenes'))
+        index.executemany('INSERT INTO titles (rowid,title) VALUES (?,?)',
+                          conn.execute('SELECT id,title FROM scenes WHERE title IS NOT NULL'))
+
+def find_title(title_pattern):
+    # The pattern only contains whole words separated by wildcards: let FTS5 narrow
+    # down the candidates and have LIKE check the order of the words
+    words=re.findall(r'\w+',title_pattern)
+    if words and has_fts5(index):
+        query=' '.join(f'"{w}"*' for w in words)
+        row=index.execute('SELECT rowid FROM titles WHERE titles MATCH ? AND title LIKE ? ORDER BY rowid LIMIT 1',
+                          (query,title_pattern)).fetchone()
+    else:
+        row=index.execute('SELECT rowid FROM titles WHERE title LIKE ? ORDER BY rowid LIMIT 1',(title_pattern,)).fetchone()
+    return row[0] if row else None
+
 def find_scene_id(title):
-    c = conn.cursor()
+    # filename and scene_id use NOCASE collation so these LIKE patterns are answered from their indexes
+    c = index.cursor()
     c.execute('SELECT scene_id FROM files WHERE filename LIKE ?', (title,))
     id=c.fetchone()
     if id == None:
@@ -65,46 +140,86 @@ def find_scene_id(title):
             if 'originals' in t:
                 t.remove('originals')
             title='%'.join(t)+'%'
-        c.execute('SELECT id FROM scenes WHERE title LIKE ?',(title+'%',))
-        id=c.fetchone()
-        if id is not None:
-            return id[0]
+        return find_title(title+'%')
     else:
         return id[0]
     return None
 
-def query_api(filename):
-    request_config={"dlState":"available","cardSize":"1","lists":[],"isAvailable":True,"isAccessible":True,"isHidden":False,"isWatched":None,"releaseMonth":"","cast":[],"sites":[],"tags":[],"cuepoint":[],"attributes":[],"volume":0,"sort":"release_desc","offset":0,"limit":1}
-    response = requests.post(XBVR_HOST+'/api/scene/list', json=request_config)
-    if response.status_code == 200:
-        total_scenes = response.json()['results']
-        log.debug('total scenes %s' % (total_scenes))
-        request_config['limit'] = 500
-        request_config['offset'] = 0
-        while request_config['offset'] < total_scenes:
-            response = requests.post(XBVR_HOST+'/api/scene/list', json=request_config)
-            for s in response.json()['scenes']:
-                for f in s['file']:
-                    if f['filename'] == filename:
-
-                       result={
-                               'title':s['title'],
-                               'details':s['synopsis'],
-                               'studio':{'name':s['site']},
-                               'image':s['cover_url'],
-                               'url':s['scene_url'],
-                               'date':s['release_date_text'],
-                               'tags':[{"name":x['name']} for x in s['tags']],
-                               'performers':[{"name":x['name']} for x in s['cast']]
-                               }
-                       log.debug(result)
-                       print(json.dumps(result))
-                       exit(0)
-            request_config['offset'] = request_config['offset'] + request_config['limit']
+def api_scene_list(offset,limit):
+    request_config={"dlState":"available","cardSize":"1","lists":[],"isAvailable":True,"isAccessible":True,"isHidden":False,"isWatched":None,"releaseMonth":"","cast":[],"sites":[],"tags":[],"cuepoint":[],"attributes":[],"volume":0,"sort":"release_desc","offset":offset,"limit":limit}
+    response = http.post(XBVR_HOST+'/api/scene/list', json=request_config)
+    response.raise_for_status()
+    return response.json()
 
+def api_result(s):
+    return {
+        'title':s['title'],
+        'details':s['synopsis'],
+        'studio':{'name':s['site']},
+        'image':s['cover_url'],
+        'url':s['scene_url'],
+        'date':s['release_date_text'],
+        'tags':[{"name":x['name']} for x in s['tags']],
+        'performers':[{"name":x['name']} for x in s['cast']]
+    }
 
+def sync_api_index(index,full=False):
+    total_scenes = api_scene_list(0,1)['results']
+    log.debug('total scenes %s' % (total_scenes))
+    if get_meta(index,'source')!=XBVR_HOST:
+        full=True
+    if full:
+        # Pages are fetched before the index is touched so a failed rescan keeps the old index
+        end=total_scenes
+    else:
+        # Scenes are sorted by release_desc so new scenes show up in the first pages
+        end=total_scenes-int(get_meta(index,'total',0))
+        if end<=0:
+            return
+    log.debug(f'Fetching {end} scenes from {XBVR_HOST}')
+    with ThreadPoolExecutor(max_workers=PARALLEL_PAGES) as executor:
+        pages=list(executor.map(lambda offset: api_scene_list(offset,PAGE_SIZE)['scenes'],range(0,end,PAGE_SIZE)))
+    with index:
+        if full:
+            clear_index(index,XBVR_HOST)
+            set_meta(index,'full_sync',time.time())
+        for page in pages:
+            for s in page:
+                index.execute('INSERT OR REPLACE INTO scenes (id,scene_id,data) VALUES (?,?,?)',
+                              (s['id'],s.get('scene_id'),json.dumps(api_result(s))))
+                index.executemany('INSERT OR REPLACE INTO files (filename,scene_id) VALUES (?,?)',
+                                  [(f['filename'],s['id']) for f in s['file'] or []])
+        set_meta(index,'total',total_scenes)
 
+def lookup_api_index(index,filename):
+    row=index.execute('SELECT scenes.data FROM files JOIN scenes ON scenes.id=files.scene_id WHERE files.filename=?',
+                      (filename,)).fetchone()
+    return json.loads(row[0]) if row else None
 
+def query_api(filename):
+    index=open_index()
+    try:
+        result=lookup_api_index(index,filename)
+        if time.time()-float(get_meta(index,'full_sync',0))>FULL_SYNC_INTERVAL:
+            try:
+                sync_api_index(index,full=True)
+            except Exception as e:
+                if result is None:
+                    raise
+                log.warning(f'Failed to refresh the index from {XBVR_HOST}, using stored scene: {e}')
+            else:
+                result=lookup_api_index(index,filename)
+        elif result is None:
+            sync_api_index(index)
+            result=lookup_api_index(index,filename)
+    finally:
+        index.close()
+    if result is None:
+        log.debug(f'No scene found with filename {filename}')
+        print("{}")
+        return
+    log.debug(result)
+    print(json.dumps(result))
 
 if XBVR_HOST is not None:
     if sys.argv[1] == "query":
@@ -122,6 +237,8 @@ def query_api(filename):
     exit(1)
 
 conn = sqlite3.connect('xbvr.db',detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
+index = open_index()
+sync_db_index(index)
 
 if sys.argv[1] == "query":
     fragment = json.loads(sys.stdin.read())
@@ -134,6 +251,7 @@ def query_api(filename):
         print(json.dumps(result))
 
         conn.close()
+        index.close()
         exit(0)
     scene_id = find_scene_id(fragment['title'])
     if not scene_id:
@@ -144,6 +262,7 @@ def query_api(filename):
         result=lookup_scene(scene_id)
         print(json.dumps(result))
     conn.close()
+    index.close()
 elif sys.argv[1] == "gallery_query":
     fragment= json.loads(sys.stdin.read())
     print(json.dumps(fragment),file=sys.stderr)
@@ -157,4 +276,4 @@ def query_api(filename):
         result.pop("image",None)
         print(json.dumps(result))
     conn.close()
-    
+    index.close()